@@ -0,0 +1,108 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Relaxed manifest parsing benchmark, comparing the tolerant JSON reader
+with jsoncfg over manifests with comments and trailing commas.
+
+Manifests are taken from the file store of a work directory, or generated.
+Valid ones get comments and trailing commas added. Run from the repository
+root, e.g.
+
+    python -m benchmarks.manifest_benchmark --workdir ~/.webextaware
+"""
+
+import argparse
+import hashfs
+import json
+import jsoncfg
+import os
+import time
+import zipfile
+
+from webextaware import inventory as iv
+from webextaware import webext as we
+
+
+def get_args():
+    parser = argparse.ArgumentParser(prog="manifest_benchmark")
+    parser.add_argument("--workdir", help="work directory with cached extensions")
+    parser.add_argument("--count", help="number of manifests to generate without a work directory",
+                        type=int, default=20000)
+    return parser.parse_args()
+
+
+def cached_manifests(workdir):
+    file_db = hashfs.HashFS(os.path.join(workdir, "webext_data"), depth=4, width=1, algorithm="sha256")
+    inventory = iv.FileInventory(file_db)
+    for ext_hash in inventory:
+        try:
+            with zipfile.ZipFile(inventory.path(ext_hash)) as z:
+                content = z.read("manifest.json")
+            yield content.decode("utf-8-sig")
+        except (OSError, KeyError, zipfile.BadZipFile, UnicodeDecodeError):
+            continue
+
+
+def generated_manifests(count):
+    for n in range(count):
+        yield json.dumps({
+            "manifest_version": 2,
+            "name": "__MSG_extensionName__ %d" % n,
+            "description": "A \"quoted\" description with // slashes, /* stars */ and commas, ]",
+            "version": "1.%d" % n,
+            "default_locale": "en",
+            "icons": {"48": "icons/48.png", "96": "icons/96.png"},
+            "permissions": ["tabs", "storage", "<all_urls>", "https://*.example.com/*"],
+            "background": {"scripts": ["lib/jquery.js", "background.js"]},
+            "content_scripts": [{"matches": ["<all_urls>"], "js": ["content.js"], "run_at": "document_end"}],
+            "browser_action": {"default_icon": "icons/48.png", "default_popup": "popup.html"},
+            "applications": {"gecko": {"id": "ext%d@example.com" % n, "strict_min_version": "57.0"}}
+        }, indent=2)
+
+
+def relax(text):
+    """Adds comments and trailing commas to indented JSON"""
+    lines = []
+    for line in text.split("\n"):
+        if line.rstrip().endswith(("{", "[")):
+            line += " // opened"
+        elif line.strip() in ("}", "]", "},", "],") and len(lines) > 0 and not lines[-1].rstrip().endswith(
+                ("{", "[", "opened")):
+            lines[-1] += ","
+        lines.append(line)
+    return "/* relaxed */\n" + "\n".join(lines)
+
+
+def main():
+    args = get_args()
+    source = cached_manifests(args.workdir) if args.workdir else generated_manifests(args.count)
+    texts = []
+    for text in source:
+        try:
+            json.loads(text)
+            texts.append(relax(text))
+        except ValueError:
+            texts.append(text)
+    print("Parsing %d relaxed manifests" % len(texts))
+
+    results = {}
+    for name, parse in (("jsoncfg", jsoncfg.loads), ("tolerant", we.tolerant_json_loads)):
+        parsed = []
+        start = time.monotonic()
+        for text in texts:
+            try:
+                parsed.append(parse(text))
+            except (ValueError, jsoncfg.parser.JSONConfigParserException):
+                parsed.append(None)
+        results[name] = parsed
+        print("%-8s  %7.2fs  %5d failed" % (name, time.monotonic() - start, parsed.count(None)))
+
+    differing = sum(1 for a, b in zip(results["jsoncfg"], results["tolerant"]) if b is not None and a != b)
+    fallbacks = sum(1 for a, b in zip(results["jsoncfg"], results["tolerant"]) if a is not None and b is None)
+    print("%d differing results, %d left to the jsoncfg fallback" % (differing, fallbacks))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Metadata file load and save benchmark by codec, against the legacy format.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.metadata_benchmark --count 60000
+"""
+
+import argparse
+import bz2
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from webextaware import metadata as md
+from webextaware.fakeamo import generate_addon
+
+
+def get_args():
+    parser = argparse.ArgumentParser(prog="metadata_benchmark")
+    parser.add_argument("--count", help="number of extensions", type=int, default=60000)
+    parser.add_argument("--description", help="size of extension descriptions", type=int, default=300)
+    parser.add_argument("--locales", help="number of translations per extension", type=int, default=8)
+    parser.add_argument("--codecs", help="comma-separated codecs to try", default=",".join(md.available_codecs()))
+    return parser.parse_args()
+
+
+def generate_metadata(count, description_size, locales):
+    # Roughly what AMO records look like, with translated texts and previews
+    languages = ["en-US", "de", "fr", "es", "it", "pl", "ru", "ja", "zh-CN", "pt-BR", "nl", "uk"][:max(1, locales)]
+    data = []
+    for amo_id in range(1, count + 1):
+        addon = generate_addon(amo_id, b"%d" % amo_id, "https://addons.example.com")
+        text = ("Lorem ipsum dolor sit amet %d " % amo_id) * (description_size // 30)
+        for field in ("name", "summary", "description"):
+            addon[field] = dict((lang, "%s (%s)" % (text if field == "description" else field, lang))
+                                for lang in languages)
+        addon["previews"] = [{"id": amo_id * 10 + n, "caption": None, "image_size": [1280, 800],
+                              "image_url": "https://addons.example.com/user-media/previews/full/%d.png" % n,
+                              "thumbnail_url": "https://addons.example.com/user-media/previews/thumbs/%d.png" % n}
+                             for n in range(3)]
+        addon["categories"] = {"firefox": ["privacy-security", "tabs"]}
+        addon["tags"] = ["privacy", "tabs", "tools"]
+        addon["ratings"] = {"average": 4.5, "bayesian_average": 4.4, "count": amo_id % 100, "text_count": 3}
+        data.append(addon)
+    return data
+
+
+def measure(func):
+    """Returns the result, wall time and peak traced memory of a call"""
+    # Tracing slows things down a lot, so time a separate run
+    start = time.monotonic()
+    func()
+    elapsed = time.monotonic() - start
+    tracemalloc.start()
+    result = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def save_legacy(filename, meta):
+    # What Metadata.save used to do
+    with bz2.open(filename, "w") as f:
+        f.write(json.dumps([ext.raw() for ext in meta]).encode("utf-8"))
+
+
+def main():
+    args = get_args()
+    print("Generating %d extensions" % args.count)
+    meta = md.Metadata(data=generate_metadata(args.count, args.description, args.locales))
+    work_dir = tempfile.mkdtemp(prefix="webextaware_bench_")
+    try:
+        runs = [("legacy", os.path.join(work_dir, md.LEGACY_METADATA_FILE), lambda f: save_legacy(f, meta))]
+        for codec in args.codecs.split(","):
+            filename = os.path.join(work_dir, "amo_metadata.jsonl" + md.METADATA_CODECS[codec])
+            runs.append((codec, filename, lambda f: md.Metadata(filename=f, data=meta.raw_data()).save()))
+
+        print("%-8s  %8s  %8s  %10s  %10s  %10s" % ("codec", "size", "save", "save peak", "load", "load peak"))
+        for name, filename, save in runs:
+            _, save_time, save_peak = measure(lambda: save(filename))
+            loaded, load_time, load_peak = measure(lambda: md.Metadata(filename=filename))
+            assert len(loaded) == len(meta)
+            del loaded
+            print("%-8s  %6.1fMB  %7.2fs  %8.1fMB  %9.2fs  %8.1fMB"
+                  % (name, os.path.getsize(filename) / 1e6, save_time, save_peak / 1e6, load_time, load_peak / 1e6))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
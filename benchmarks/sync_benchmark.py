@@ -0,0 +1,115 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+End-to-end sync throughput benchmark against a local AMO stand-in.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.sync_benchmark --count 5000 --latency 0.05 --concurrency 4,8,16,32
+"""
+
+import argparse
+import hashfs
+import logging
+import math
+import shutil
+import tempfile
+import time
+
+from webextaware import amo
+from webextaware import metadata as md
+from webextaware.fakeamo import FakeAMO
+
+
+def get_args():
+    parser = argparse.ArgumentParser(prog="sync_benchmark")
+    parser.add_argument("--count", help="number of extensions in the corpus", type=int, default=5000)
+    parser.add_argument("--files", help="number of extensions to download, 0 for all", type=int, default=1000)
+    parser.add_argument("--latency", help="server latency in seconds", type=float, default=0.05)
+    parser.add_argument("--error-rate", help="share of requests failing with 503", type=float, default=0.0)
+    parser.add_argument("--redirects", help="number of redirects per download", type=int, default=0)
+    parser.add_argument("--max-results", help="search result window", type=int, default=30000)
+    parser.add_argument("--xpi-padding", help="extra bytes per extension file", type=int, default=0)
+    parser.add_argument("--concurrency", help="comma-separated maximum concurrent requests to try",
+                        default="4,8,16,32")
+    parser.add_argument("-d", "--debug", help="enable debug logging", action="store_true", default=False)
+    return parser.parse_args()
+
+
+def reset(server):
+    with server.lock:
+        server.requests = 0
+        server.pages = 0
+        server.bytes_sent = 0
+
+
+def bench_metadata(server):
+    reset(server)
+    start = time.monotonic()
+    metadata = amo.download_metadata()
+    elapsed = time.monotonic() - start
+    if metadata is None:
+        return None
+    return {
+        "phase": "metadata",
+        "time": elapsed,
+        "requests": server.requests,
+        "items": len(metadata),
+        "rate": server.pages / elapsed,
+        "unit": "pages/s",
+        "mbps": 0.0
+    }
+
+
+def bench_files(server, corpus):
+    reset(server)
+    work_dir = tempfile.mkdtemp(prefix="webextaware_bench_")
+    try:
+        file_db = hashfs.HashFS(work_dir + "/webext_data", depth=4, width=1, algorithm="sha256")
+        start = time.monotonic()
+        amo.update_files(md.Metadata(data=corpus), file_db)
+        elapsed = time.monotonic() - start
+        stored = len(file_db)
+    finally:
+        shutil.rmtree(work_dir)
+    return {
+        "phase": "files",
+        "time": elapsed,
+        "requests": server.requests,
+        "items": stored,
+        "rate": stored / elapsed,
+        "unit": "files/s",
+        "mbps": server.bytes_sent / elapsed / 1e6
+    }
+
+
+def main():
+    args = get_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.CRITICAL)
+    concurrency = [int(c) for c in args.concurrency.split(",")]
+
+    print("Generating %d extensions" % args.count)
+    with FakeAMO(count=args.count, latency=args.latency, error_rate=args.error_rate, redirects=args.redirects,
+                 max_results=args.max_results, xpi_padding=args.xpi_padding) as server:
+        amo.amo_server = server.url
+        corpus = server.corpus[:args.files or len(server.corpus)]
+        print("Sequential estimate: %.1fs for metadata, %.1fs for files"
+              % (math.ceil(args.count / server.max_page_size) * args.latency,
+                 len(corpus) * (args.redirects + 1) * args.latency))
+        print("%11s  %-8s  %8s  %8s  %8s  %14s  %8s"
+              % ("concurrency", "phase", "time", "requests", "items", "rate", "MB/s"))
+        for max_concurrent in concurrency:
+            amo.MAX_CONCURRENT_REQUESTS = max_concurrent
+            for result in (bench_metadata(server), bench_files(server, corpus)):
+                if result is None:
+                    print("%11d  incomplete" % max_concurrent)
+                    continue
+                print("%11d  %-8s  %7.2fs  %8d  %8d  %6.1f %-7s  %8.2f"
+                      % (max_concurrent, result["phase"], result["time"], result["requests"], result["items"],
+                         result["rate"], result["unit"], result["mbps"]))
+
+
+if __name__ == "__main__":
+    main()
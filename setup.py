@@ -8,16 +8,13 @@ PACKAGE_NAME = "webextaware"
 PACKAGE_VERSION = "1.2.5"
 
 INSTALL_REQUIRES = [
+    "aiohttp",
     "coloredlogs",
-    "gevent",
-    "grequests",
     "hashfs",
     "ipython",
     "json-cfg",
-    "requests",
     "pynpm",
-    "python-magic",
-    "urllib3"
+    "python-magic"
 ]
 
 TESTS_REQUIRE = [
@@ -68,7 +65,7 @@ setup(
     use_2to3=False,
     install_requires=INSTALL_REQUIRES,
     tests_require=TESTS_REQUIRE,
-    extras_require={"dev": DEV_REQUIRES},  # For `pip install -e .[dev]`
+    extras_require={"dev": DEV_REQUIRES, "zstd": ["zstandard"]},  # For `pip install -e .[dev]`
     entry_points={
         "console_scripts": [
             "webextaware = webextaware.main:main"
@@ -2,10 +2,24 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import asyncio
+import errno
+import hashfs
+import os
+import pytest
+import time
+import tracemalloc
+
+from webextaware import amo
+from webextaware import httpcache as hc
+from webextaware import journal as dj
+from webextaware import metadata as md
+from webextaware.fakeamo import FakeAMO
+
 
 def test_amo_metadata_downloader(raw_meta):
     """AMO metadata downloader"""
-    # Operates on data pre-downloaded by tests.__init__.setup_package()
+    # Operates on data pre-downloaded from the session-wide AMO stand-in
     assert type(raw_meta) is list and type(raw_meta[0]) is dict, "delivers expected format"
     assert len(raw_meta) == 100, "delivers expected number of extensions"
     assert "id" in raw_meta[0] and "current_version" in raw_meta[0] and "file" in raw_meta[0]["current_version"], \
@@ -15,7 +29,7 @@ def test_amo_metadata_downloader(raw_meta):
 
 def test_amo_extension_downloader(raw_meta, ext_db):
     """AMO extension downloader"""
-    # Operates on data pre-downloaded by tests.__init__.setup_package()
+    # Operates on data pre-downloaded from the session-wide AMO stand-in
 
     # Download AMO pages until they contain at least five web extension files
     all_extensions = set()
@@ -33,3 +47,285 @@ def test_amo_extension_downloader(raw_meta, ext_db):
     assert len(downloaded_extensions) > 10, "extensions are downloaded"
     assert all_extensions >= downloaded_extensions, "only extensions from metadata are downloaded"
     assert len(downloaded_extensions) > 0.5 * len(all_extensions), "at least 50% of extensions are downloaded"
+
+
+def test_amo_metadata_crawl(fake_amo):
+    """AMO metadata crawl streams result pages"""
+    crawl = amo.MetadataCrawl()
+    pages = list(crawl)
+    assert crawl.complete, "crawl completes"
+    assert len(pages) == 3 and all(type(p) is list for p in pages), "yields one list per result page"
+    amo_ids = [ext["id"] for page in pages for ext in page]
+    assert sorted(amo_ids) == sorted(ext["id"] for ext in fake_amo.corpus), "yields every extension once"
+
+    assert len(amo.download_metadata(max_ext=70)) == 70, "can limit number of extensions"
+
+
+def test_amo_metadata_crawl_is_concurrent(monkeypatch):
+    """AMO metadata crawl fetches pages concurrently"""
+    with FakeAMO(count=2400, latency=0.05) as server:
+        monkeypatch.setattr(amo, "amo_server", server.url)
+        start = time.time()
+        metadata = amo.download_metadata()
+        elapsed = time.time() - start
+    assert len(metadata) == 2400, "delivers all extensions"
+    assert server.requests == 48, "requests each page once"
+    assert elapsed < 0.5 * server.requests * server.latency, "is faster than sequential download"
+
+
+def test_amo_metadata_crawl_partitions(monkeypatch):
+    """AMO metadata crawl partitions queries that exceed the result window"""
+    with FakeAMO(count=2000, latency=0.05, max_results=300) as server:
+        monkeypatch.setattr(amo, "amo_server", server.url)
+        start = time.time()
+        crawl = amo.MetadataCrawl()
+        metadata = [ext for results in crawl for ext in results]
+        elapsed = time.time() - start
+        truncated = amo.download_metadata(max_pages=10)
+    assert crawl.complete, "crawl completes"
+    assert sorted(ext["id"] for ext in metadata) == list(range(1, 2001)), "yields every extension once"
+    assert elapsed < 0.5 * server.requests * server.latency, "crawls partitions concurrently"
+    assert len(truncated) == 300, "does not partition limited crawls"
+
+
+def test_amo_split_users_range():
+    """User count ranges are split until they can't be"""
+    assert amo.split_users_range(0, None) == 10, "splits open ranges by decades"
+    assert amo.split_users_range(10, None) == 100, "splits open ranges by decades"
+    assert amo.split_users_range(100, 10000) == 1000, "splits bounded ranges at their geometric mean"
+    assert amo.split_users_range(0, 3) == 1, "splits small ranges"
+    assert amo.split_users_range(5, 6) is None, "can't split single user counts"
+
+
+def test_amo_find_delisted(fake_amo, monkeypatch):
+    """AMO delisting check"""
+    meta = md.Metadata(data=fake_amo.corpus)
+    for amo_id in (1, 50, 51, 120):
+        fake_amo.delist(amo_id)
+    assert amo.find_delisted(meta, len(fake_amo.corpus)) == {1, 50, 51, 120}, "finds delisted extensions by GUID"
+    # Make GUID lookups expensive enough to rather bisect
+    monkeypatch.setattr(amo, "RECONCILE_BATCH_SIZE", 1)
+    requests_before = fake_amo.requests
+    assert amo.find_delisted(meta, len(fake_amo.corpus)) == {1, 50, 51, 120}, "finds delisted extensions by bisection"
+    assert fake_amo.requests - requests_before < 30, "needs far fewer requests than there are extensions"
+    monkeypatch.setattr(amo, "RESULT_WINDOW", 60)
+    assert amo.find_delisted(meta, len(fake_amo.corpus)) == {1, 50, 51, 120}, \
+        "checks extensions beyond the result window by GUID"
+    fake_amo.add(121)
+    assert amo.find_delisted(meta, len(fake_amo.corpus)) is None, "detects unexpected listing changes"
+
+
+def test_amo_adaptive_limiter():
+    """Adaptive request limiter"""
+    limiter = amo.AdaptiveLimiter(initial=10, minimum=2, maximum=12)
+
+    async def concurrently(latency, statuses):
+        for _ in statuses:
+            await limiter.__aenter__()
+        for status in statuses:
+            limiter.record(latency, status)
+            await limiter.__aexit__(None, None, None)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(concurrently(0.1, [200] * 10))
+        assert limiter.limit == 11, "grows after a round of fast responses"
+        loop.run_until_complete(concurrently(0.1, [503]))
+        assert limiter.limit == 11, "leaves occasional server errors to the retry scheduler"
+        loop.run_until_complete(concurrently(0.1, [503] * 11))
+        assert limiter.limit == 5.5, "halves when most requests of a round fail"
+        for _ in range(100):
+            limiter.record(0.1, 200)
+        assert limiter.limit == 12, "growth is capped"
+        loop.run_until_complete(concurrently(0.1, [429] * 12))
+        assert limiter.limit == 6, "halves once for requests that were asked to slow down together"
+        loop.run_until_complete(concurrently(0.1, [429]))
+        assert limiter.limit == 3, "halves again on later 429s"
+    finally:
+        loop.close()
+    for _ in range(100):
+        limiter.record(0.1, 200)
+    for _ in range(100):
+        limiter.record(1.0, 200)
+    assert limiter.limit < 12, "shrinks when latency climbs"
+    for _ in range(20):
+        limiter.record(None, 429)
+    assert limiter.limit == 2, "never drops below minimum"
+
+
+def test_amo_crawl_gives_up(monkeypatch):
+    """AMO metadata crawl gives up on persistent server errors"""
+    monkeypatch.setattr(amo, "BACKOFF_BASE", 0.001)
+    with FakeAMO(count=10, error_rate=1.0) as server:
+        monkeypatch.setattr(amo, "amo_server", server.url)
+        assert amo.download_metadata() is None, "reports incomplete crawl"
+    assert server.requests == amo.MAX_ATTEMPTS, "retries a bounded number of times"
+
+
+def test_amo_update_files(fake_amo, tmpdir):
+    """AMO extension downloader verifies and stores files"""
+    edb = hashfs.HashFS(str(tmpdir.join("webext_data")), depth=4, width=1, algorithm="sha256")
+    meta = md.Metadata(data=fake_amo.corpus)
+    fake_amo.corrupt = {1, 2}
+    amo.update_files(meta, edb)
+
+    stored = set(edb.get(f).id for f in edb)
+    expected = set(h for ext in meta for h in ext.file_hashes())
+    assert len(stored) == len(expected) - 2, "stores all files that match their hash"
+    assert stored < expected, "stores files under their expected hash"
+    assert len(os.listdir(amo.get_incoming_dir(edb))) == 0, "leaves no partial downloads behind"
+
+    fake_amo.corrupt = set()
+    amo.update_files(meta, edb)
+    assert len(edb) == len(expected), "fetches missing files on the next run"
+
+
+def test_amo_update_files_follows_redirects(monkeypatch, tmpdir):
+    """AMO extension downloader follows redirects"""
+    with FakeAMO(count=5, redirects=2) as server:
+        monkeypatch.setattr(amo, "amo_server", server.url)
+        edb = hashfs.HashFS(str(tmpdir.join("webext_data")), depth=4, width=1, algorithm="sha256")
+        amo.update_files(md.Metadata(data=server.corpus), edb)
+    assert len(edb) == 5, "downloads all files"
+    assert server.requests == 15, "goes through every redirect"
+
+
+def test_amo_update_files_raises(fake_amo, monkeypatch, tmpdir):
+    """AMO extension downloader does not swallow unexpected errors"""
+    edb = hashfs.HashFS(str(tmpdir.join("webext_data")), depth=4, width=1, algorithm="sha256")
+    meta = md.Metadata(data=fake_amo.corpus[:5])
+
+    def disk_full(*args):
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+    monkeypatch.setattr(amo, "store_file", disk_full)
+    with pytest.raises(OSError):
+        amo.update_files(meta, edb)
+
+
+def test_amo_update_files_streams(monkeypatch, tmpdir):
+    """AMO extension downloader does not hold whole files in memory"""
+    with FakeAMO(count=4, xpi_padding=8 << 20) as server:
+        monkeypatch.setattr(amo, "amo_server", server.url)
+        edb = hashfs.HashFS(str(tmpdir.join("webext_data")), depth=4, width=1, algorithm="sha256")
+        meta = md.Metadata(data=server.corpus)
+        tracemalloc.start()
+        try:
+            amo.update_files(meta, edb)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    assert len(edb) == 4, "downloads all files"
+    assert peak < 4 << 20, "peak memory stays well below the file size"
+
+
+def test_amo_retry_scheduler(monkeypatch):
+    """Retry scheduler"""
+    monkeypatch.setattr(amo, "BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(amo, "BREAKER_THRESHOLD", 3)
+    monkeypatch.setattr(amo, "BREAKER_COOLDOWN", 0.05)
+
+    async def run(scheduler, outcomes):
+        log = []
+        while True:
+            item = await scheduler.get()
+            if item is None:
+                return log
+            log.append((item, time.monotonic()))
+            outcome = outcomes[item].pop(0)
+            if outcome == "ok":
+                scheduler.success(item)
+            elif outcome == "gone":
+                scheduler.give_up(item)
+            else:
+                scheduler.failure(item, 503, retry_after=outcome)
+
+    scheduler = amo.RetryScheduler(["a", "b"], max_attempts=3)
+    outcomes = {"a": [None, None, None], "b": [0.2, "ok"]}
+    log = asyncio.run(run(scheduler, outcomes))
+    assert [item for item, _ in log].count("a") == 3, "caps attempts per item"
+    assert scheduler.attempts == {"a": 3, "b": 1}, "counts failed attempts per item"
+    assert scheduler.errors == {503: 4}, "counts errors by status"
+    b_times = [t for item, t in log if item == "b"]
+    assert b_times[1] - b_times[0] >= 0.2, "honors Retry-After"
+    a_times = [t for item, t in log if item == "a"]
+    assert a_times[2] - a_times[1] > a_times[1] - a_times[0] - 0.005, "backs off exponentially"
+
+    scheduler = amo.RetryScheduler(["a", "b", "c", "d"], max_attempts=10)
+    outcomes = {"a": [None, "ok"], "b": [None, "ok"], "c": [None, "ok"], "d": [None, "ok"]}
+    log = asyncio.run(run(scheduler, outcomes))
+    assert len(log) == 8, "retries until success"
+    assert log[3][1] - log[2][1] >= 0.05, "breaker pauses requests after consecutive failures"
+    assert log[4][1] - log[3][1] >= 0.1, "breaker pauses longer when the probe fails"
+    assert log[7][1] - log[4][1] < 0.05, "breaker closes when the probe succeeds"
+
+
+def test_amo_retries_under_error_load(monkeypatch, tmpdir):
+    """AMO client recovers from server errors"""
+    monkeypatch.setattr(amo, "BACKOFF_BASE", 0.01)
+    with FakeAMO(count=200, error_rate=0.3, retry_after=0) as server:
+        monkeypatch.setattr(amo, "amo_server", server.url)
+        metadata = amo.download_metadata()
+        assert metadata is not None and len(metadata) == 200, "retrieves all metadata"
+        edb = hashfs.HashFS(str(tmpdir.join("webext_data")), depth=4, width=1, algorithm="sha256")
+        amo.update_files(md.Metadata(data=metadata), edb)
+        assert len(edb) == 200, "retrieves all files"
+
+
+def test_amo_crawl_revalidates_cached_pages(monkeypatch):
+    """AMO metadata crawl revalidates cached result pages"""
+    with FakeAMO(count=500) as fake_amo:
+        monkeypatch.setattr(amo, "amo_server", fake_amo.url)
+        cache = hc.ResponseCache()
+        metadata = amo.download_metadata(cache=cache)
+        assert len(metadata) == 500 and fake_amo.pages == 10, "downloads all pages"
+        assert len(cache) == 10, "caches all pages"
+
+        cached_metadata = amo.download_metadata(cache=cache)
+        assert sorted(e["id"] for e in cached_metadata) == sorted(e["id"] for e in metadata), \
+            "gets the same metadata from the cache"
+        assert fake_amo.pages == 10 and fake_amo.not_modified == 10, "revalidates unchanged pages"
+
+        fake_amo.update(5)
+        metadata = amo.download_metadata(cache=cache)
+        assert [e for e in metadata if e["id"] == 5][0]["current_version"]["version"] == "2.0", "updates changed pages"
+        assert fake_amo.pages == 11, "downloads changed pages only"
+
+
+def test_amo_plan_downloads():
+    """Download planning orders by priority and sticks to budgets"""
+    info = {}
+    files = []
+    for n in range(10):
+        ext_hash = "%064x" % n
+        size = 10 * amo.LARGE_FILE_SIZE if n < 3 else 100 * (10 - n)
+        info[ext_hash] = ({"average_daily_users": n, "last_updated": "2020-01-%02d" % (10 - n)}, {"size": size})
+        files.append(("https://example.com/%d.xpi" % n, ext_hash))
+
+    def planned(**kwargs):
+        return [int(h, 16) for _, h in amo.plan_downloads(files, info, **kwargs)]
+
+    assert planned() == [0, 3, 4, 5, 1, 6, 7, 8, 2, 9], "lets large files take a share of the queue"
+    assert planned(priority="users") == [9, 8, 7, 6, 5, 4, 3, 2, 1, 0], "orders by users"
+    assert planned(priority="updated", max_files=5) == [0, 3, 4, 1, 2], "orders by updates and limits number"
+    assert planned(priority="size") == [9, 8, 7, 6, 5, 4, 3, 0, 1, 2], "orders by size"
+    assert planned(max_bytes=1000) == [3, 7], "fills the byte budget"
+    with pytest.raises(ValueError):
+        planned(priority="bogus")
+
+
+def test_amo_update_files_budget(fake_amo, tmpdir):
+    """Extension downloader sticks to budgets and resumes later"""
+    edb = hashfs.HashFS(str(tmpdir.join("hashfs")), depth=4, width=1, algorithm="sha256")
+    meta = md.Metadata(data=fake_amo.corpus)
+    journal = dj.DownloadJournal()
+    amo.update_files(meta, edb, journal, priority="users", max_files=10)
+    top = sorted(fake_amo.corpus, key=lambda e: e["average_daily_users"], reverse=True)[:10]
+    assert sorted(f.id for f in map(edb.get, edb)) \
+        == sorted(e["current_version"]["file"]["hash"][7:] for e in top), "downloads the most used first"
+    assert len(journal.pending()) == len(fake_amo.corpus) - 10, "leaves the rest for later"
+
+    amo.update_files(meta, edb, journal, max_time=0)
+    assert len(edb) == 10, "stops downloading after the time budget"
+    amo.update_files(meta, edb, journal)
+    assert len(edb) == len(fake_amo.corpus), "downloads the rest later"
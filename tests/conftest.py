@@ -7,12 +7,22 @@ import pytest
 
 from webextaware import amo
 from webextaware import metadata as md
+from webextaware.fakeamo import FakeAMO
 
 
 @pytest.fixture(scope="session")
-def raw_meta():
+def amo_stand_in():
+    """Session-wide local AMO stand-in"""
+    with FakeAMO(count=150) as server:
+        yield server
+
+
+@pytest.fixture(scope="session")
+def raw_meta(amo_stand_in):
     """Raw AMO metadata session fixture"""
-    return amo.download_metadata(max_pages=2)
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(amo, "amo_server", amo_stand_in.url)
+        return amo.download_metadata(max_pages=2)
 
 
 @pytest.fixture(scope="session")
@@ -27,3 +37,11 @@ def ext_db(raw_meta, hfs_tmp):
     meta = md.Metadata(data=raw_meta)
     amo.update_files(meta, edb)
     return edb
+
+
+@pytest.fixture
+def fake_amo(monkeypatch):
+    """Local AMO stand-in serving a small generated corpus"""
+    with FakeAMO(count=120) as server:
+        monkeypatch.setattr(amo, "amo_server", server.url)
+        yield server
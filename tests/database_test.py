@@ -0,0 +1,155 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+
+from webextaware import amo
+from webextaware import database as db
+from webextaware import hashindex as hi
+from webextaware import metadata as md
+from webextaware import nameindex as ni
+from webextaware import permindex as pi
+from webextaware import snapshots as sn
+
+from . import ArgsMock
+
+
+def test_database_incremental_sync(fake_amo, tmpdir):
+    """Incremental metadata sync"""
+    args = ArgsMock(workdir=str(tmpdir), incremental=True)
+    database = db.Database(args)
+    database.sync()
+    assert len(database.meta) == len(fake_amo.corpus), "falls back to full sync on first run"
+    assert md.load_sync_state(args)["high_water_mark"] == database.meta.last_updated(), \
+        "records high-water mark"
+
+    fake_amo.update(5)
+    fake_amo.add(500)
+    fake_amo.delist(7)
+    requests_before = fake_amo.requests
+    database = db.Database(args)
+    database.sync()
+    meta = md.Metadata(filename=md.get_metadata_file(args))
+    assert len(meta) == len(fake_amo.corpus), "syncs changes"
+    assert meta.get_by_id(5)["current_version"]["version"] == "2.0", "updates changed extensions"
+    assert meta.is_known_id(500), "adds new extensions"
+    assert not meta.is_known_id(7), "drops delisted extensions"
+    assert len(md.open_metadata(args)) == len(meta) and not md.open_metadata(args).is_known_id(7), \
+        "updates the metadata database"
+    assert database.file_db.get(fake_amo.get(500)["current_version"]["file"]["hash"][7:]) is not None, \
+        "downloads new extensions"
+    diff = sn.SnapshotStore(sn.get_snapshot_dir(args)).diff(-2, -1)
+    assert (diff["added"], diff["removed"], diff["bumped"][0]["id"]) == ([500], [7], 5), "snapshots changes"
+    metadata_requests = fake_amo.requests - requests_before - 2
+    assert metadata_requests < 6, "only requests few metadata pages"
+
+    database.sync()
+    assert len(database.meta) == len(fake_amo.corpus), "syncs again without changes"
+
+
+def test_database_failed_incremental_sync(fake_amo, monkeypatch, tmpdir):
+    """Failed incremental metadata sync keeps cached metadata"""
+    args = ArgsMock(workdir=str(tmpdir), incremental=True)
+    database = db.Database(args)
+    database.sync()
+
+    def find_delisted(metadata, count, stats=None):
+        # AMO goes down half-way through the update
+        fake_amo.error_rate = 1.0
+        return None
+
+    monkeypatch.setattr(amo, "find_delisted", find_delisted)
+    monkeypatch.setattr(amo, "BACKOFF_BASE", 0.001)
+    fake_amo.update(5)
+    fake_amo.delist(7)
+    database = db.Database(args)
+    database.sync()
+    assert len(database.meta) == len(fake_amo.corpus) + 1, "keeps cached extensions"
+    assert database.meta.get_by_id(5)["current_version"]["version"] == "1.0", "does not apply partial updates"
+
+
+def test_database_match(fake_amo, tmpdir):
+    """Selecting extensions by ID, hash and name"""
+    args = ArgsMock(workdir=str(tmpdir))
+    database = db.Database(args)
+    database.sync()
+    ext = database.meta.get_by_id(12)
+    assert database.match(12) == {12: set(ext.file_hashes())}, "selects by AMO ID"
+    assert database.match(next(ext.file_hashes())) == {12: set(ext.file_hashes())}, "selects by hash"
+    assert sorted(database.match("fake add-on 1[0-9]$")) == list(range(10, 20)), "selects by name"
+    assert database.match("(") == {}, "ignores invalid selectors"
+    assert database.hashes.amo_id(next(ext.file_hashes())) == 12, "maps hashes to AMO IDs"
+    assert os.path.isfile(hi.get_hash_index_file(args)), "persists the hash index"
+
+    database = db.Database(args, metadata=md.open_metadata(args))
+    assert sorted(database.match(["Fake Add-on 12$", "fake add-on 4"])) == [4, 12] + list(range(40, 50)), \
+        "selects by name from the persisted name index"
+    assert os.path.isfile(ni.get_name_index_file(args)), "persists the name index"
+
+
+def test_database_match_permissions(fake_amo, tmpdir):
+    """Selecting extensions by permission"""
+    args = ArgsMock(workdir=str(tmpdir))
+    database = db.Database(args)
+    database.sync()
+    assert os.path.isfile(pi.get_permission_index_file(args)), "builds the permission index on sync"
+    everything = database.match("all")
+    assert database.match("perm:tabs") == everything, "selects by API permission"
+    assert database.match("host:<all_urls> & perm:tabs") == everything, "intersects permissions"
+    assert database.match("perm:tabs - host:<all_urls>") == {}, "excludes permissions"
+    assert database.match("perm:nativeMessaging") == {}, "selects nothing for unused permissions"
+
+
+def test_database_orphans(fake_amo, tmpdir):
+    """Orphans are found through the file store inventory"""
+    args = ArgsMock(workdir=str(tmpdir))
+    database = db.Database(args)
+    database.sync()
+    assert database.match("orphans") == {}, "has no orphans after a sync"
+    assert len(database.inventory) == len(fake_amo.corpus), "adds downloads to the inventory"
+
+    orphan = fake_amo.get(7)["current_version"]["file"]["hash"][7:]
+    fake_amo.delist(7)
+    database.sync()
+    assert database.match("orphans") == {None: {orphan}}, "selects files dropped from the metadata"
+    assert db.Database(args).match(orphan) == {None: {orphan}}, "selects orphans by hash"
+
+
+def test_database_resolve(fake_amo, tmpdir):
+    """Resolving hashes to file store paths"""
+    args = ArgsMock(workdir=str(tmpdir))
+    database = db.Database(args)
+    database.sync()
+    ext_id = next(database.meta.get_by_id(3).file_hashes())
+    path = database.file_db.idpath(ext_id, ".zip")
+    assert database.resolve(ext_id) == path, "resolves stored hashes to their HashFS path"
+    assert list(database.select(3)) == [(3, ext_id, path)], "selects the paths along with the hashes"
+
+    assert database.match("file:manifest.json") == database.match("all"), "selects by zip member"
+    assert database.match("file:*.wasm") == {}, "selects nothing for missing members"
+    assert database.manifest(ext_id)["name"] == database.meta.get_by_id(3).name, "caches manifests"
+    with next(database.iter_ext(3))[2] as ext:
+        assert ext.unzip().startswith(str(tmpdir.join("webext_unzipped"))), "unzips to the unzip cache"
+
+    database.inventory.remove(ext_id)
+    assert database.resolve(ext_id) == path, "finds files missing from the inventory"
+    assert ext_id in database.inventory, "adds files found to the inventory"
+    os.unlink(path)
+    assert database.resolve(ext_id) is None, "resolves missing files to None"
+    assert ext_id not in database.inventory, "drops missing files from the inventory"
+    assert database.manifest("0" * 64) is None, "has no manifests for missing files"
+    assert database.resolve("0" * 64) is None, "resolves unknown hashes to None"
+
+
+def test_database_pruned_files(fake_amo, tmpdir):
+    """Files pruned from the file store after a sync are cache misses"""
+    args = ArgsMock(workdir=str(tmpdir))
+    db.Database(args).sync()
+    database = db.Database(args, metadata=md.open_metadata(args))
+    ext_id = next(database.meta.get_by_id(3).file_hashes())
+    os.unlink(database.file_db.idpath(ext_id, ".zip"))
+    assert list(database.select(3)) == [(3, ext_id, None)], "selects pruned files without a path"
+    assert list(database.iter_ext(3)) == [], "skips pruned files"
+    assert ext_id not in db.Database(args).inventory, "drops pruned files from the persisted inventory"
+    assert len(list(database.iter_ext("all"))) == len(fake_amo.corpus) - 1, "finds the remaining files"
@@ -0,0 +1,29 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from webextaware import database as db
+from webextaware import metadata as md
+from webextaware.modes import grep as gm
+
+from . import ArgsMock
+
+
+def test_grep_mode_metadata_db(fake_amo, tmpdir, capsys):
+    """Grep mode on a synced work directory with a metadata database"""
+    db.Database(ArgsMock(workdir=str(tmpdir))).sync()
+    capsys.readouterr()
+    args = ArgsMock(workdir=str(tmpdir), regexp="hello from 1[0-9]\\b", selectors=["all"], grepargs=["-o"])
+    mode = gm.GrepMode(args)
+    assert mode.setup(), "sets up grep mode"
+    assert type(mode.meta) is md.MetadataDB, "opens the metadata database"
+    assert mode.run() == 0, "greps all extensions"
+    lines = capsys.readouterr().out.splitlines()
+    assert sorted(line.split(":")[1] for line in lines) == ["hello from %d" % n for n in range(10, 20)], \
+        "finds matches in all selected extensions"
+
+    args = ArgsMock(workdir=str(tmpdir), regexp="console", selectors=["fake add-on 4$", "3"], grepargs=["-l"])
+    mode = gm.GrepMode(args)
+    assert mode.setup(), "sets up grep mode"
+    assert mode.run() == 0, "greps selected extensions"
+    assert len(capsys.readouterr().out.splitlines()) == 2, "greps extensions selected through the metadata database"
@@ -0,0 +1,38 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import pickle
+
+from webextaware import hashindex as hi
+from webextaware import metadata as md
+
+
+def test_hash_index(raw_meta, tmpdir):
+    """Binary hash index"""
+    meta = md.Metadata(data=raw_meta)
+    hashes = set(h for ext in meta for h in ext.file_hashes())
+
+    index_file = str(tmpdir.join("hashes.idx"))
+    index = hi.HashIndex.create(index_file, meta, ["metadata", 1, 2])
+    assert len(index) == len(hashes), "indexes all hashes"
+    assert index.stamp == ["metadata", 1, 2], "keeps the metadata stamp"
+    for ext in meta:
+        for h in ext.file_hashes():
+            assert h in index, "knows hashes"
+            assert index.amo_id(h) == ext.id, "maps hashes to AMO IDs"
+    for bogus in ("0" * 64, "f" * 64, "z" * 64, "abc", None, 1234):
+        assert bogus not in index and index.amo_id(bogus) is None, "rejects unknown hashes"
+
+    some_hash = next(iter(hashes))
+    copy = pickle.loads(pickle.dumps(index))
+    assert copy.amo_id(some_hash) == index.amo_id(some_hash), "maps the index file again when unpickled"
+    in_memory = hi.HashIndex(hi.HashIndex.build(meta, None))
+    assert pickle.loads(pickle.dumps(in_memory)).amo_id(some_hash) == index.amo_id(some_hash), \
+        "pickles indexes in memory"
+    index.close()
+
+    with open(index_file, "wb") as f:
+        f.write(b"garbage")
+    assert hi.HashIndex.open(index_file) is None, "ignores invalid index files"
+    assert hi.HashIndex.open(str(tmpdir.join("missing.idx"))) is None, "ignores missing index files"
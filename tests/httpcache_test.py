@@ -0,0 +1,42 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import os
+import zlib
+
+from webextaware import httpcache as hc
+
+
+def body(n, size=64):
+    return json.dumps({"n": n, "padding": os.urandom(size).hex()}).encode()
+
+
+def test_response_cache(tmpdir):
+    """AMO response cache keeps validators and documents within its size bound"""
+    cache_file = str(tmpdir.join("cache.sqlite"))
+    bodies = [body(n) for n in range(6)]
+    size = len(zlib.compress(bodies[1]))
+    cache = hc.ResponseCache(cache_file, max_size=3 * size)
+    cache.put("https://example.com/1", bodies[1], etag="\"1\"")
+    cache.put("https://example.com/2", bodies[2], last_modified="Wed, 01 Jan 2020 00:00:00 GMT")
+    cache.put("https://example.com/3", bodies[3])
+    assert "https://example.com/3" not in cache, "does not cache responses without validators"
+    assert cache.validators("https://example.com/1") == {"If-None-Match": "\"1\""}, "revalidates by ETag"
+    assert cache.validators("https://example.com/2") == {"If-Modified-Since": "Wed, 01 Jan 2020 00:00:00 GMT"}, \
+        "revalidates by modification time"
+    assert cache.validators("https://example.com/3") == {}, "requests unknown documents unconditionally"
+
+    assert cache.get("https://example.com/1") == json.loads(bodies[1]), "returns cached documents"
+    cache.put("https://example.com/4", body(4, 128), etag="\"4\"")
+    assert "https://example.com/2" not in cache, "evicts least recently used documents"
+    assert "https://example.com/1" in cache, "keeps recently used documents"
+    assert cache.size <= 3 * size, "stays within its size bound"
+    cache.put("https://example.com/4", bodies[5], etag="\"5\"")
+    assert cache.get("https://example.com/4") == json.loads(bodies[5]) and len(cache) == 2, "replaces documents"
+    cache.save()
+
+    cache = hc.ResponseCache(cache_file, max_size=len(zlib.compress(bodies[5])))
+    assert len(cache) == 1 and cache.get("https://example.com/4") == json.loads(bodies[5]), \
+        "loads saved documents within its size bound"
@@ -0,0 +1,35 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashfs
+import os
+
+from webextaware import inventory as iv
+
+
+def test_file_inventory(ext_db, tmpdir):
+    """File store inventory"""
+    inventory = iv.FileInventory(ext_db)
+    stored = set(ext_db.unshard(path) for path in ext_db)
+    assert set(inventory) == stored, "scans all files"
+    some_hash = next(iter(stored))
+    assert inventory.get(some_hash)[0] == os.path.getsize(ext_db.idpath(some_hash, ".zip")), "knows file sizes"
+    assert inventory.path(some_hash) == ext_db.idpath(some_hash, ".zip"), "computes HashFS paths"
+    assert inventory.path("0" * 64) is None, "has no paths for missing files"
+    assert inventory.size() == sum(os.path.getsize(path) for path in ext_db), "sums up file sizes"
+
+    file_db = hashfs.HashFS(str(tmpdir.join("webext_data")), depth=4, width=1, algorithm="sha256")
+    inventory_file = str(tmpdir.join("inventory.json"))
+    inventory = iv.FileInventory(file_db, inventory_file)
+    assert len(inventory) == 0, "starts out empty"
+    address = file_db.put(open(ext_db.idpath(some_hash, ".zip"), "rb"), ".zip")
+    inventory.add(address.id)
+    inventory.save()
+    assert some_hash in iv.FileInventory(file_db, inventory_file), "persists stored files"
+    os.unlink(address.abspath)
+    assert some_hash in iv.FileInventory(file_db, inventory_file), "trusts the persisted inventory"
+    inventory.rescan()
+    assert some_hash not in inventory, "rescans the file store"
+    inventory.save()
+    assert len(iv.FileInventory(file_db, inventory_file)) == 0, "persists rescans"
@@ -0,0 +1,66 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashfs
+
+from webextaware import amo
+from webextaware import journal as dj
+from webextaware import metadata as md
+
+
+def test_journal_resume(tmpdir):
+    """Download journal resumes interrupted runs"""
+    journal_file = str(tmpdir.join("journal.jsonl"))
+    journal = dj.DownloadJournal(journal_file)
+    for n in range(5):
+        journal.add("%064x" % n, "https://example.com/%d.xpi" % n)
+    journal.add("%064x" % 0, "https://example.com/0.xpi")
+    assert len(journal.pending()) == 5, "schedules every download once"
+    journal.start("%064x" % 0)
+    journal.finish("%064x" % 0)
+    journal.start("%064x" % 1)
+    journal.fail("%064x" % 1, 404)
+    journal.start("%064x" % 2)
+    journal.close()  # Crashing with download #2 in flight
+
+    journal = dj.DownloadJournal(journal_file)
+    assert journal.is_done("%064x" % 0), "remembers finished downloads"
+    assert journal.is_failed("%064x" % 1, "https://example.com/1.xpi"), "remembers failed downloads"
+    assert not journal.is_failed("%064x" % 1, "https://example.com/new.xpi"), "retries failures with new URLs"
+    assert [h for _, h in journal.pending()] == ["%064x" % n for n in (2, 3, 4)], \
+        "resumes pending and in-flight downloads in order"
+    journal.compact()
+    journal.close()
+    assert len(open(journal_file).readlines()) == 5, "compacts to one entry per download"
+
+    journal = dj.DownloadJournal(journal_file)
+    journal.compact(keep={"%064x" % n for n in (0, 3)})
+    assert [h for _, h in journal.pending()] == ["%064x" % 3], "drops downloads no longer wanted"
+    journal.close()
+    assert len(open(journal_file).readlines()) == 2, "drops them from the log"
+
+
+def test_journal_update_files(fake_amo, tmpdir):
+    """AMO extension downloader uses the download journal"""
+    edb = hashfs.HashFS(str(tmpdir.join("webext_data")), depth=4, width=1, algorithm="sha256")
+    meta = md.Metadata(data=fake_amo.corpus)
+    del fake_amo.xpis[1]
+    journal_file = str(tmpdir.join("journal.jsonl"))
+    with_journal = dj.DownloadJournal(journal_file)
+    amo.update_files(meta, edb, with_journal)
+    with_journal.close()
+    assert len(edb) == len(meta) - 1, "downloads available files"
+
+    requests_before = fake_amo.requests
+    with_journal = dj.DownloadJournal(journal_file)
+    amo.update_files(meta, edb, with_journal)
+    with_journal.close()
+    assert fake_amo.requests == requests_before, "does not retry permanent failures"
+
+    pruned = fake_amo.get(2)["current_version"]["file"]["hash"][7:]
+    edb.delete(pruned)
+    with_journal = dj.DownloadJournal(journal_file)
+    amo.update_files(meta, edb, with_journal)
+    with_journal.close()
+    assert edb.get(pruned) is not None, "downloads finished files again if they were removed from the cache"
@@ -0,0 +1,48 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashfs
+import io
+import zipfile
+
+from webextaware import inventory as iv
+from webextaware import manifestcache as mc
+from webextaware import webext as we
+
+
+def put_xpi(file_db, files):
+    xpi = io.BytesIO()
+    with zipfile.ZipFile(xpi, "w") as z:
+        for name, content in files.items():
+            z.writestr(name, content)
+    xpi.seek(0)
+    return file_db.put(xpi, ".zip").id
+
+
+def test_manifest_cache(ext_db, tmpdir):
+    """Parsed manifest cache"""
+    inventory = iv.FileInventory(ext_db)
+    cache_file = str(tmpdir.join("manifests.sqlite"))
+    cache = mc.ManifestCache(cache_file)
+    assert cache.update(inventory) == (len(inventory), 0), "parses all manifests"
+    assert cache.update(inventory) == (0, 0), "updates incrementally"
+    for ext_hash in inventory:
+        with we.WebExtension(inventory.path(ext_hash)) as ext:
+            manifest = ext.manifest()
+        cached = mc.ManifestCache(cache_file).get(ext_hash)
+        assert cached.raw == manifest.raw, "caches raw manifests"
+        assert cached.json == manifest.json, "caches parsed manifests"
+        assert cached.status == we.Manifest.PARSED, "caches the parse status"
+
+    file_db = hashfs.HashFS(str(tmpdir.join("webext_data")), depth=4, width=1, algorithm="sha256")
+    relaxed = put_xpi(file_db, {"manifest.json": '{"name": "x", // comment\n "version": "1",}'})
+    invalid = put_xpi(file_db, {"manifest.json": "{{"})
+    missing = put_xpi(file_db, {"background.js": ""})
+    cache.update(iv.FileInventory(file_db))
+    assert len(cache) == 3, "drops files gone from the inventory"
+    assert cache.get(relaxed).json == {"name": "x", "version": "1"}, "caches relaxed parses"
+    assert cache.get(relaxed).status == we.Manifest.RELAXED, "caches relaxed parse status"
+    assert cache.get(invalid).json is None and cache.get(invalid).status == we.Manifest.INVALID, \
+        "caches invalid manifests"
+    assert cache.get(missing) is None, "caches missing manifests"
@@ -6,10 +6,15 @@ from nose.tools import *
 import bz2
 import copy
 import json
+import multiprocessing
 import os
+import pickle
+import sqlite3
 
 from webextaware import metadata as md
 
+from . import ArgsMock
+
 
 def test_metadata_object(tmpdir, raw_meta):
     """Metadata cache object instantiation"""
@@ -110,3 +115,118 @@ def test_metadata_migration_from_amo_v3_to_v5(tmpdir, raw_meta):
     for e in meta:
         assert_true(e.is_webextension(), "there are only web extensions in cache")
         assert_equal(len(list(e.file_hashes())), 1, "got file hash")
+
+
+def test_metadata_db(tmpdir, raw_meta):
+    """Indexed metadata database"""
+    meta = md.Metadata(data=raw_meta)
+    db_file = str(tmpdir.join("md.sqlite"))
+    meta_db = md.MetadataDB.create(db_file, meta)
+    assert_equal(len(meta_db), len(meta), "holds all extensions")
+    assert_equal([e.id for e in meta_db], [e.id for e in meta], "iterates in metadata order")
+    assert_equal(meta_db.last_updated(), meta.last_updated(), "knows the high-water mark")
+    for e in meta:
+        assert_true(meta_db.is_known_id(e.id) and meta_db.is_known_id(str(e.id)), "AMO IDs are recognized")
+        assert_equal(meta_db.get_by_id(e.id), e, "can get by AMO ID")
+        for h in e.file_hashes():
+            assert_true(meta_db.is_known_hash(h), "hash IDs are recognized")
+            assert_equal(meta_db.get(h).id, e.id, "can get by hash ID")
+            assert_equal(meta_db.hash_to_id(h), e.id, "hash IDs resolve to extension")
+    assert_true(meta_db.get("invalid foo") is None and meta_db.get_by_hash(1) is None, "invalid get yields None")
+
+    first, second = raw_meta[0], raw_meta[1]
+    updated = copy.deepcopy(first)
+    updated["name"] = {"en-US": "Updated"}
+    meta_db.merge([updated])
+    meta_db.remove([second["id"]])
+    meta_db.save()
+    meta_db.close()
+
+    meta_db = md.MetadataDB(db_file)
+    assert_equal(len(meta_db), len(meta) - 1, "removes extensions")
+    assert_equal(next(iter(meta_db)).name, "Updated", "updates extensions in place")
+    assert_false(meta_db.is_known_id(second["id"]), "forgets removed extensions")
+
+
+def test_open_metadata(tmpdir, raw_meta):
+    """Opening metadata prefers an up-to-date database"""
+    args = ArgsMock(workdir=str(tmpdir))
+    meta = md.Metadata(filename=md.get_metadata_file(args), data=raw_meta)
+    meta.save()
+    assert_true(type(md.open_metadata(args)) is md.Metadata, "falls back to the metadata file")
+    md.MetadataDB.create(md.get_metadata_db_file(args), meta).close()
+    assert_true(type(md.open_metadata(args)) is md.MetadataDB, "opens the metadata database")
+    os.utime(md.get_metadata_db_file(args), (0, 0))
+    assert_true(type(md.open_metadata(args)) is md.Metadata, "ignores outdated metadata databases")
+    md.MetadataDB.create(md.get_metadata_db_file(args), meta).close()
+    db = sqlite3.connect(md.get_metadata_db_file(args))
+    db.execute("PRAGMA user_version = 1")
+    db.close()
+    assert_true(type(md.open_metadata(args)) is md.Metadata, "ignores databases with an older schema")
+
+
+def test_metadata_codecs(tmpdir, raw_meta):
+    """Metadata files are written line by line with any codec"""
+    meta = md.Metadata(data=raw_meta)
+    for codec in md.available_codecs():
+        md_file = str(tmpdir.join("amo_metadata.jsonl" + md.METADATA_CODECS[codec]))
+        md.Metadata(filename=md_file, data=raw_meta).save()
+        with md.open_compressed(md_file, "rt") as f:
+            assert_equal(len(f.readlines()), len(meta), "writes one line per extension with %s" % codec)
+        meta_again = md.Metadata(filename=md_file)
+        assert_equal([e.id for e in meta_again], [e.id for e in meta], "restores data with %s" % codec)
+
+    legacy_file = str(tmpdir.join(md.LEGACY_METADATA_FILE))
+    with bz2.open(legacy_file, "w") as f:
+        f.write(json.dumps(raw_meta).encode("utf-8"))
+    assert_equal(len(md.Metadata(filename=legacy_file)), len(meta), "reads legacy metadata files")
+
+    args = ArgsMock(workdir=str(tmpdir))
+    os.utime(legacy_file, (0, 0))
+    assert_true(md.find_metadata_file(args) != legacy_file, "finds the most recent metadata file")
+    assert_equal(md.get_metadata_file(args), str(tmpdir.join("amo_metadata.jsonl.gz")), "writes gzip by default")
+
+
+forked_meta_db = None
+
+
+def lookup_name(amo_id):
+    return forked_meta_db.get_by_id(amo_id).name
+
+
+def test_metadata_db_in_workers(tmpdir, raw_meta):
+    """Metadata database works in forked pool workers"""
+    global forked_meta_db
+    meta = md.Metadata(data=raw_meta)
+    forked_meta_db = md.MetadataDB.create(str(tmpdir.join("md.sqlite")), meta)
+    assert_equal(forked_meta_db.get_by_id(meta.raw_data()[0].id).name, meta.raw_data()[0].name, "works in parent")
+    with multiprocessing.get_context("fork").Pool(2) as pool:
+        names = pool.map(lookup_name, [ext.id for ext in meta])
+    assert_equal(names, [ext.name for ext in meta], "works in workers")
+
+
+def test_extension_record(raw_meta):
+    """Extension records keep hot fields and decode the rest on demand"""
+    raw_ext = raw_meta[0]
+    ext = md.Extension(raw_ext)
+    assert_equal(ext.raw(), raw_ext, "keeps the complete AMO record")
+    assert_equal(ext, raw_ext, "compares like the AMO record")
+    assert_equal(md.Extension(json.dumps(raw_ext)), ext, "can be created from JSON text")
+    assert_equal(md.Extension(ext).raw_json(), ext.raw_json(), "can be copied")
+    assert_equal(ext["guid"], raw_ext["guid"], "gives access to hot fields")
+    assert_equal(ext["current_version"], raw_ext["current_version"], "gives access to all fields")
+    assert_true("current_version" in ext and "bogus" not in ext, "knows its fields")
+    assert_true(ext.get("bogus") is None and ext.get("bogus", 5) == 5, "defaults missing fields")
+    assert_false(hasattr(ext, "__dict__"), "only has slots")
+    assert_equal(pickle.loads(pickle.dumps(ext)), ext, "can be pickled")
+
+
+def test_extension_record_from_db(tmpdir, raw_meta):
+    """Extension records from the metadata database read the AMO record from disk"""
+    meta_db = md.MetadataDB.create(str(tmpdir.join("md.sqlite")), md.Metadata(data=raw_meta))
+    ext = meta_db.get_by_id(raw_meta[0]["id"])
+    assert_equal(ext.name, md.Extension(raw_meta[0]).name, "keeps hot fields")
+    assert_equal(list(ext.files()), list(md.Extension(raw_meta[0]).files()), "keeps files")
+    assert_equal(ext.raw(), raw_meta[0], "reads the complete AMO record on demand")
+    assert_equal(md.Extension(ext).raw(), raw_meta[0], "copies read from the same database")
+    meta_db.close()
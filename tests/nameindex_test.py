@@ -0,0 +1,40 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import re
+
+from webextaware import metadata as md
+from webextaware import nameindex as ni
+
+
+def test_required_literals():
+    """Literal prefixes and runs are taken from regex selectors"""
+    assert ni.required_literals("Fake Add-on") == ("fake add-on", ["fake add-on"]), "takes plain literals"
+    assert ni.required_literals("^(Fake) Add.*on 1") == ("fake add", ["fake add", "on 1"]), \
+        "looks through groups and anchors"
+    assert ni.required_literals(".*tabs") == ("", ["tabs"]), "has no prefix after wildcards"
+    assert ni.required_literals("ab?c") == ("a", ["a", "c"]), "ends runs at optional parts"
+    assert ni.required_literals("tabs|windows") == ("", []), "ignores alternatives"
+    assert ni.required_literals("Über") == ("", ["ber"]), "only keeps ASCII literals"
+
+
+def test_name_index(raw_meta, tmpdir):
+    """Regex selectors are matched like a scan over all names"""
+    meta = md.Metadata(data=raw_meta)
+    index = ni.NameIndex.from_metadata(meta)
+    assert len(index) == len(meta), "indexes all extensions"
+    for pattern in ("fake add-on 1", "Fake Add-on 1[0-9]$", ".*-ON 4", "(fake) add", "fake|add", "^$", "x"):
+        m = re.compile(pattern, re.IGNORECASE)
+        expected = [(ext.id, list(ext.file_hashes())) for ext in meta if m.match(ext.name) is not None]
+        assert sorted(index.search(pattern)) == sorted(expected), "matches `%s` like a scan" % pattern
+        assert sorted(index.search(pattern)) == sorted(expected), "matches `%s` again from its results" % pattern
+
+    special = ni.NameIndex([(1, "ſtylus", ["a"]), (2, "\u212aelvin", ["b"]), (3, "Stylish", ["c"])])
+    assert sorted(amo_id for amo_id, _ in special.search("sty")) == [1, 3], "folds like case-insensitive regexes"
+    assert [amo_id for amo_id, _ in special.search("kel")] == [2], "folds the Kelvin sign"
+
+    index_file = str(tmpdir.join("names.json"))
+    ni.NameIndex.open(index_file, meta, ["metadata", 1, 2])
+    assert len(ni.NameIndex.open(index_file, [], ["metadata", 1, 2])) == len(meta), "loads a current index"
+    assert len(ni.NameIndex.open(index_file, [], ["metadata", 1, 3])) == 0, "rebuilds an outdated index"
@@ -0,0 +1,33 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from webextaware import permindex as pi
+
+
+def test_permission_selectors():
+    """Permission selectors are told apart from other selectors"""
+    assert pi.is_permission_selector("perm:tabs"), "knows API permission selectors"
+    assert pi.is_permission_selector("host:<all_urls>"), "knows host permission selectors"
+    assert not pi.is_permission_selector("Fake"), "rejects names"
+    assert not pi.is_permission_selector(1234), "rejects AMO IDs"
+    assert pi.normalize_host("*://*.Example.COM") == "*://*.example.com/", "normalizes host permissions"
+    assert pi.normalize_host("HTTPS://example.com/Path") == "https://example.com/Path", "keeps paths"
+
+
+def test_permission_index(tmpdir):
+    """Inverted permission index"""
+    index = pi.PermissionIndex()
+    index.add(1, {"hash": "sha256:a", "permissions": ["tabs", "<all_urls>"]})
+    index.add(2, {"hash": "sha256:b", "permissions": ["tabs", "storage", "*://*.Example.com/*"]})
+    index.add(3, {"hash": "sha256:c", "permissions": ["nativeMessaging"], "host_permissions": ["<all_urls>"]})
+    assert index.lookup("perm:tabs") == [(1, "a"), (2, "b")], "looks up API permissions"
+    assert index.lookup("host:*://*.example.com/*") == [(2, "b")], "looks up normalized host permissions"
+    assert index.lookup("host:<all_urls>") == [(1, "a"), (3, "c")], "includes manifest v3 host permissions"
+    assert index.permissions()["perm:tabs"] == 2, "counts files per permission"
+
+    index_file = str(tmpdir.join("permissions.json"))
+    index.save(index_file, ["metadata", 1, 2])
+    loaded = pi.PermissionIndex.open(index_file, [], ["metadata", 1, 2])
+    assert loaded.lookup("perm:storage") == [(2, "b")], "loads a current index"
+    assert len(pi.PermissionIndex.open(index_file, [], ["metadata", 1, 3])) == 0, "rebuilds an outdated index"
@@ -0,0 +1,59 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import itertools
+
+from webextaware import database as db
+from webextaware import selection as sel
+
+from . import ArgsMock
+
+
+def test_tokenize():
+    """Selector arguments are split at blank-separated operators"""
+    assert list(sel.tokenize(["all - orphans"])) == ["all", "-", "orphans"], "splits operators"
+    assert list(sel.tokenize(["Fake Add-on 1", "&", 5])) == ["Fake Add-on 1", "&", 5], "keeps names and IDs"
+    assert list(sel.tokenize(["AT&T"])) == ["AT&T"], "only splits at blank-separated operators"
+
+
+def test_unspaced_expressions():
+    """Operators without blanks are told apart from names"""
+    assert sel.is_unspaced_expression("perm:tabs&users>=0"), "finds unspaced intersections"
+    assert sel.is_unspaced_expression("!perm:storage"), "finds unspaced negations"
+    assert not sel.is_unspaced_expression("AT&T"), "keeps names"
+    assert not sel.is_unspaced_expression("host:*://example.com/?a&b"), "keeps host permissions"
+    assert sel.space_operators("perm:tabs&!perm:storage&users>=0") == "perm:tabs - perm:storage & users>=0", \
+        "suggests the spaced expression"
+
+
+def test_select(fake_amo, tmpdir):
+    """Selector query plans"""
+    args = ArgsMock(workdir=str(tmpdir))
+    database = db.Database(args)
+    database.sync()
+    fake_amo.delist(3)
+    database.sync()
+    ids = lambda selectors: sorted(set(amo_id for amo_id, _, _ in database.select(selectors)),
+                                 key=lambda amo_id: (amo_id is None, amo_id or 0))
+
+    assert ids(["all"]) == sorted(e.id for e in database.meta), "selects everything"
+    assert ids(["all", "orphans"]) == ids("all") + [None], "unites selectors"
+    assert ids(["all - orphans"]) == ids("all"), "subtracts selectors"
+    assert ids(["-", "all"]) == [], "negates selectors"
+    assert ids(["fake add-on 1", "-", "fake add-on 1[0-9]$"]) == [1] + list(range(100, 121)), "subtracts names"
+    assert ids(["users>=500 & fake add-on 1"]) == sorted(e.id for e in database.meta
+                                                         if e.average_daily_users >= 500 and str(e.id)[0] == "1"), \
+        "filters by user count"
+    assert ids(["downloads<5", "&", "perm:tabs"]) == sorted(e.id for e in database.meta if e.weekly_downloads < 5), \
+        "filters by downloads"
+    assert ids(["orphans & all"]) == [], "intersects selectors"
+    assert ids(["(", "7"]) == [7], "skips invalid selectors"
+    assert ids(["perm:tabs&users>=0"]) == [], "rejects unspaced expressions"
+
+    paths = dict((ext_id, path) for _, ext_id, path in database.select("all"))
+    assert all(path == database.file_db.idpath(ext_id, ".zip") for ext_id, path in paths.items()), \
+        "resolves file paths"
+    first = next(iter(database.select("all")))
+    assert first[0] == next(iter(database.meta)).id, "streams results in metadata order"
+    assert len(list(itertools.islice(database.iter_ext("all"), 3))) == 3, "streams web extensions"
@@ -0,0 +1,51 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import copy
+import pytest
+
+from webextaware import metadata as md
+from webextaware import snapshots as sn
+
+
+def test_snapshots(raw_meta, tmpdir, monkeypatch):
+    """Metadata snapshots as deltas"""
+    monkeypatch.setattr(sn, "REBASE_INTERVAL", 2)
+    store = sn.SnapshotStore(str(tmpdir.join("snapshots")))
+    first = store.record(md.Metadata(data=raw_meta), "first")
+    assert first["base"] and first["added"] == len(raw_meta), "starts with a base snapshot"
+
+    bumped = copy.deepcopy(raw_meta[0])
+    bumped["current_version"]["version"] = "2.0"
+    renamed = copy.deepcopy(raw_meta[1])
+    renamed["name"] = {"en-US": "Renamed"}
+    added = copy.deepcopy(raw_meta[2])
+    added["id"] = 100000
+    second_meta = [bumped, renamed] + raw_meta[3:-1] + [added]
+    second = store.record(md.Metadata(data=second_meta), "second")
+    assert not second["base"], "writes deltas"
+    assert (second["added"], second["removed"], second["bumped"], second["changed"]) == (1, 2, 1, 1), \
+        "counts changes"
+    third = store.record(md.Metadata(data=second_meta), "third")
+    assert not third["base"] and third["added"] + third["removed"] + third["changed"] == 0, "records no changes"
+    fourth = store.record(md.Metadata(data=raw_meta))
+    assert fourth["base"], "rebases every REBASE_INTERVAL snapshots"
+
+    diff = store.diff("first", "third")
+    assert diff["added"] == [100000], "lists added extensions"
+    assert diff["removed"] == sorted([raw_meta[2]["id"], raw_meta[-1]["id"]]), "lists removed extensions"
+    assert diff["bumped"] == [{"id": raw_meta[0]["id"], "from": "1.0", "to": "2.0"}], "lists version bumps"
+    assert diff["changed"] == [raw_meta[1]["id"]], "lists other changes"
+    reverse = store.diff("third", "first")
+    assert reverse["added"] == diff["removed"] and reverse["removed"] == diff["added"], "diffs backwards"
+    assert store.diff("first", -1)["added"] == [], "diffs across base snapshots"
+    assert store.diff(-2, -1)["to"] == fourth["name"], "resolves snapshot indexes"
+    with pytest.raises(KeyError):
+        store.diff("first", "bogus")
+
+    store = sn.SnapshotStore(str(tmpdir.join("snapshots")))
+    assert [s["name"] for s in store.snapshots()][:3] == ["first", "second", "third"], "persists snapshots"
+    assert [e.raw() for e in store.load("third")] == [md.Extension(e).raw() for e in second_meta], \
+        "replays snapshots"
+    assert len(store.load(-1)) == len(raw_meta), "replays base snapshots"
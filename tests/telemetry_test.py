@@ -0,0 +1,54 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+
+from webextaware import amo
+from webextaware import database as db
+from webextaware import telemetry as tm
+
+from . import ArgsMock
+
+
+def test_request_stats():
+    """Request stats keep a latency histogram and retry counts"""
+    stats = tm.RequestStats()
+    for latency in (0.005, 0.015, 0.015, 0.3, 100.0):
+        stats.start()
+        stats.response(latency, 200, 10)
+        stats.finish()
+    stats.response(0.015, None, 5)
+    summary = stats.summary()
+    assert summary["requests"] == 6 and summary["statuses"] == {"200": 5, "error": 1}, "counts responses"
+    assert summary["latency"]["buckets"]["0.02"] == 3 and summary["latency"]["buckets"]["+Inf"] == 1, \
+        "sorts latencies into buckets"
+    assert summary["latency"]["p50"] == 0.02 and summary["latency"]["p99"] is None, "estimates percentiles"
+    assert summary["concurrency_limit"] == {"min": 5, "max": 10, "last": 5}, "tracks the concurrency limit"
+
+    scheduler = amo.RetryScheduler(["a", "b"], max_attempts=2)
+    scheduler.failure("a", 503)
+    scheduler.failure("a", None)
+    scheduler.failure("b", 503)
+    stats.retry_summary(scheduler)
+    assert stats.summary()["retries"] == {"by_status": {"503": 2, "error": 1}, "items": 2, "exhausted": 1}, \
+        "reports retries by status"
+
+
+def test_sync_stats(fake_amo, monkeypatch, tmpdir):
+    """Sync writes a stats summary"""
+    monkeypatch.setattr(amo, "BACKOFF_BASE", 0.001)
+    fake_amo.error_rate = 0.1
+    args = ArgsMock(workdir=str(tmpdir))
+    database = db.Database(args)
+    database.sync()
+    with open(tm.get_stats_file(args)) as f:
+        summary = json.load(f)
+    metadata, files = summary["metadata"], summary["files"]
+    assert metadata["statuses"]["200"] == fake_amo.pages, "counts metadata pages"
+    assert metadata["time"]["decode"] > 0, "measures JSON decoding"
+    assert files["statuses"]["200"] == len(fake_amo.corpus), "counts downloads"
+    assert files["bytes"] == sum(len(x) for x in fake_amo.xpis.values()), "counts downloaded bytes"
+    assert files["time"]["disk"] > 0, "measures disk time"
+    assert sum(metadata["retries"]["by_status"].values()) + sum(files["retries"]["by_status"].values()) \
+        == fake_amo.requests - fake_amo.pages - len(fake_amo.corpus), "reports retries"
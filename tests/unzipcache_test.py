@@ -0,0 +1,58 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+
+from webextaware import unzipcache as uc
+from webextaware import webext as we
+
+
+def test_unzip_cache(ext_db, tmpdir):
+    """Unzip cache with LRU eviction"""
+    files = dict((ext_db.unshard(path), path) for path in ext_db)
+    hashes = sorted(files)[:3]
+    cache_dir = str(tmpdir.join("unzipped"))
+    cache = uc.UnzipCache(cache_dir)
+    path = cache.get(hashes[0], files[hashes[0]])
+    assert os.path.isfile(os.path.join(path, "manifest.json")), "extracts extensions"
+    marker = os.path.join(path, "marker")
+    open(marker, "w").close()
+    other = uc.UnzipCache(cache_dir)
+    assert other.get(hashes[0], files[hashes[0]]) == path and os.path.exists(marker), "reuses extracted trees"
+    other.release(hashes[0])
+    cache.release(hashes[0])
+    tree_size = cache.size()
+    assert tree_size > 0, "keeps track of its size"
+
+    with we.WebExtension(files[hashes[1]], hashes[1], cache) as ext:
+        assert os.path.isfile(os.path.join(ext.unzip(), "manifest.json")), "unzips extensions to the cache"
+    assert hashes[1] in cache, "keeps trees of cleaned up extensions"
+    assert not any(name.startswith(uc.TEMP_PREFIX) for name in os.listdir(cache_dir)), "leaves no temporary trees"
+
+    os.utime(os.path.join(cache_dir, hashes[0]), (1000, 1000))
+    os.utime(os.path.join(cache_dir, hashes[1]), (2000, 2000))
+    cache = uc.UnzipCache(cache_dir, budget=cache.size() + 1)
+    cache.get(hashes[2], files[hashes[2]])
+    assert hashes[0] not in cache, "evicts the least recently used trees"
+    assert hashes[1] in cache and hashes[2] in cache, "keeps recently used trees"
+    assert len(cache.trees()) == 2, "fits into its budget"
+    cache.release(hashes[2])
+
+    cache = uc.UnzipCache(cache_dir, budget=0)
+    in_use = uc.UnzipCache(cache_dir, budget=0)
+    in_use.get(hashes[1], files[hashes[1]])
+    cache.get(hashes[0], files[hashes[0]])
+    assert hashes[0] in cache and hashes[1] in cache, "doesn't evict trees in use"
+    assert hashes[2] not in cache, "evicts recently used trees that aren't in use"
+    cache.release(hashes[0])
+    in_use.release(hashes[1])
+    cache.evict()
+    assert cache.trees() == [] and cache.size() == 0, "enforces its budget once trees are released"
+
+    with we.WebExtension(files[hashes[0]], hashes[0], cache) as ext:
+        ext.unzip()
+    cache.get(hashes[1], files[hashes[1]])
+    assert hashes[0] not in cache, "evicts trees of cleaned up extensions"
+    cache.clear()
+    assert cache.trees() == [], "can be cleared"
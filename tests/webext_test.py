@@ -3,6 +3,7 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import json
+import jsoncfg
 
 from webextaware import webext as we
 
@@ -37,3 +38,32 @@ def test_webext_manifest(ext_db):
             re_manifest = json.loads(manifest_str)
             assert "manifest_version" in re_manifest and "version" in re_manifest and "name" in re_manifest, \
                 "strings representations are valid JSON"
+
+
+RELAXED_MANIFESTS = [
+    '{"name": "x", // comment\n "version": "1.0",}',
+    '/* header */ {"permissions": ["tabs", "<all_urls>",], "a": {"b": [1, 2, /* three */],},}',
+    '{"url": "https://example.com/*", "glob": "/*.js", "text": "a, ] and }",}',
+    '{"escaped": "quote \\" // not a comment", "slash": "\\\\", // comment\n "end": true}',
+    '{"trailing": [1, 2, // last\n /* more */ ],\r\n}',
+    '{"nested": {"empty": [], "obj": {},},}'
+]
+
+
+def test_tolerant_json_loads(ext_db):
+    """Tolerant JSON parsing has the same results as jsoncfg"""
+    for text in RELAXED_MANIFESTS:
+        assert we.tolerant_json_loads(text) == jsoncfg.loads(text), "parses like jsoncfg"
+        manifest = we.Manifest(text.encode("utf-8"))
+        assert manifest.status == we.Manifest.RELAXED, "flags relaxed parses"
+
+    for file_name in ext_db:
+        with we.WebExtension(file_name) as w:
+            manifest = w.manifest()
+        lines = str(manifest).split("\n")
+        # Comment every line and add a comma after the last item of every object and array
+        relaxed = "\n".join("%s%s // line %d" % (line, "," if n + 1 < len(lines) and lines[n + 1].strip()[:1] in "]}"
+                                                 and line.strip()[-1:] not in "[{" else "", n)
+                            for n, line in enumerate(lines))
+        assert we.tolerant_json_loads(relaxed) == manifest.json == jsoncfg.loads(relaxed), \
+            "parses manifests with comments and trailing commas"
@@ -0,0 +1,116 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import pytest
+import zipfile
+
+from webextaware import webext as we
+from webextaware import zipgrep as zg
+
+
+CONTENT = {
+    "manifest.json": '{\n  "name": "Grep Test",\n  "version": "1.0"\n}\n',
+    "lib/jquery.js": "\n".join("line %d%s" % (n, " jQuery v3.1.%d" % n if n % 7 == 0 else "") for n in range(40)),
+    "lib/crlf.js": "var a = eval(x);\r\nvar b = 1;\r\n",
+    "alt.txt": "xabcd\nd1 and dd\nA(?i)\n\\d\n",
+    "icon.png": b"\x89PNG\r\n\x1a\n\0\0eval(\0",
+    "empty.txt": ""
+}
+
+
+@pytest.fixture
+def test_xpi(tmpdir):
+    file_name = str(tmpdir.join("test.xpi"))
+    with zipfile.ZipFile(file_name, "w") as z:
+        z.writestr("lib/", "")
+        for name, data in CONTENT.items():
+            z.writestr(name, data)
+    return file_name
+
+
+def test_parse_grep_args():
+    """Parsing grep flags"""
+    assert zg.parse_grep_args(["-i", "-nA", "2", "--count"]) == \
+        {"ignore_case": True, "line_number": True, "after": 2, "count": True}, "parses flags"
+    assert zg.parse_grep_args(["-C3", "-r"]) == {"before": 3, "after": 3}, "parses context flags"
+    with pytest.raises(ValueError):
+        zg.parse_grep_args(["-v"])
+    assert zg.translate_ere(r"\<[[:digit:]]+\>") == r"\b[0-9]+\b", "translates POSIX syntax"
+    zg.check_ere(r"\<\.js\b [[:alpha:]_]+ (ab)?c|d")
+    for regexp in (r"\d", r"\1", "(?i)a", r"[\d]", "a+?", "[[.a.]]"):
+        with pytest.raises(ValueError):
+            zg.check_ere(regexp)
+    for regexp in ("ab|abcd", "(ab)?c"):
+        with pytest.raises(ValueError):
+            zg.ZipGrep(regexp, only_matching=True)
+        with pytest.raises(ValueError):
+            zg.ZipGrep(regexp, color=True)
+
+
+@pytest.mark.skipif(we.WebExtension.grep_exe is None, reason="needs the `grep` binary")
+@pytest.mark.parametrize("regexp, grep_args", [
+    ("jQuery v[0-9.]+", []),
+    ("jquery", ["-i"]),
+    ("JQUERY V3", ["-i", "-l"]),
+    ("eval\\(", []),
+    ("eval\\(", ["-l"]),
+    ("line [0-9]*7", ["-c"]),
+    ("v3\\.[0-9.]+", ["-o", "-n"]),
+    ("jQuery", ["-C", "2"]),
+    ("jQuery", ["-n", "-B1", "-A", "3"]),
+    ("jQuery", ["-A", "10"]),
+    ("\\<var [[:alpha:]]+", []),
+    ("^var b = 1;$", []),
+    ("nothing to see", []),
+    ("jQuery v3.1.(7|28)", ["-C", "1"]),
+    ("jQuery|eval", ["-n", "-A", "0"]),
+    ("jQuery|eval", ["-o", "-A", "1"]),
+    ("line 1[0-9]", ["-o", "-B", "2"]),
+    ("ab|abcd", ["-o"]),
+    ("d|d1", ["-o"]),
+    ("x(ab)?(abcd)?", ["-o"]),
+    ("\\d", ["-o"]),
+    ("[\\d]", []),
+    ("\\(\\?i", []),
+    ("(?i)a", []),
+    ("a[[:upper:]]|[[:punct:]]{2}", ["-i", "-c"])
+])
+def test_zipgrep_matches_grep(test_xpi, regexp, grep_args):
+    """In-memory grep has the same output as the `grep` binary"""
+    with we.WebExtension(test_xpi) as ext:
+        native = ext.grep(regexp, grep_args)
+        binary = ext.grep_exe_output(regexp, grep_args)
+    # Newer grep versions report binary files on stderr
+    binary_matches = [line for line in native if line.endswith(": Binary file matches")]
+    binary = [line for line in binary if not line.endswith(": Binary file matches")]
+    assert sorted(line for line in native if line not in binary_matches) == sorted(binary), \
+        "has the same output lines"
+
+
+def test_zipgrep_context_separators():
+    """In-memory grep separates groups of context lines like grep"""
+    text = b"a1\na2\nb\nb\na3 a4\nb\n"
+    assert zg.ZipGrep("a[0-9]", after=1).grep_data(text, "f") == ["f:a1", "f:a2", "f-b", "--", "f:a3 a4", "f-b"], \
+        "separates groups"
+    assert zg.ZipGrep("a[0-9]", after=0).grep_data(text, "f") == ["f:a1", "f:a2", "--", "f:a3 a4"], \
+        "separates groups without context lines"
+    assert zg.ZipGrep("a[0-9]", only_matching=True, before=1).grep_data(text, "f") == \
+        ["f:a1", "f:a2", "--", "f:a3", "f:a4"], "separates groups of matches"
+    assert zg.ZipGrep("a[0-9]").grep_data(text, "f") == ["f:a1", "f:a2", "f:a3 a4"], "only separates with context"
+
+
+def test_zipgrep_binary(test_xpi):
+    """In-memory grep reports binary files"""
+    with we.WebExtension(test_xpi) as ext:
+        assert ext.grep("eval\\(") == ["<%= PACKAGE_ID %>/lib/crlf.js:var a = eval(x);",
+                                       "<%= PACKAGE_ID %>/icon.png: Binary file matches"], "reports binary files"
+        assert "<%= PACKAGE_ID %>/icon.png:1" in ext.grep("eval\\(", ["-c"]), "counts binary files"
+
+
+@pytest.mark.skipif(we.WebExtension.grep_exe is None, reason="needs the `grep` binary")
+def test_zipgrep_fallback(test_xpi):
+    """Flags not supported in memory are handled by the `grep` binary"""
+    with we.WebExtension(test_xpi) as ext:
+        assert ext.grep("line 1", ["-x"]) == ["<%= PACKAGE_ID %>/lib/jquery.js:line 1"], "supports other flags"
+
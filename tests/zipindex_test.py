@@ -0,0 +1,40 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashfs
+import os
+import zipfile
+
+from webextaware import inventory as iv
+from webextaware import zipindex as zi
+
+
+def test_zip_index(ext_db, tmpdir):
+    """Zip member index"""
+    inventory = iv.FileInventory(ext_db)
+    index_file = str(tmpdir.join("members.sqlite"))
+    index = zi.ZipIndex(index_file)
+    assert index.update(inventory) == (len(inventory), 0), "indexes all files"
+    assert index.update(inventory) == (0, 0), "updates incrementally"
+
+    some_hash = next(iter(inventory))
+    with zipfile.ZipFile(inventory.path(some_hash)) as z:
+        names = sorted(info.filename for info in z.infolist() if not info.is_dir())
+    assert sorted(name for h, name, _ in index.find("*") if h == some_hash) == names, "indexes all members"
+    manifests = list(index.find("manifest.json"))
+    assert len(manifests) == len(inventory), "finds members in all files"
+    assert sorted(index.search("manifest.json")) == sorted(inventory), "finds files by member"
+    sizes = [size for _, _, size in index.find("*", largest_first=True)]
+    assert sizes == sorted(sizes, reverse=True), "finds the largest members first"
+    assert all(size >= 1000 for _, _, size in index.find("*", min_size=1000)), "filters by size"
+    assert list(index.find("[!m]*.json")) == [], "supports negated sets"
+
+    file_db = hashfs.HashFS(str(tmpdir.join("webext_data")), depth=4, width=1, algorithm="sha256")
+    broken = file_db.put(open(__file__, "rb"), ".zip")
+    other_inventory = iv.FileInventory(file_db)
+    index = zi.ZipIndex(index_file)
+    assert len(index) == len(inventory), "persists the index"
+    assert index.update(other_inventory) == (1, len(inventory)), "drops files gone from the inventory"
+    assert broken.id in index and broken.id not in index.search("*"), "remembers broken files"
+    os.unlink(broken.abspath)
@@ -2,19 +2,57 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import grequests
-from io import BytesIO
+import aiohttp
+import asyncio
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import glob
+import hashlib
+import heapq
+import itertools
+import json
 import logging
 import math
-import requests
+import os
+import random
+import tempfile
+import time
+from urllib.parse import quote
+
+from .journal import DownloadJournal
+from .telemetry import RequestStats
 
 
 logger = logging.getLogger(__name__)
 amo_server = "https://addons.mozilla.org"
-MAX_CONCURRENT_REQUESTS = 10
+INITIAL_CONCURRENT_REQUESTS = 10
+MIN_CONCURRENT_REQUESTS = 2
+MAX_CONCURRENT_REQUESTS = 32
+LATENCY_TOLERANCE = 2.0
+ERROR_TOLERANCE = 0.5
+REQUEST_TIMEOUT = 60
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+RECONCILE_BATCH_SIZE = 50
+RESULT_WINDOW = 30000
+MAX_ATTEMPTS = 10
+BACKOFF_BASE = 0.1
+BACKOFF_MAX = 60.0
+BREAKER_THRESHOLD = 20
+BREAKER_COOLDOWN = 10.0
+BREAKER_MAX_COOLDOWN = 300.0
+LARGE_FILE_SIZE = 4 * 1024 * 1024
+LARGE_FILE_SHARE = 0.25
+# Download priorities as (sort key, whether larger keys go first)
+DOWNLOAD_PRIORITIES = {
+    "users": (lambda ext, ext_file: ext.get("average_daily_users") or 0, True),
+    "updated": (lambda ext, ext_file: ext.get("last_updated") or "", True),
+    "size": (lambda ext, ext_file: ext_file.get("size") or 0, False)
+}
 
 
-def download_metadata(max_pages=(2 << 31), max_ext=(2 << 31), page_size=50, min_users=0, max_users=0):
+def download_metadata(max_pages=(2 << 31), max_ext=(2 << 31), page_size=50, min_users=0, max_users=0, cache=None,
+                      stats=None):
     """
     Retrieves the metadata for all public extensions.
     If specified, limit to extensions with at least |min_users| users.
@@ -22,122 +60,677 @@ def download_metadata(max_pages=(2 << 31), max_ext=(2 << 31), page_size=50, min_
 
     Returns an array of addon results from the AMO API as described at
     https://addons-server.readthedocs.io/en/latest/topics/api/addons.html#addon-detail-object
+    or None if not all result pages could be retrieved.
     """
-    global logger
+    crawl = MetadataCrawl(max_pages, max_ext, page_size, min_users, max_users, cache, stats)
+    metadata = []
+    for results in crawl:
+        metadata += results
+    if not crawl.complete:
+        return None
+    return metadata
 
-    # Maximum page_size seems to be 50 right now, 25 is AMO's current default.
-    url = amo_server + "/api/v5/addons/search/"
-    search_params = "sort=created" \
-        "&type=extension" \
-        "&app=firefox" \
-        "&page_size=%d" % page_size
-    if min_users:
-        search_params += "&users__gte=%d" % min_users
-    if max_users:
-        search_params += "&users__lt=%d" % max_users
-    logger.debug("Search parameters for AMO query: %s" % search_params)
-
-    extra_desc = ""
-    if min_users and max_users:
-        extra_desc += ", with at least %d and less than %d users" % (min_users, max_users)
-    elif min_users:
-        extra_desc += ", with at least %d users" % min_users
-    elif max_users:
-        extra_desc += ", with less than %d users" % max_users
-
-    # Grab page_size and count from first result page and calculate num_pages from that
-    first_page = requests.get("%s?%s" % (url, search_params), verify=True).json()
-    logger.info("There are currently %d web extensions listed%s" % (first_page["count"], extra_desc))
-    supported_page_size = int(first_page["page_size"])
-    if page_size != supported_page_size:
-        logger.warning("Requested size %d is greater than supported size %d" % (page_size, supported_page_size))
-    num_pages = min(max_pages, int(math.ceil(first_page["count"] / supported_page_size)))
-    max_pages_in_api = first_page["page_count"]
-    if num_pages > max_pages_in_api:
-        actual_result_count = max_pages_in_api * supported_page_size
-        if not min_users and not max_users and num_pages <= max_pages and first_page["count"] < max_ext:
-            logger.info("Splitting query to avoid truncation to %d results" % actual_result_count)
-            return download_metadata_workaround_limit(max_pages, max_ext, supported_page_size, first_page["count"])
-        logger.warning("Truncating results to %d pages (%d results) due to API limitation" % (max_pages_in_api, actual_result_count))
-        num_pages = max_pages_in_api
-    logger.info("Fetching %d pages of AMO metadata" % num_pages)
-    pages_to_get = ["%s?%s&page=%d" % (url, search_params, n) for n in range(2, num_pages + 1)]
-
-    # NOTE: The logic below assumes the result set to be stable during the query.
-    # If an item is deleted during the query, another item may be missing or
-    # appear multiple times due to shifted items during pagination.
-
-    session = create_request_session()
-    metadata = first_page["results"]
-    while True:
-        fatal_errors = 0
-        unsent_requests = [grequests.get(url, verify=True, session=session) for url in pages_to_get]
-        for response in grequests.imap(unsent_requests, size=MAX_CONCURRENT_REQUESTS):
-            if 200 <= response.status_code < 400:
-                logger.debug("Downloaded %d bytes from `%s`" % (len(response.content), response.url))
-                metadata += response.json()["results"]
-                try:
-                    original_url = response.history[0].url
-                except IndexError:
-                    # There was no redirect
-                    original_url = response.url
-                pages_to_get.remove(original_url)
-            else:
-                logger.error("Unable to download `%s`, status code %d" % (response.url, response.status_code))
-                if 400 <= response.status_code < 500:
-                    fatal_errors += 1
-            if len(pages_to_get) % 25 == 0:
-                logger.info("%d pages to go" % len(pages_to_get))
-        if len(pages_to_get) == fatal_errors:
-            break
 
-    if len(pages_to_get) > 0:
-        logger.error("Unable to fetch %d pages. Please try again later later" % len(pages_to_get))
+def update_metadata(metadata, since, cache=None, stats=None):
+    """Applies changes since the |since| high-water mark to |metadata|, returns the new mark or None on errors"""
+    global logger
+    crawl = UpdateCrawl(since, cache=cache, stats=stats)
+    updates = []
+    for results in crawl:
+        updates += results
+    if not crawl.complete:
         return None
+    logger.info("%d web extensions were created or updated since %s" % (len(updates), since))
+    metadata.merge(updates)
 
-    if len(metadata) != first_page["count"]:
-        logger.warning("Got %d instead of the expected %d results" % (len(metadata), first_page["count"]))
+    if len(metadata) > crawl.count:
+        # Delisted add-ons don't show up in search results at all
+        logger.info("Reconciling %d cached with %d listed web extensions" % (len(metadata), crawl.count))
+        delisted_ids = find_delisted(metadata, crawl.count, stats)
+        if delisted_ids is None:
+            return None
+        logger.info("Removing %d delisted web extensions" % len(delisted_ids))
+        metadata.remove(delisted_ids)
+    elif len(metadata) < crawl.count:
+        logger.warning("%d listed web extensions are missing from the cached metadata"
+                       % (crawl.count - len(metadata)))
 
-    return metadata[0:min(len(metadata), max_ext)]
+    return crawl.high_water_mark
 
 
-def download_metadata_workaround_limit(max_pages, max_ext, page_size, total_count):
+def find_delisted(metadata, count, stats=None):
+    """Returns the AMO IDs in |metadata| that are no longer among the |count| listed ones, or None on errors"""
     global logger
+    cached = sorted(metadata, key=lambda ext: ext["created"], reverse=True)
+    position = dict((ext.id, n) for n, ext in enumerate(cached))
+    last = min(count, RESULT_WINDOW) - 1
 
-    # The AMO API is limited to 30k, but there are more extensions. To work
-    # around this limit, we run two queries with logically disjoint results and
-    # merge them. In May 2023, the total number of public extensions is 32k,
-    # of which 14k have at least 10 users (=user_count_for_split).
-    #
-    # The work-around here depends on the ability to partition the results in
-    # subsets. Ideally the AMO API should not have a cap on the result window:
-    # https://github.com/mozilla/addons-server/issues/20640
-    user_count_for_split = 10
-    logger.info("Part 1 of 2: Looking up extensions with at least %d users" % user_count_for_split)
-    metadata_part_1 = download_metadata(max_pages, max_ext, page_size, user_count_for_split, 0)
-    logger.info("Part 2 of 2: Looking up extensions with less than %d users" % user_count_for_split)
-    metadata_part_2 = download_metadata(max_pages, max_ext, page_size, 0, user_count_for_split)
-    logger.info("Merging %d and %d and expecting %d results" % (len(metadata_part_1), len(metadata_part_2), total_count))
-
-    id_seen = set()
-    metadata = []
-    for metadata_part in [metadata_part_1, metadata_part_2]:
-        for ext in metadata_part:
+    async def bisect(session, limiter):
+        offsets = {}
+
+        async def probe(positions):
+            # Offset = number of delisted extensions before a listed position in `sort=created` order
+            urls = dict(("%s/api/v5/addons/search/?type=extension&app=firefox&sort=created&page_size=1&page=%d"
+                         % (amo_server, n + 1), n) for n in positions)
+            ok = True
+            async for url, page in crawl_json(session, limiter, list(urls)):
+                if page is None or len(page["results"]) == 0 or page["results"][0]["id"] not in position:
+                    ok = False
+                    continue
+                offsets[urls[url]] = position[page["results"][0]["id"]] - urls[url]
+            return ok
+
+        if last < 0:
+            return set(ext.id for ext in cached)
+        if not await probe({0, last}):
+            return None
+        delisted = set(ext.id for ext in cached[:offsets[0]])
+        gaps = [(0, last)] if offsets[last] > offsets[0] else []
+        while len(gaps) > 0:
+            if not await probe(set((lo + hi) // 2 for lo, hi in gaps if hi - lo > 1)):
+                return None
+            narrower = []
+            for lo, hi in gaps:
+                if hi - lo == 1:
+                    delisted.update(ext.id for ext in cached[lo + offsets[lo] + 1:hi + offsets[hi]])
+                    continue
+                mid = (lo + hi) // 2
+                if not offsets[lo] <= offsets[mid] <= offsets[hi]:
+                    return None
+                if offsets[mid] > offsets[lo]:
+                    narrower.append((lo, mid))
+                if offsets[hi] > offsets[mid]:
+                    narrower.append((mid, hi))
+            gaps = narrower
+
+        tail = cached[last + offsets[last] + 1:]
+        if last == count - 1:
+            delisted.update(ext.id for ext in tail)
+        else:
+            listed = await listed_guids(session, limiter, [ext["guid"] for ext in tail])
+            if listed is None:
+                return None
+            delisted.update(ext.id for ext in tail if ext["guid"] not in listed)
+        return delisted
+
+    async def run():
+        async with create_client_session() as session:
+            limiter = AdaptiveLimiter(stats=stats)
+            bisect_cost = 2 + (len(cached) - count) * math.ceil(math.log2(max(2, count)))
+            if bisect_cost < math.ceil(len(cached) / RECONCILE_BATCH_SIZE):
+                return await bisect(session, limiter)
+            listed = await listed_guids(session, limiter, [ext["guid"] for ext in cached])
+            if listed is None:
+                return None
+            return set(ext.id for ext in cached if ext["guid"] not in listed)
+
+    loop = asyncio.new_event_loop()
+    try:
+        delisted = loop.run_until_complete(run())
+    finally:
+        loop.close()
+    if delisted is None or len(delisted) != len(metadata) - count:
+        # Most likely the listing changed while we were looking
+        logger.error("Unable to check for delisted web extensions")
+        return None
+    return delisted
+
+
+async def listed_guids(session, limiter, guids):
+    """Returns the subset of addon GUIDs that are listed on AMO, or None on errors"""
+    listed = set()
+    urls = ["%s/api/v5/addons/search/?type=extension&app=firefox&page_size=%d&guid=%s"
+            % (amo_server, RECONCILE_BATCH_SIZE, quote(",".join(guids[i:i + RECONCILE_BATCH_SIZE])))
+            for i in range(0, len(guids), RECONCILE_BATCH_SIZE)]
+    async for _, page in crawl_json(session, limiter, urls):
+        if page is None:
+            return None
+        listed.update(ext["guid"] for ext in page["results"])
+    return listed
+
+
+class Crawl(object):
+    """Iterable of addon result lists as search result pages arrive, with `pages()` left to subclasses"""
+
+    def __init__(self, page_size=50, cache=None, stats=None):
+        self.page_size = page_size
+        self.cache = cache
+        self.stats = stats
+        self.count = None
+        self.complete = False
+        self.limiter = None
+        self.__seen = set()
+
+    def __iter__(self):
+        # The event loop only runs while we wait for the next page
+        loop = asyncio.new_event_loop()
+        pages = self.pages()
+        try:
+            while True:
+                try:
+                    results = loop.run_until_complete(pages.__anext__())
+                except StopAsyncIteration:
+                    break
+                yield results
+        finally:
+            loop.run_until_complete(pages.aclose())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    def _search_url(self, params):
+        return "%s/api/v5/addons/search/?type=extension&app=firefox&page_size=%d&%s" \
+            % (amo_server, self.page_size, params)
+
+    def _reset(self):
+        self.count = None
+        self.complete = False
+        self.limiter = AdaptiveLimiter(stats=self.stats)
+        self.__seen = set()
+
+    def _dedup(self, results):
+        global logger
+        unique_results = []
+        for ext in results:
             amo_id = ext["id"]
-            if amo_id in id_seen:
+            if amo_id in self.__seen:
                 # In theory, the user count could update while the query is
-                # running, and an addon can appear in both lists.
+                # running, and an addon can appear in both partitions.
                 logger.warning("Ignoring duplicate entry for AMO ID %s (addon ID %s)" % (amo_id, ext["guid"]))
                 continue
-            id_seen.add(amo_id)
-            metadata.append(ext)
+            self.__seen.add(amo_id)
+            unique_results.append(ext)
+        return unique_results
+
+
+class MetadataCrawl(Crawl):
+    """Crawl of all public extensions, split into user count ranges that fit into the API result window"""
+
+    def __init__(self, max_pages=(2 << 31), max_ext=(2 << 31), page_size=50, min_users=0, max_users=0,
+                 cache=None, stats=None):
+        super().__init__(page_size, cache, stats)
+        self.max_pages = max_pages
+        self.max_ext = max_ext
+        self.min_users = min_users
+        self.max_users = max_users
+        self.__failed = False
+
+    async def pages(self):
+        """Async generator yielding lists of addon results"""
+        global logger
+        self._reset()
+        self.__failed = False
+
+        received = 0
+        queue = asyncio.Queue()
+        async with create_client_session() as session:
+            crawl = asyncio.ensure_future(self.__crawl(session, queue))
+            try:
+                while True:
+                    results = await queue.get()
+                    if results is None:
+                        break
+                    if isinstance(results, Exception):
+                        raise results
+                    results = self._dedup(results)[0:self.max_ext - received]
+                    received += len(results)
+                    if len(results) > 0:
+                        yield results
+                    if received >= self.max_ext:
+                        break
+            finally:
+                crawl.cancel()
+                await asyncio.gather(crawl, return_exceptions=True)
+
+        if self.count is None or self.__failed:
+            logger.error("Unable to fetch all pages. Please try again later")
+            return
+        if received < min(self.count, self.max_ext):
+            logger.warning("Got %d instead of the expected %d results" % (received, self.count))
+        self.complete = True
+
+    async def __crawl(self, session, queue):
+        try:
+            await self.__query(session, queue, self.min_users, self.max_users or None, True)
+            queue.put_nowait(None)
+        except Exception as err:
+            queue.put_nowait(err)
+
+    async def __query(self, session, queue, min_users, max_users, is_root):
+        global logger
+
+        # Maximum page_size seems to be 50 right now, 25 is AMO's current default.
+        search_params = "sort=created"
+        if min_users:
+            search_params += "&users__gte=%d" % min_users
+        if max_users is not None:
+            search_params += "&users__lt=%d" % max_users
+        logger.debug("Search parameters for AMO query: %s" % search_params)
+
+        # Grab page_size and count from first result page and calculate num_pages from that
+        first_page = None
+        async for _, first_page in crawl_json(session, self.limiter, [self._search_url(search_params)], self.cache):
+            pass
+        if first_page is None:
+            self.__failed = True
+            return
+        count = first_page["count"]
+        supported_page_size = int(first_page["page_size"])
+        if is_root:
+            logger.info("There are currently %d web extensions listed%s"
+                        % (count, describe_users_range(min_users, max_users)))
+            self.count = count
+            if self.page_size != supported_page_size:
+                logger.warning("Requested size %d is greater than supported size %d"
+                               % (self.page_size, supported_page_size))
+        else:
+            logger.debug("There are %d web extensions%s" % (count, describe_users_range(min_users, max_users)))
+        total_pages = int(math.ceil(count / supported_page_size))
+        num_pages = min(self.max_pages, total_pages)
+        max_pages_in_api = first_page["page_count"]
+        if num_pages > max_pages_in_api:
+            actual_result_count = max_pages_in_api * supported_page_size
+            split = split_users_range(min_users, max_users)
+            # Limited crawls are truncated anyway
+            if split is not None and (not is_root or (total_pages <= self.max_pages and count < self.max_ext)):
+                # The work-around here depends on the ability to partition the results in
+                # subsets. Ideally the AMO API should not have a cap on the result window:
+                # https://github.com/mozilla/addons-server/issues/20640
+                logger.info("Splitting query for %d web extensions%s at %d users to avoid truncation to %d results"
+                            % (count, describe_users_range(min_users, max_users), split, actual_result_count))
+                await asyncio.gather(self.__query(session, queue, min_users, split, False),
+                                     self.__query(session, queue, split, max_users, False))
+                return
+            logger.warning("Truncating results%s to %d pages (%d results) due to API limitation"
+                           % (describe_users_range(min_users, max_users), max_pages_in_api, actual_result_count))
+            num_pages = max_pages_in_api
+
+        queue.put_nowait(first_page["results"])
+
+        # NOTE: The logic below assumes the result set to be stable during the query.
+        # If an item is deleted during the query, another item may be missing or
+        # appear multiple times due to shifted items during pagination.
+        logger.info("Fetching %d pages of AMO metadata%s" % (num_pages, describe_users_range(min_users, max_users)))
+        pages_to_get = [self._search_url("%s&page=%d" % (search_params, n)) for n in range(2, num_pages + 1)]
+        pages_to_go = len(pages_to_get)
+        async for _, page in crawl_json(session, self.limiter, pages_to_get, self.cache):
+            pages_to_go -= 1
+            if pages_to_go % 25 == 0:
+                logger.info("%d pages to go" % pages_to_go)
+            if page is None:
+                self.__failed = True
+                continue
+            queue.put_nowait(page["results"])
+
+
+def split_users_range(min_users, max_users):
+    """Returns the user count at which to split a users range, or None if it can't be split"""
+    # Most extensions have very few users
+    if max_users is None:
+        return max(10, 10 * min_users)
+    if max_users - min_users < 2:
+        return None
+    split = int(math.sqrt(max(1, min_users) * max_users))
+    return min(max_users - 1, max(min_users + 1, split))
+
+
+def describe_users_range(min_users, max_users):
+    if min_users and max_users is not None:
+        return ", with at least %d and less than %d users" % (min_users, max_users)
+    elif min_users:
+        return ", with at least %d users" % min_users
+    elif max_users is not None:
+        return ", with less than %d users" % max_users
+    return ""
+
+
+class UpdateCrawl(Crawl):
+    """Crawl of the extensions created or updated since the largest `last_updated` timestamp of the last sync"""
+
+    def __init__(self, since, page_size=50, cache=None, stats=None):
+        super().__init__(page_size, cache, stats)
+        self.since = since
+        self.high_water_mark = since
+
+    async def pages(self):
+        global logger
+        self._reset()
+        self.high_water_mark = self.since
+
+        page_count = 1
+        page_no = 1
+        batch_size = 1
+        async with create_client_session() as session:
+            while page_no <= page_count:
+                page_numbers = range(page_no, min(page_no + batch_size, page_count + 1))
+                urls = [self._search_url("sort=updated&page=%d" % n) for n in page_numbers]
+                pages = {}
+                async for url, page in crawl_json(session, self.limiter, urls, self.cache):
+                    pages[url] = page
+                if None in pages.values():
+                    logger.error("Unable to fetch all pages. Please try again later")
+                    return
+
+                reached_mark = False
+                for url in urls:
+                    page = pages[url]
+                    if self.count is None:
+                        self.count = page["count"]
+                        page_count = page["page_count"]
+                    results = [e for e in page["results"] if e.get("last_updated", "") >= self.since]
+                    if len(results) < len(page["results"]):
+                        reached_mark = True
+                    for e in results:
+                        self.high_water_mark = max(self.high_water_mark, e["last_updated"])
+                    results = self._dedup(results)
+                    if len(results) > 0:
+                        yield results
+                if reached_mark:
+                    self.complete = True
+                    return
+
+                page_no += len(urls)
+                batch_size = min(2 * batch_size, int(self.limiter.limit))
+
+        if page_count * self.page_size < self.count:
+            logger.warning("Updates since %s exceed the API result window" % self.since)
+            return
+        self.complete = True
+
+
+class AdaptiveLimiter(object):
+    """Async context manager limiting concurrent AMO requests based on errors and latency"""
+
+    def __init__(self, initial=None, minimum=None, maximum=None, stats=None):
+        # Defaults are looked up late so they can be tuned at runtime
+        self.minimum = minimum if minimum is not None else MIN_CONCURRENT_REQUESTS
+        self.maximum = maximum if maximum is not None else MAX_CONCURRENT_REQUESTS
+        initial = initial if initial is not None else INITIAL_CONCURRENT_REQUESTS
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.in_flight = 0
+        self.stats = stats if stats is not None else RequestStats()
+        self.latency = None
+        self.base_latency = None
+        self.__round = 0
+        self.__errors = 0
+        self.__stale = 0
+        self.__condition = None
+
+    async def __aenter__(self):
+        if self.__condition is None:
+            self.__condition = asyncio.Condition()
+        async with self.__condition:
+            await self.__condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        self.stats.start()
+        return self
 
-    if len(metadata) != total_count:
-        # Could happen for several reasons, including but not limited to:
-        # - An extension was added or removed while querying.
-        # - user count updated, extension no longer in metadata_part_2.
-        logger.warning("Got %d instead of the expected %d results after combining two result sets" % (len(metadata), total_count))
-    return metadata[0:min(len(metadata), max_ext)]
+    async def __aexit__(self, *args):
+        self.stats.finish()
+        async with self.__condition:
+            self.in_flight -= 1
+            self.__condition.notify_all()
+
+    def record(self, latency, status):
+        """Account for a finished request. Status is None for connection errors."""
+        self.stats.response(latency, status, self.limit)
+        # Requests sent before the last back-off don't count
+        stale = self.__stale > 0
+        if stale:
+            self.__stale -= 1
+        failed = status is None or status == 429 or status >= 500
+        if not failed:
+            self.__track_latency(latency)
+        if stale:
+            return
+        if status == 429:
+            self.__back_off("status 429")
+            return
+        if failed:
+            self.__errors += 1
+
+        self.__round += 1
+        if self.__round < self.limit:
+            return
+        if self.__errors > ERROR_TOLERANCE * self.__round:
+            self.__back_off("%d errors in %d requests" % (self.__errors, self.__round))
+            return
+        # Rising latency is how server-side queueing shows up
+        if self.latency is not None and self.latency > LATENCY_TOLERANCE * self.base_latency:
+            self.limit = max(self.minimum, self.limit * 0.9)
+        elif self.__errors == 0:
+            self.limit = min(self.maximum, self.limit + 1)
+        self.__round = 0
+        self.__errors = 0
+
+    def __track_latency(self, latency):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = 0.8 * self.latency + 0.2 * latency
+        if self.base_latency is None or self.latency < self.base_latency:
+            self.base_latency = self.latency
+
+    def __back_off(self, reason):
+        global logger
+        self.__stale = max(0, self.in_flight - 1)
+        self.__round = 0
+        self.__errors = 0
+        self.limit = max(self.minimum, self.limit / 2)
+        logger.debug("Reducing concurrent requests to %d after %s" % (self.limit, reason))
+
+
+class RetryScheduler(object):
+    """Queue of request items with retry backoff and a circuit breaker for consecutive failures"""
+
+    def __init__(self, items=(), max_attempts=MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+        self.attempts = {}
+        self.errors = {}
+        self.outstanding = 0
+        self.__heap = []
+        self.__sequence = itertools.count()
+        self.__wakeup = None
+        self.__consecutive_failures = 0
+        self.__open_until = 0.0
+        self.__cooldown = BREAKER_COOLDOWN
+        self.__probing = False
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        self.outstanding += 1
+        self.__push(item, 0.0)
+
+    def __push(self, item, delay):
+        heapq.heappush(self.__heap, (time.monotonic() + delay, next(self.__sequence), item))
+        self.__notify()
+
+    def __notify(self):
+        if self.__wakeup is not None:
+            self.__wakeup.set()
+
+    async def get(self):
+        """Waits for the next item that is due, returns None once all items are dealt with"""
+        if self.__wakeup is None:
+            self.__wakeup = asyncio.Event()
+        while self.outstanding > 0:
+            timeout = None
+            if len(self.__heap) > 0 and not self.__probing:
+                now = time.monotonic()
+                due = max(self.__heap[0][0], self.__open_until)
+                if due <= now:
+                    _, _, item = heapq.heappop(self.__heap)
+                    if self.__open_until > 0:
+                        self.__probing = True
+                    return item
+                timeout = due - now
+            self.__wakeup.clear()
+            try:
+                await asyncio.wait_for(self.__wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return None
+
+    def success(self, item):
+        self.__done(item)
+
+    def give_up(self, item):
+        """Takes an item out of rotation, e.g. due to a permanent client error"""
+        self.__done(item)
+
+    def __done(self, item):
+        global logger
+        self.outstanding -= 1
+        self.__consecutive_failures = 0
+        if self.__open_until > 0:
+            logger.info("AMO is responding again, resuming requests")
+            self.__open_until = 0.0
+            self.__cooldown = BREAKER_COOLDOWN
+            self.__probing = False
+        self.__notify()
+
+    def failure(self, item, status=None, retry_after=None):
+        """Reschedules an item after a failed attempt, returns False if it ran out of attempts"""
+        global logger
+        attempts = self.attempts.get(item, 0) + 1
+        self.attempts[item] = attempts
+        self.errors[status] = self.errors.get(status, 0) + 1
+        self.__consecutive_failures += 1
+
+        now = time.monotonic()
+        if self.__probing:
+            self.__probing = False
+            self.__cooldown = min(2 * self.__cooldown, BREAKER_MAX_COOLDOWN)
+            self.__open_until = now + self.__cooldown
+            logger.warning("AMO is still failing, pausing requests for %d seconds" % self.__cooldown)
+        elif self.__open_until == 0 and self.__consecutive_failures >= BREAKER_THRESHOLD:
+            self.__open_until = now + self.__cooldown
+            logger.warning("AMO failed %d requests in a row, pausing requests for %d seconds"
+                           % (self.__consecutive_failures, self.__cooldown))
+
+        if attempts >= self.max_attempts:
+            logger.error("Giving up on `%s` after %d attempts" % (item, attempts))
+            self.outstanding -= 1
+            self.__notify()
+            return False
+
+        delay = backoff_delay(attempts)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        logger.debug("Retrying `%s` in %.1f seconds" % (item, delay))
+        self.__push(item, delay)
+        return True
+
+
+def backoff_delay(attempts):
+    """Exponential backoff with jitter"""
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+def parse_retry_after(value):
+    """Returns the delay in seconds requested by a Retry-After header, or None"""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+async def crawl_json(session, limiter, urls, cache=None):
+    """Async generator yielding (url, document) as downloads finish, with None for failed documents"""
+    global logger
+    scheduler = RetryScheduler(urls)
+    done = asyncio.Queue()
+
+    async def worker():
+        try:
+            while True:
+                url = await scheduler.get()
+                if url is None:
+                    return
+                request_headers = cache.validators(url) if cache is not None else None
+                status, body, headers = await fetch(session, limiter, url, request_headers)
+                if status == 304 and request_headers:
+                    document = cache.get(url)
+                    scheduler.success(url)
+                    if document is None:
+                        # Evicted by another request in the meantime
+                        scheduler.add(url)
+                        continue
+                    done.put_nowait((url, document))
+                elif status == 200:
+                    scheduler.success(url)
+                    start = time.monotonic()
+                    try:
+                        document = json.loads(body)
+                    except ValueError as err:
+                        logger.error("Invalid JSON in `%s`: %s" % (url, str(err)))
+                        done.put_nowait((url, None))
+                        continue
+                    finally:
+                        limiter.stats.decode(time.monotonic() - start)
+                    if cache is not None:
+                        cache.put(url, body, headers.get("ETag"), headers.get("Last-Modified"))
+                    done.put_nowait((url, document))
+                elif status is not None and 400 <= status < 500 and status != 429:
+                    scheduler.give_up(url)
+                    done.put_nowait((url, None))
+                elif not scheduler.failure(url, status, parse_retry_after(headers.get("Retry-After"))):
+                    done.put_nowait((url, None))
+        except Exception as err:
+            # Hand unexpected errors to the consumer rather than leaving it waiting
+            done.put_nowait(err)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(min(len(urls), limiter.maximum))]
+    try:
+        for _ in range(len(urls)):
+            result = await done.get()
+            if isinstance(result, Exception):
+                raise result
+            yield result
+    finally:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        limiter.stats.retry_summary(scheduler)
+
+
+async def fetch(session, limiter, url, headers=None):
+    """Returns status code, body and response headers, or None, None, {} on connection errors"""
+    global logger
+    async with limiter:
+        start = time.monotonic()
+        try:
+            async with session.get(url, headers=headers) as response:
+                status = response.status
+                body = await response.read()
+                response_headers = response.headers
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            logger.error("Unable to download `%s`: %s" % (url, repr(err)))
+            limiter.record(time.monotonic() - start, None)
+            return None, None, {}
+        limiter.record(time.monotonic() - start, status)
+        limiter.stats.transfer(len(body), time.monotonic() - start)
+    if status == 200:
+        logger.debug("Downloaded %d bytes from `%s`" % (len(body), url))
+    elif status == 304:
+        logger.debug("`%s` is unchanged" % url)
+    else:
+        logger.error("Unable to download `%s`, status code %d" % (url, status))
+    return status, body, response_headers
+
+
+def create_client_session():
+    # Share connections between requests to avoid overusing file descriptors.
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS)
+    timeout = aiohttp.ClientTimeout(sock_connect=REQUEST_TIMEOUT, sock_read=REQUEST_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
 
 
 def __as_chunks(flat_list, chunk_size):
@@ -145,58 +738,231 @@ def __as_chunks(flat_list, chunk_size):
         yield flat_list[i:i + chunk_size]
 
 
-def update_files(metadata, hash_fs):
-    urls_to_get = []
+def update_files(metadata, hash_fs, journal=None, stats=None, priority=None, max_files=None, max_bytes=None,
+                 max_time=None, inventory=None):
+    """Downloads the files referenced by |metadata| that are not in |hash_fs| yet, within the given budgets"""
+    global logger
+    if journal is None:
+        journal = DownloadJournal()
+
+    known = set()
+    wanted = {}
+    urls = set()
+    skipped = 0
     for ext in metadata:
         for ext_file in ext.files():
             ext_file_hash_type, ext_file_hash = ext_file["hash"].split(":")
             assert ext_file_hash_type == "sha256"
-            if hash_fs.get(ext_file_hash) is None:
-                if ext_file["url"] in urls_to_get:
-                    logger.warning("Duplicate URL in metadata: %s" % ext_file["url"])
-                urls_to_get.append(ext_file["url"])
+            url = ext_file["url"]
+            if url in urls:
+                logger.warning("Duplicate URL in metadata: %s" % url)
+            urls.add(url)
+            known.add(ext_file_hash)
+            # Finished downloads may have been pruned from the cache since
+            if inventory is not None:
+                cached = ext_file_hash in inventory
             else:
-                logger.debug("`%s` is already cached locally" % ext_file_hash)
+                cached = os.path.isfile(hash_fs.idpath(ext_file_hash, ".zip"))
+            if cached:
+                if not journal.is_done(ext_file_hash):
+                    logger.debug("`%s` is already cached locally" % ext_file_hash)
+                    journal.finish(ext_file_hash, url)
+                continue
+            if journal.is_failed(ext_file_hash, url):
+                skipped += 1
+                continue
+            journal.add(ext_file_hash, url)
+            wanted[ext_file_hash] = (ext, ext_file)
 
-    logger.info("Fetching %d uncached web extensions from AMO" % len(urls_to_get))
+    # Leftovers of interrupted runs may have vanished from the metadata since
+    pending = [(url, ext_hash) for url, ext_hash in journal.pending() if ext_hash in wanted]
+    files_to_get = plan_downloads(pending, wanted, priority, max_files, max_bytes)
+    if skipped > 0:
+        logger.info("Skipping %d web extensions that recently failed to download" % skipped)
+    if len(files_to_get) < len(pending):
+        logger.info("Leaving %d uncached web extensions for the next run due to the download budget"
+                    % (len(pending) - len(files_to_get)))
+    logger.info("Fetching %d uncached web extensions from AMO" % len(files_to_get))
 
-    session = create_request_session()
+    loop = asyncio.new_event_loop()
+    try:
+        failed = loop.run_until_complete(download_files(hash_fs, files_to_get, journal, stats, max_time, inventory))
+    finally:
+        loop.close()
+        journal.compact(known)
+
+    if failed > 0:
+        logger.warning("Unable to fetch %d extensions, likely deleted add-ons" % failed)
 
-    while True:
-        fatal_errors = 0
-        unsent_requests = [grequests.get(url, verify=True, session=session) for url in urls_to_get]
-        for response in grequests.imap(unsent_requests, size=MAX_CONCURRENT_REQUESTS):
-            if response.status_code == 200:
-                logger.debug("Downloaded %d bytes from `%s`" % (len(response.content), response.url))
-                try:
-                    hash_fs.put(BytesIO(response.content), ".zip")
-                except ValueError as err:
-                    # probably the mysterious ValueError: embedded null byte
-                    logger.error("Unable to store `%s` in local cache: %s" % (response.url, str(err)))
-                    continue
-                try:
-                    original_url = response.history[0].url
-                except IndexError:
-                    # There was no redirect
-                    original_url = response.url
-                urls_to_get.remove(original_url)
-            else:
-                logger.error("Unable to download `%s`, status code %d" % (response.url, response.status_code))
-                if 400 <= response.status_code < 500:
-                    fatal_errors += 1
-            if len(urls_to_get) % 100 == 0:
-                logger.info("%d extensions to go" % len(urls_to_get))
 
-        if len(urls_to_get) == fatal_errors:
+def plan_downloads(files, info, priority=None, max_files=None, max_bytes=None):
+    """Returns the (url, hash) |files| to download in |priority| order and within budget"""
+    if priority is not None:
+        if priority not in DOWNLOAD_PRIORITIES:
+            raise ValueError("Unknown download priority `%s`" % priority)
+        key, reverse = DOWNLOAD_PRIORITIES[priority]
+        files = sorted(files, key=lambda f: key(*info[f[1]]), reverse=reverse)
+
+    selected = []
+    planned_bytes = 0
+    for url, ext_hash in files:
+        if max_files is not None and len(selected) >= max_files:
             break
+        size = info[ext_hash][1].get("size") or 0
+        if max_bytes is not None and planned_bytes + size > max_bytes:
+            continue
+        planned_bytes += size
+        selected.append((url, ext_hash))
 
-    if len(urls_to_get) > 0:
-        logger.warning("Unable to fetch %d extensions, likely deleted add-ons" % len(urls_to_get))
+    small = deque(f for f in selected if (info[f[1]][1].get("size") or 0) < LARGE_FILE_SIZE)
+    large = deque(f for f in selected if (info[f[1]][1].get("size") or 0) >= LARGE_FILE_SIZE)
+    rank = dict((f, n) for n, f in enumerate(selected))
+    ordered = []
+    large_count = 0
+    while len(small) > 0 or len(large) > 0:
+        # Large files don't get to tie up every connection
+        take_large = len(small) == 0 or (len(large) > 0 and rank[large[0]] < rank[small[0]]
+                                         and large_count < LARGE_FILE_SHARE * (len(ordered) + 1))
+        if take_large:
+            ordered.append(large.popleft())
+            large_count += 1
+        else:
+            ordered.append(small.popleft())
+    return ordered
 
 
-def create_request_session():
-    # Share connections between requests to avoid overusing file descriptors.
-    a = requests.adapters.HTTPAdapter(pool_maxsize=MAX_CONCURRENT_REQUESTS)
-    session = requests.Session()
-    session.mount('https://', a)
-    return session
+def get_incoming_dir(hash_fs):
+    # Next to the cache, so files can be moved in atomically
+    return os.path.join(os.path.dirname(hash_fs.root), "webext_incoming")
+
+
+async def download_files(hash_fs, files, journal, stats=None, max_time=None, inventory=None):
+    """Downloads a list of (url, sha256) files into hash_fs, returns the number of failed files"""
+    global logger
+    incoming_dir = get_incoming_dir(hash_fs)
+    os.makedirs(incoming_dir, exist_ok=True)
+    for stale_file in glob.glob(os.path.join(incoming_dir, "*.part")):
+        os.unlink(stale_file)
+
+    limiter = AdaptiveLimiter(stats=stats)
+    hashes = dict(files)
+    scheduler = RetryScheduler(hashes.keys())
+    done = asyncio.Queue()
+    deadline = None if max_time is None else time.monotonic() + max_time
+
+    async def worker():
+        try:
+            while True:
+                url = await scheduler.get()
+                if url is None:
+                    return
+                ext_hash = hashes[url]
+                if deadline is not None and time.monotonic() >= deadline:
+                    scheduler.give_up(url)
+                    journal.defer(ext_hash)
+                    done.put_nowait(None)
+                    continue
+                journal.start(ext_hash)
+                status, stored, retry_after = await download_file(session, limiter, url, ext_hash, hash_fs,
+                                                                  incoming_dir)
+                if stored:
+                    scheduler.success(url)
+                    journal.finish(ext_hash)
+                    if inventory is not None:
+                        inventory.add(ext_hash)
+                    done.put_nowait(True)
+                elif status is None or status == 429 or status >= 500:
+                    if not scheduler.failure(url, status, retry_after):
+                        journal.defer(ext_hash)
+                        done.put_nowait(False)
+                elif status == 200:
+                    # Hash mismatch, possibly due to outdated metadata
+                    scheduler.give_up(url)
+                    journal.defer(ext_hash)
+                    done.put_nowait(False)
+                else:
+                    scheduler.give_up(url)
+                    journal.fail(ext_hash, status)
+                    done.put_nowait(False)
+        except Exception as err:
+            done.put_nowait(err)
+
+    failed = 0
+    deferred = 0
+    async with create_client_session() as session:
+        workers = [asyncio.ensure_future(worker()) for _ in range(min(len(hashes), limiter.maximum))]
+        try:
+            for to_go in range(len(hashes) - 1, -1, -1):
+                result = await done.get()
+                if isinstance(result, Exception):
+                    raise result
+                if result is None:
+                    deferred += 1
+                elif not result:
+                    failed += 1
+                if to_go % 100 == 0:
+                    logger.info("%d extensions to go" % to_go)
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            limiter.stats.retry_summary(scheduler)
+    if deferred > 0:
+        logger.info("Leaving %d uncached web extensions for the next run due to the time budget" % deferred)
+    return failed
+
+
+async def download_file(session, limiter, url, ext_hash, hash_fs, incoming_dir):
+    """Streams a file into hash_fs if it matches |ext_hash|, returns status, whether it was stored and Retry-After"""
+    global logger
+    async with limiter:
+        start = time.monotonic()
+        status = None
+        fd, temp_path = tempfile.mkstemp(suffix=".part", dir=incoming_dir)
+        try:
+            hash_obj = hashlib.sha256()
+            size = 0
+            disk_time = 0.0
+            with os.fdopen(fd, "wb") as f:
+                async with session.get(url) as response:
+                    status = response.status
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    # Time to the response headers, regardless of file size
+                    limiter.record(time.monotonic() - start, status)
+                    if status == 200:
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            hash_obj.update(chunk)
+                            write_start = time.monotonic()
+                            f.write(chunk)
+                            disk_time += time.monotonic() - write_start
+                            size += len(chunk)
+            limiter.stats.transfer(size, time.monotonic() - start - disk_time)
+            limiter.stats.disk(disk_time)
+            if status != 200:
+                logger.error("Unable to download `%s`, status code %d" % (url, status))
+                return status, False, retry_after
+            if hash_obj.hexdigest() != ext_hash:
+                logger.error("Hash mismatch for `%s`: expected %s, got %s" % (url, ext_hash, hash_obj.hexdigest()))
+                return status, False, None
+            logger.debug("Downloaded %d bytes from `%s`" % (size, url))
+            store_start = time.monotonic()
+            store_file(hash_fs, temp_path, ext_hash)
+            limiter.stats.disk(time.monotonic() - store_start)
+            return status, True, None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            logger.error("Unable to download `%s`: %s" % (url, repr(err)))
+            if status is None:
+                limiter.record(time.monotonic() - start, None)
+            return None, False, None
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+
+def store_file(hash_fs, temp_path, ext_hash):
+    """Atomically moves a verified file into its hash_fs location"""
+    file_path = hash_fs.idpath(ext_hash, ".zip")
+    hash_fs.makepath(os.path.dirname(file_path))
+    os.chmod(temp_path, hash_fs.fmode)
+    os.replace(temp_path, file_path)
+    return file_path
@@ -5,11 +5,22 @@
 import hashfs
 import logging
 import os
-import re
 
 from . import amo
+from . import hashindex as hi
+from . import inventory as iv
+from . import httpcache as hc
+from . import journal as dj
+from . import manifestcache as mc
 from . import metadata as md
+from . import nameindex as ni
+from . import permindex as pi
+from . import selection as sel
+from . import snapshots as sn
+from . import telemetry as tm
+from . import unzipcache as uc
 from . import webext as we
+from . import zipindex as zi
 
 
 logger = logging.getLogger(__name__)
@@ -22,6 +33,13 @@ class Database(object):
         self.args = args
         self.meta = metadata
         self.file_db = files
+        self.__names = None
+        self.__permissions = None
+        self.__hashes = None
+        self.__inventory = None
+        self.__members = None
+        self.__manifests = None
+        self.__unzip_cache = None
 
         if self.file_db is None:
             db_dir = os.path.join(self.args.workdir, "webext_data")
@@ -30,69 +48,232 @@ class Database(object):
             self.file_db = hashfs.HashFS(db_dir, depth=4, width=1, algorithm='sha256')
 
         if self.meta is None:
-            self.meta = md.Metadata(filename=md.get_metadata_file(self.args))
+            self.meta = md.open_metadata(self.args)
 
     def sync(self):
+        stats = tm.SyncStats(self.args.stats_interval)
+        try:
+            self.__sync(stats)
+        finally:
+            stats.save(tm.get_stats_file(self.args))
+            logger.info("Sync stats written to `%s`" % tm.get_stats_file(self.args))
+
+    def __sync(self, stats):
         if self.args.nometa:
             logger.warning("Using cached AMO metadata, not updating")
         else:
-            logger.info("Downloading current metadata set from AMO")
-            self.meta = md.Metadata(filename=md.get_metadata_file(self.args),
-                                    data=amo.download_metadata())
-            self.meta.save()
+            cache = hc.ResponseCache(hc.get_response_cache_file(self.args))
+            try:
+                if not self.args.incremental or not self.update_metadata(cache, stats.section("metadata")):
+                    self.download_metadata(cache, stats.section("metadata"))
+            finally:
+                cache.save()
         logger.info("Metadata set contains %d web extensions" % len(self.meta))
         logger.info("Downloading missing web extensions")
-        amo.update_files(self.meta, self.file_db)
+        journal = dj.DownloadJournal(dj.get_journal_file(self.args))
+        # Files may have been pruned from the cache since the last run
+        self.inventory.rescan()
+        try:
+            amo.update_files(self.meta, self.file_db, journal, stats.section("files"), priority=self.args.priority,
+                             max_files=self.args.max_files, max_bytes=self.args.max_bytes,
+                             max_time=self.args.max_time, inventory=self.inventory)
+        finally:
+            journal.close()
+            self.inventory.save()
+        self.update_member_index()
+        self.update_manifest_cache()
 
-    def match(self, selectors):
+    def download_metadata(self, cache=None, stats=None):
+        logger.info("Downloading current metadata set from AMO")
+        meta = md.Metadata(filename=md.get_metadata_file(self.args), data=[])
+        crawl = amo.MetadataCrawl(cache=cache, stats=stats)
+        for results in crawl:
+            meta.ingest(results)
+        if not crawl.complete:
+            logger.warning("Keeping cached AMO metadata")
+            return False
+        self.meta = meta
+        self.save_metadata()
+        md.save_sync_state(self.args, {"high_water_mark": self.meta.last_updated()})
+        return True
+
+    def update_metadata(self, cache=None, stats=None):
+        state = md.load_sync_state(self.args)
+        if state.get("high_water_mark") is None or len(self.meta) == 0:
+            logger.info("No previous metadata sync recorded, downloading full metadata set")
+            return False
+        logger.info("Downloading metadata updates since %s from AMO" % state["high_water_mark"])
+        # Update a copy, so a failed update leaves the cached metadata intact
+        meta = md.Metadata(filename=md.get_metadata_file(self.args), data=self.meta.raw_data())
+        high_water_mark = amo.update_metadata(meta, state["high_water_mark"], cache, stats)
+        if high_water_mark is None:
+            logger.warning("Unable to update metadata incrementally, downloading full metadata set")
+            return False
+        self.meta = meta
+        self.save_metadata()
+        md.save_sync_state(self.args, {"high_water_mark": high_water_mark})
+        return True
+
+    def save_metadata(self):
+        """Writes the metadata file along with the indexed metadata database and a snapshot"""
+        self.meta.save()
+        md.MetadataDB.create(md.get_metadata_db_file(self.args), self.meta).close()
+        sn.SnapshotStore(sn.get_snapshot_dir(self.args)).record(self.meta)
+        self.__names = None
+        self.__permissions = None
+        if self.__hashes is not None:
+            self.__hashes.close()
+            self.__hashes = None
+        logger.info("Indexed %d extension names and %d permissions"
+                    % (len(self.names), len(self.permissions.permissions())))
+
+    def __metadata_stamp(self):
+        """Returns the version of metadata that was read from a file, or None"""
+        if self.meta.filename is None or self.args.workdir is None:
+            return None
+        return md.get_metadata_stamp(self.meta.filename)
+
+    def __open_index(self, index_class, filename):
+        """Opens an index of the metadata, persisted in |filename| for metadata that was read from a file"""
+        stamp = self.__metadata_stamp()
+        if stamp is None:
+            return index_class.from_metadata(self.meta)
+        return index_class.open(filename, self.meta, stamp)
+
+    @property
+    def names(self):
+        if self.__names is None:
+            self.__names = self.__open_index(ni.NameIndex, ni.get_name_index_file(self.args))
+        return self.__names
+
+    @property
+    def permissions(self):
+        if self.__permissions is None:
+            self.__permissions = self.__open_index(pi.PermissionIndex, pi.get_permission_index_file(self.args))
+        return self.__permissions
+
+    @property
+    def hashes(self):
+        """Hash index of the metadata, rebuilt when the metadata changes"""
+        if self.__hashes is None:
+            stamp = self.__metadata_stamp()
+            if stamp is not None:
+                self.__hashes = hi.HashIndex.open(hi.get_hash_index_file(self.args))
+            if self.__hashes is None or self.__hashes.stamp != stamp:
+                self.update_hash_index()
+        return self.__hashes
+
+    def update_hash_index(self):
+        """Rebuilds the hash index from the metadata"""
+        if self.__hashes is not None:
+            self.__hashes.close()
+        stamp = self.__metadata_stamp()
+        if stamp is None:
+            self.__hashes = hi.HashIndex(hi.HashIndex.build(self.meta, None))
+        else:
+            self.__hashes = hi.HashIndex.create(hi.get_hash_index_file(self.args), self.meta, stamp)
+
+    @property
+    def inventory(self):
+        """Inventory of the file store, persisted in the work directory if there is one"""
+        if self.__inventory is None:
+            filename = None if self.args.workdir is None else iv.get_inventory_file(self.args)
+            self.__inventory = iv.FileInventory(self.file_db, filename)
+        return self.__inventory
+
+    @property
+    def members(self):
+        """Index of the zip members of the files in the file store"""
+        if self.__members is None:
+            self.update_member_index()
+        return self.__members
+
+    def update_member_index(self):
+        """Indexes the zip members of new files in the inventory and drops those of files that are gone"""
+        if self.__members is None:
+            filename = ":memory:" if self.args.workdir is None else zi.get_zip_index_file(self.args)
+            self.__members = zi.ZipIndex(filename)
+        added, removed = self.__members.update(self.inventory)
+        if added > 0 or removed > 0:
+            logger.info("Indexed zip members of %d new files, dropped %d" % (added, removed))
+
+    @property
+    def manifests(self):
+        """Cache of the parsed manifests of the files in the file store"""
+        if self.__manifests is None:
+            self.update_manifest_cache()
+        return self.__manifests
+
+    def update_manifest_cache(self):
+        """Parses the manifests of new files in the inventory and drops those of files that are gone"""
+        if self.__manifests is None:
+            filename = ":memory:" if self.args.workdir is None else mc.get_manifest_cache_file(self.args)
+            self.__manifests = mc.ManifestCache(filename)
+        added, removed = self.__manifests.update(self.inventory)
+        if added > 0 or removed > 0:
+            logger.info("Cached manifests of %d new files, dropped %d" % (added, removed))
+
+    def manifest(self, ext_id):
+        """Returns the Manifest of a file in the file store, or None if it is missing or has none"""
+        try:
+            return self.manifests.get(ext_id)
+        except KeyError:
+            pass
+        path = self.resolve(ext_id)
+        if path is None:
+            return None
+        self.manifests.add(ext_id, path)
+        return self.manifests.get(ext_id)
+
+    @property
+    def unzip_cache(self):
+        """Cache of extracted extensions shared between runs, or None if disabled by a zero budget"""
+        if self.__unzip_cache is None and self.args.workdir is not None and uc.get_unzip_cache_budget(self.args) > 0:
+            self.__unzip_cache = uc.UnzipCache(uc.get_unzip_cache_dir(self.args), uc.get_unzip_cache_budget(self.args))
+        return self.__unzip_cache
+
+    def orphans(self):
+        """Returns the hashes of the files in the file store that are not referenced by the metadata"""
+        return set(ext_id for ext_id in self.inventory if ext_id not in self.hashes)
+
+    def select(self, selectors):
+        """
+        Yields (amo_id, ext_id, path) for the extension files selected by
+        |selectors| as they are found, see selection.compile_selectors().
+        The path is None for files missing from the file store.
+        """
         if type(selectors) is not list and type(selectors) is not tuple:
             selectors = [selectors]
-        logger.debug("Matching for %s" % repr(selectors))
+        logger.debug("Selecting %s" % repr(selectors))
+        plan = sel.compile_selectors(self, selectors)
+        if plan is None:
+            return
+        for amo_id, ext_id in plan:
+            yield amo_id, ext_id, self.resolve(ext_id)
+        self.inventory.save()
 
-        selection = {}
-        for selector in selectors:
-            if selector == "all":
-                for amo_ext in self.meta:
-                    for ext_id in amo_ext.file_hashes():
-                        if amo_ext.id not in selection:
-                            selection[amo_ext.id] = set()
-                        selection[amo_ext.id].add(ext_id)
-            elif selector == "orphans":
-                for file_path in self.file_db:
-                    ext_id = self.file_db.get(file_path).id
-                    if not self.meta.is_known_hash(ext_id):
-                        if None not in selection:
-                            selection[None] = set()
-                        selection[None].add(ext_id)
-            elif self.meta.is_known_id(selector):
-                amo_ext = self.meta.get_by_id(selector)
-                for ext_id in amo_ext.file_hashes():
-                    if amo_ext.id not in selection:
-                        selection[amo_ext.id] = set()
-                    selection[amo_ext.id].add(ext_id)
-            elif self.meta.is_known_hash(selector):
-                amo_ext = self.meta.get_by_hash(selector)
-                if amo_ext.id not in selection:
-                    selection[amo_ext.id] = set()
-                selection[amo_ext.id].add(selector)
-            elif type(selector) is str and len(selector) == 64 and self.file_db.get(selector) is not None:
-                amo_id = None
-                if amo_id not in selection:
-                    selection[amo_id] = set()
-                selection[amo_id].add(selector)
-            else:
-                try:
-                    m = re.compile(selector, re.IGNORECASE)
-                except re.error:
-                    logger.error("Invalid selector `%s`" % selector)
-                    continue
-                for amo_ext in self.meta:
-                    if m.match(amo_ext.name) is not None:
-                        for ext_id in amo_ext.file_hashes():
-                            if amo_ext.id not in selection:
-                                selection[amo_ext.id] = set()
-                            selection[amo_ext.id].add(ext_id)
+    def resolve(self, ext_id):
+        """
+        Returns the path of the file stored under the hash |ext_id|, or None
+        if it isn't in the file store. Costs one existence check, which also
+        updates the inventory for files stored or pruned by other processes.
+        """
+        path = iv.hash_path(self.file_db.root, ext_id, self.file_db.depth, self.file_db.width)
+        if not os.path.isfile(path):
+            if ext_id in self.inventory:
+                logger.warning("File `%s` is gone from the file store" % ext_id)
+                self.inventory.remove(ext_id)
+            return None
+        if ext_id not in self.inventory:
+            self.inventory.add(ext_id, path)
+        return path
 
+    def match(self, selectors):
+        selection = {}
+        for amo_id, ext_id, _ in self.select(selectors):
+            if amo_id not in selection:
+                selection[amo_id] = set()
+            selection[amo_id].add(ext_id)
         return selection
 
     def get_meta(self, selectors):
@@ -102,19 +283,20 @@ class Database(object):
             meta[amo_id] = self.meta.get_by_id(amo_id)
         return meta
 
+    def iter_ext(self, selectors):
+        """Yields (amo_id, ext_id, WebExtension) for the selected extensions in the file store"""
+        for amo_id, ext_id, path in self.select(selectors):
+            if path is None:
+                logger.warning("Cache miss for ID %s - %s" % (amo_id, ext_id))
+                continue
+            yield amo_id, ext_id, we.WebExtension(path, ext_id, self.unzip_cache)
+
     def get_ext(self, selectors):
         extensions = {}
-        match = self.match(selectors)
-        for amo_id in match:
-            for ext_id in match[amo_id]:
-                file_ref = self.file_db.get(ext_id)
-                if file_ref is None:
-                    logger.warning("Cache miss for ID %s - %s" % (amo_id, ext_id))
-                    continue
-                file_path = file_ref.abspath
-                if amo_id not in extensions:
-                    extensions[amo_id] = {}
-                extensions[amo_id][ext_id] = we.WebExtension(file_path)
+        for amo_id, ext_id, ext in self.iter_ext(selectors):
+            if amo_id not in extensions:
+                extensions[amo_id] = {}
+            extensions[amo_id][ext_id] = ext
         return extensions
 
     def grep(self, pattern, selectors=None):
@@ -0,0 +1,268 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from datetime import datetime, timedelta
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+import zipfile
+
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+class FakeAMO(object):
+    """
+    Local stand-in for the AMO search API and file downloads,
+    serving a generated corpus of |count| extensions.
+
+    Every response is delayed by |latency| seconds, and a random |error_rate|
+    share of requests fails with 503, optionally asking clients to come back
+    after |retry_after| seconds. Like AMO, search results are capped at
+    |max_results| and pages at |max_page_size| results. Search result pages
+    carry an ETag and unchanged ones are answered with 304 to conditional
+    requests. Downloads go through a number of |redirects|, like AMO's
+    redirects to its CDN.
+
+    Use as context manager. While running, `url` points to the server root.
+    """
+
+    def __init__(self, count=200, latency=0.0, max_results=30000, max_page_size=50, xpi_padding=0, error_rate=0.0,
+                 retry_after=None, redirects=0):
+        self.count = count
+        self.latency = latency
+        self.max_results = max_results
+        self.max_page_size = max_page_size
+        self.xpi_padding = xpi_padding
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.redirects = redirects
+        self.requests = 0
+        self.pages = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self.corrupt = set()
+        self.random = random.Random(0)
+        self.lock = threading.Lock()
+        self.corpus = []
+        self.xpis = {}
+        self.__results = {}
+        self.__server = None
+        self.__thread = None
+
+    @property
+    def url(self):
+        host, port = self.__server.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def __enter__(self):
+        self.__server = FakeAMOServer(("127.0.0.1", 0), FakeAMOHandler)
+        self.__server.daemon_threads = True
+        self.__server.fake_amo = self
+        for amo_id in range(self.count, 0, -1):
+            xpi = generate_xpi(amo_id, self.xpi_padding)
+            self.xpis[amo_id] = xpi
+            self.corpus.append(generate_addon(amo_id, xpi, self.url))
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+
+    def add(self, amo_id):
+        xpi = generate_xpi(amo_id, self.xpi_padding)
+        self.xpis[amo_id] = xpi
+        addon = generate_addon(amo_id, xpi, self.url)
+        addon["created"] = addon["last_updated"] = self.__now()
+        self.corpus.insert(0, addon)
+        self.__results = {}
+        return addon
+
+    def update(self, amo_id):
+        addon = self.get(amo_id)
+        addon["current_version"]["version"] = "2.0"
+        addon["last_updated"] = self.__now()
+        self.__results = {}
+        return addon
+
+    def delist(self, amo_id):
+        self.corpus.remove(self.get(amo_id))
+        self.__results = {}
+
+    def get(self, amo_id):
+        return [a for a in self.corpus if a["id"] == amo_id][0]
+
+    def __now(self):
+        # Anything touched during the test is newer than the generated corpus.
+        return (datetime(2030, 1, 1) + timedelta(seconds=len(self.corpus) + self.requests)).strftime(TIME_FORMAT)
+
+    def search(self, query):
+        # Filtering a large corpus for every page would make the server the bottleneck
+        key = tuple(query.get(k) for k in ("guid", "sort", "users__gte", "users__lt"))
+        results = self.__results.get(key)
+        if results is None:
+            results = self.__results[key] = self.__filter(query)
+        page_size = min(int(query.get("page_size", 25)), self.max_page_size)
+        page = int(query.get("page", 1))
+        page_count = max(1, int(math.ceil(min(len(results), self.max_results) / page_size)))
+        if page > page_count:
+            return 404, {"detail": "Invalid page."}
+        return 200, {
+            "count": len(results),
+            "page_size": page_size,
+            "page_count": page_count,
+            "next": None,
+            "previous": None,
+            "results": results[(page - 1) * page_size:page * page_size]
+        }
+
+    def __filter(self, query):
+        results = self.corpus
+        if "guid" in query:
+            guids = set(query["guid"].split(","))
+            results = [a for a in results if a["guid"] in guids]
+        if query.get("sort") == "updated":
+            results = sorted(results, key=lambda a: a["last_updated"], reverse=True)
+        if "users__gte" in query:
+            results = [a for a in results if a["average_daily_users"] >= int(query["users__gte"])]
+        if "users__lt" in query:
+            results = [a for a in results if a["average_daily_users"] < int(query["users__lt"])]
+        return results
+
+    def download(self, amo_id):
+        if amo_id not in self.xpis:
+            return 404, b"Not found."
+        if amo_id in self.corrupt:
+            return 200, b"corrupted" + self.xpis[amo_id]
+        return 200, self.xpis[amo_id]
+
+
+class FakeAMOServer(ThreadingHTTPServer):
+
+    def handle_error(self, request, client_address):
+        # Clients dropping connections is business as usual.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeAMOHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        fake_amo = self.server.fake_amo
+        with fake_amo.lock:
+            fake_amo.requests += 1
+            fail = fake_amo.random.random() < fake_amo.error_rate
+        if fake_amo.latency:
+            time.sleep(fake_amo.latency)
+        if fail:
+            headers = {}
+            if fake_amo.retry_after is not None:
+                headers["Retry-After"] = str(fake_amo.retry_after)
+            self.send_body(503, b"Service Unavailable", content_type="text/plain", headers=headers)
+            return
+        url = urlparse(self.path)
+        if url.path == "/api/v5/addons/search/":
+            query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+            status, page = fake_amo.search(query)
+            body = json.dumps(page).encode("utf-8")
+            etag = "\"%s\"" % hashlib.sha256(body).hexdigest()[:32]
+            if status == 200 and self.headers.get("If-None-Match") == etag:
+                with fake_amo.lock:
+                    fake_amo.not_modified += 1
+                self.send_body(304, b"", content_type="application/json", headers={"ETag": etag})
+                return
+            if status == 200:
+                with fake_amo.lock:
+                    fake_amo.pages += 1
+            self.send_body(status, body, content_type="application/json", headers={"ETag": etag})
+            return
+        download = re.match(r"^/downloads/file/(\d+)/", url.path)
+        cdn = re.match(r"^/user-media/addons/(\d+)/(\d+)/", url.path)
+        if download is not None or cdn is not None:
+            amo_id, hops = (int(download.group(1)), 0) if download is not None \
+                else (int(cdn.group(1)), int(cdn.group(2)))
+            if hops < fake_amo.redirects:
+                self.send_redirect("%s/user-media/addons/%d/%d/addon-%d.xpi" % (fake_amo.url, amo_id, hops + 1, amo_id))
+                return
+            status, body = fake_amo.download(amo_id)
+            if status == 200:
+                with fake_amo.lock:
+                    fake_amo.bytes_sent += len(body)
+            self.send_body(status, body, content_type="application/x-xpinstall")
+            return
+        self.send_json(404, {"detail": "Not found."})
+
+    def send_redirect(self, location):
+        self.send_body(302, b"", content_type="text/plain", headers={"Location": location})
+
+    def send_json(self, status, obj):
+        self.send_body(status, json.dumps(obj).encode("utf-8"), content_type="application/json")
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def generate_xpi(amo_id, padding=0):
+    manifest = {
+        "manifest_version": 2,
+        "name": "Fake Add-on %d" % amo_id,
+        "version": "1.0",
+        "permissions": ["tabs", "<all_urls>"],
+        "background": {"scripts": ["background.js"]}
+    }
+    xpi = BytesIO()
+    with zipfile.ZipFile(xpi, "w") as z:
+        # Fixed timestamps keep the generated archives and their hashes stable.
+        z.writestr(zipfile.ZipInfo("manifest.json", (2020, 1, 1, 0, 0, 0)), json.dumps(manifest, indent=2))
+        z.writestr(zipfile.ZipInfo("background.js", (2020, 1, 1, 0, 0, 0)),
+                   "// Fake Add-on %d\nconsole.log(\"hello from %d\");\n" % (amo_id, amo_id))
+        if padding:
+            z.writestr(zipfile.ZipInfo("padding.bin", (2020, 1, 1, 0, 0, 0)), bytes(padding))
+    return xpi.getvalue()
+
+
+def generate_addon(amo_id, xpi, base_url):
+    created = datetime(2020, 1, 1) + timedelta(hours=amo_id)
+    last_updated = created + timedelta(hours=(amo_id * 37) % 500)
+    return {
+        "id": amo_id,
+        "guid": "addon-%d@example.com" % amo_id,
+        "name": {"en-US": "Fake Add-on %d" % amo_id},
+        "average_daily_users": (amo_id * 7919) % 1000,
+        "weekly_downloads": amo_id % 100,
+        "created": created.strftime(TIME_FORMAT),
+        "last_updated": last_updated.strftime(TIME_FORMAT),
+        "current_version": {
+            "version": "1.0",
+            "file": {
+                "id": amo_id,
+                "hash": "sha256:%s" % hashlib.sha256(xpi).hexdigest(),
+                "url": "%s/downloads/file/%d/addon-%d.xpi" % (base_url, amo_id, amo_id),
+                "size": len(xpi),
+                "permissions": ["tabs", "<all_urls>"]
+            }
+        }
+    }
@@ -0,0 +1,130 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import logging
+import mmap
+import os
+import struct
+
+
+logger = logging.getLogger(__name__)
+
+# File layout: magic, entry count and stamp length, the JSON stamp padded to
+# eight bytes, then the sorted SHA-256 digests and the AMO ID of each digest
+# as little-endian uint32.
+MAGIC = b"WEAHASH1"
+HEADER = struct.Struct("<8sII")
+DIGEST_SIZE = 32
+ID_SIZE = 4
+
+
+def get_hash_index_file(args):
+    return os.path.join(args.workdir, "amo_hashes.idx")
+
+
+class HashIndex(object):
+    """
+    Sorted binary SHA-256 digests of all extension files in the metadata with
+    their AMO IDs. Which files are present in the file store is up to the
+    FileInventory.
+
+    Lookups are binary searches over the raw index data, which is usually a
+    read-only memory map of the index file. Worker processes forked from the
+    one that opened the index share the mapped pages, and unpickled copies in
+    other processes map the file again instead of copying it.
+    """
+
+    def __init__(self, data, filename=None):
+        self.__data = data
+        self.__filename = filename
+        _, self.__count, stamp_size = HEADER.unpack_from(data, 0)
+        self.stamp = json.loads(bytes(data[HEADER.size:HEADER.size + stamp_size]).decode("utf-8"))
+        self.__digests = HEADER.size + (stamp_size + 7) // 8 * 8
+        self.__ids = self.__digests + self.__count * DIGEST_SIZE
+
+    @staticmethod
+    def build(metadata, stamp):
+        """Returns the index data for |metadata|"""
+        entries = sorted((bytes.fromhex(h), ext.id) for ext in metadata for h in ext.file_hashes())
+        stamp = json.dumps(stamp).encode("utf-8")
+        data = bytearray(HEADER.pack(MAGIC, len(entries), len(stamp)))
+        data += stamp + bytes(-len(stamp) % 8)
+        data += b"".join(digest for digest, _ in entries)
+        data += struct.pack("<%dI" % len(entries), *(amo_id for _, amo_id in entries))
+        return bytes(data)
+
+    @classmethod
+    def create(cls, filename, metadata, stamp):
+        """Writes the index for |metadata| to |filename| and opens it"""
+        global logger
+        logger.debug("Writing hash index to `%s`" % filename)
+        with open(filename + ".tmp", "wb") as f:
+            f.write(cls.build(metadata, stamp))
+        os.replace(filename + ".tmp", filename)
+        return cls.open(filename)
+
+    @classmethod
+    def open(cls, filename):
+        """Maps the index in |filename|, or returns None if there is no valid one"""
+        global logger
+        try:
+            with open(filename, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+        if data[:len(MAGIC)] != MAGIC:
+            logger.warning("Ignoring invalid hash index in `%s`" % filename)
+            return None
+        return cls(data, filename)
+
+    def __getstate__(self):
+        if self.__filename is not None:
+            return {"filename": self.__filename}
+        return {"data": self.__data}
+
+    def __setstate__(self, state):
+        if "filename" in state:
+            index = self.open(state["filename"])
+            self.__init__(index.__data, state["filename"])
+        else:
+            self.__init__(state["data"])
+
+    def position(self, hash_id):
+        """Returns the position of a hex hash in the index, or None"""
+        if type(hash_id) is not str or len(hash_id) != 2 * DIGEST_SIZE:
+            return None
+        try:
+            digest = bytes.fromhex(hash_id)
+        except ValueError:
+            return None
+        data = self.__data
+        lo, hi = 0, self.__count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.__digests + mid * DIGEST_SIZE
+            if data[start:start + DIGEST_SIZE] < digest:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = self.__digests + lo * DIGEST_SIZE
+        if lo < self.__count and data[start:start + DIGEST_SIZE] == digest:
+            return lo
+        return None
+
+    def amo_id(self, hash_id):
+        n = self.position(hash_id)
+        if n is None:
+            return None
+        return struct.unpack_from("<I", self.__data, self.__ids + n * ID_SIZE)[0]
+
+    def close(self):
+        if isinstance(self.__data, mmap.mmap):
+            self.__data.close()
+
+    def __contains__(self, hash_id):
+        return self.position(hash_id) is not None
+
+    def __len__(self):
+        return self.__count
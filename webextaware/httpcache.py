@@ -0,0 +1,116 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import logging
+import os
+import zlib
+
+from . import metadata as md
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bound for the size of the compressed cached response bodies
+MAX_CACHE_SIZE = 256 * 1024 * 1024
+
+
+def get_response_cache_file(args):
+    return os.path.join(args.workdir, "amo_response_cache.sqlite")
+
+
+class ResponseCache(object):
+    """
+    Least recently used cache of JSON responses by request URL, along with
+    their ETag and Last-Modified validators.
+
+    Cached responses are revalidated with conditional requests, so unchanged
+    documents cost a 304 response instead of a download. Response bodies are
+    kept zlib-compressed in an SQLite database and only parsed on a hit, so
+    a sync only pays for the responses it stores or uses. Once the bodies
+    exceed |max_size| bytes, the least recently used ones are dropped.
+    Without a filename, the cache only lives in memory.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            size INTEGER NOT NULL,
+            used INTEGER NOT NULL,
+            body BLOB NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS responses_used ON responses (used);
+    """
+
+    def __init__(self, filename=None, max_size=None):
+        self.__max_size = MAX_CACHE_SIZE if max_size is None else max_size
+        self.__sqlite = md.SQLiteConnection(":memory:" if filename is None else filename)
+        self.__connection.executescript(self.SCHEMA)
+        self.__size, self.__used = self.__connection.execute(
+            "SELECT COALESCE(SUM(size), 0), COALESCE(MAX(used), 0) FROM responses").fetchone()
+        self.__evict()
+
+    @property
+    def __connection(self):
+        return self.__sqlite.connection
+
+    def save(self):
+        self.__connection.commit()
+
+    def validators(self, url):
+        """Returns the request headers to revalidate the cached response for |url|"""
+        row = self.__connection.execute("SELECT etag, last_modified FROM responses WHERE url = ?", (url,)).fetchone()
+        headers = {}
+        if row is None:
+            return headers
+        if row[0] is not None:
+            headers["If-None-Match"] = row[0]
+        if row[1] is not None:
+            headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def get(self, url):
+        """Returns the cached document for |url|, or None"""
+        row = self.__connection.execute("SELECT body FROM responses WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        self.__used += 1
+        self.__connection.execute("UPDATE responses SET used = ? WHERE url = ?", (self.__used, url))
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, url, body, etag=None, last_modified=None):
+        """Caches the JSON response |body|, if it comes with validators"""
+        self.remove(url)
+        if etag is None and last_modified is None:
+            return
+        body = zlib.compress(body)
+        self.__used += 1
+        self.__connection.execute("INSERT INTO responses (url, etag, last_modified, size, used, body) "
+                                  "VALUES (?, ?, ?, ?, ?, ?)", (url, etag, last_modified, len(body), self.__used, body))
+        self.__size += len(body)
+        self.__evict()
+
+    def remove(self, url):
+        row = self.__connection.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+        if row is not None:
+            self.__connection.execute("DELETE FROM responses WHERE url = ?", (url,))
+            self.__size -= row[0]
+
+    def __evict(self):
+        while self.__size > self.__max_size:
+            url, size = self.__connection.execute("SELECT url, size FROM responses ORDER BY used LIMIT 1").fetchone()
+            self.__connection.execute("DELETE FROM responses WHERE url = ?", (url,))
+            self.__size -= size
+
+    @property
+    def size(self):
+        return self.__size
+
+    def __contains__(self, url):
+        return self.__connection.execute("SELECT 1 FROM responses WHERE url = ?", (url,)).fetchone() is not None
+
+    def __len__(self):
+        return self.__connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
@@ -0,0 +1,146 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+# Number of threads sweeping the top-level directories of the file store
+SCAN_THREADS = 16
+
+
+def get_inventory_file(args):
+    return os.path.join(args.workdir, "webext_inventory.json")
+
+
+def hash_path(root, ext_hash, depth=4, width=1):
+    """Returns the path of the `.zip` file stored under |ext_hash| in a HashFS store at |root|"""
+    split = depth * width
+    shards = [ext_hash[n:n + width] for n in range(0, split, width)]
+    return os.path.join(root, *shards, ext_hash[split:] + ".zip")
+
+
+def scan_directory(path, prefix=""):
+    """
+    Returns (hash, size, mtime) of all files below a HashFS directory,
+    whose hash prefix is given by the directory names from the root.
+    """
+    found = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                found += scan_directory(entry.path, prefix + entry.name)
+            elif entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                found.append((prefix + os.path.splitext(entry.name)[0], stat.st_size, stat.st_mtime))
+    return found
+
+
+class FileInventory(object):
+    """
+    Hashes of the files in a HashFS store with their sizes and mtimes.
+
+    Kept in |filename| if given, and updated as files are stored, so
+    listing the cache doesn't need to walk the sharded directory tree.
+    A rescan rebuilds it with one sweep over the tree, with the top-level
+    directories scanned in parallel.
+    """
+
+    def __init__(self, hash_fs, filename=None):
+        self.__hash_fs = hash_fs
+        self.__filename = filename
+        self.__files = {}
+        self.__dirty = False
+        if filename is None:
+            self.rescan()
+        else:
+            self.load()
+
+    def load(self):
+        global logger
+        try:
+            with open(self.__filename, "r") as f:
+                state = json.load(f)
+            if state["root"] == self.__hash_fs.root:
+                logger.debug("Loading file store inventory from `%s`" % self.__filename)
+                self.__files = state["files"]
+                return
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError):
+            logger.warning("Ignoring corrupt file store inventory in `%s`" % self.__filename)
+        self.rescan()
+        self.save()
+
+    def save(self):
+        global logger
+        if self.__filename is None or not self.__dirty:
+            return
+        logger.debug("Writing file store inventory to `%s`" % self.__filename)
+        with open(self.__filename + ".tmp", "w") as f:
+            json.dump({"root": self.__hash_fs.root, "files": self.__files}, f)
+        os.replace(self.__filename + ".tmp", self.__filename)
+        self.__dirty = False
+
+    def rescan(self):
+        global logger
+        logger.debug("Scanning file store in `%s`" % self.__hash_fs.root)
+        root = self.__hash_fs.root
+        files = {}
+        subdirs = []
+        if os.path.isdir(root):
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        files[os.path.splitext(entry.name)[0]] = [stat.st_size, stat.st_mtime]
+        with ThreadPoolExecutor(max_workers=SCAN_THREADS) as executor:
+            for found in executor.map(lambda entry: scan_directory(entry.path, entry.name), subdirs):
+                for ext_hash, size, mtime in found:
+                    files[ext_hash] = [size, mtime]
+        self.__files = files
+        self.__dirty = True
+
+    def add(self, ext_hash, file_path=None):
+        """Records a file stored under |ext_hash|, by default at its HashFS location"""
+        if file_path is None:
+            file_path = self.__hash_fs.idpath(ext_hash, ".zip")
+        stat = os.stat(file_path)
+        self.__files[ext_hash] = [stat.st_size, stat.st_mtime]
+        self.__dirty = True
+
+    def path(self, ext_hash):
+        """Returns the path of a stored file without touching the file system, or None"""
+        if ext_hash not in self.__files:
+            return None
+        return hash_path(self.__hash_fs.root, ext_hash, self.__hash_fs.depth, self.__hash_fs.width)
+
+    def remove(self, ext_hash):
+        if self.__files.pop(ext_hash, None) is not None:
+            self.__dirty = True
+
+    def get(self, ext_hash):
+        """Returns (size, mtime) of a stored file, or None"""
+        entry = self.__files.get(ext_hash)
+        if entry is None:
+            return None
+        return tuple(entry)
+
+    def size(self):
+        return sum(size for size, _ in self.__files.values())
+
+    def __contains__(self, ext_hash):
+        return ext_hash in self.__files
+
+    def __iter__(self):
+        return iter(self.__files)
+
+    def __len__(self):
+        return len(self.__files)
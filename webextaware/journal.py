@@ -0,0 +1,156 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from collections import deque
+import json
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+
+# Permanently failed downloads are tried again after this many seconds,
+# in case AMO brought them back.
+FAILED_RETRY_AFTER = 30 * 24 * 3600
+
+
+def get_journal_file(args):
+    return os.path.join(args.workdir, "webext_download_journal.jsonl")
+
+
+class DownloadJournal(object):
+    """
+    Persistent record of extension downloads by file hash.
+
+    Every state change is appended to a line-based JSON log, so an interrupted
+    sync resumes where it stopped. Downloads that were in flight when the
+    previous run died are pending again. Without a filename, the journal only
+    lives in memory.
+    """
+
+    def __init__(self, filename=None):
+        self.__filename = filename
+        self.__entries = {}
+        self.__pending = deque()
+        self.__log = None
+        if filename is not None:
+            self.load()
+            self.__log = open(filename, "a")
+
+    def load(self):
+        global logger
+        try:
+            with open(self.__filename, "r") as f:
+                logger.debug("Resuming download journal from `%s`" % self.__filename)
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Most likely the last line of a crashed run
+                        logger.warning("Ignoring corrupt download journal entry: %s" % repr(line))
+                        continue
+                    self.__entries[entry["hash"]] = entry
+        except FileNotFoundError:
+            return
+        for ext_hash, entry in self.__entries.items():
+            if entry["state"] == IN_FLIGHT:
+                entry["state"] = PENDING
+            if entry["state"] == PENDING:
+                self.__pending.append(ext_hash)
+
+    def __set(self, ext_hash, state, url=None, **kwargs):
+        entry = self.__entries.get(ext_hash)
+        if entry is None:
+            entry = self.__entries[ext_hash] = {"hash": ext_hash}
+        entry["state"] = state
+        if url is not None:
+            entry["url"] = url
+        entry.update(kwargs)
+        if self.__log is not None:
+            self.__log.write(json.dumps(entry) + "\n")
+            self.__log.flush()
+
+    def state(self, ext_hash):
+        entry = self.__entries.get(ext_hash)
+        if entry is None:
+            return None
+        return entry["state"]
+
+    def is_done(self, ext_hash):
+        return self.state(ext_hash) == DONE
+
+    def is_failed(self, ext_hash, url=None):
+        """Whether the download failed permanently, and recently enough not to bother again"""
+        entry = self.__entries.get(ext_hash)
+        if entry is None or entry["state"] != FAILED:
+            return False
+        if url is not None and entry.get("url") != url:
+            return False
+        return time.time() - entry.get("time", 0) < FAILED_RETRY_AFTER
+
+    def add(self, ext_hash, url):
+        """Schedules a download, unless it is already pending"""
+        entry = self.__entries.get(ext_hash)
+        if entry is not None and entry["state"] in (PENDING, IN_FLIGHT):
+            if entry.get("url") != url:
+                self.__set(ext_hash, entry["state"], url)
+            return
+        self.__set(ext_hash, PENDING, url)
+        self.__pending.append(ext_hash)
+
+    def start(self, ext_hash):
+        self.__set(ext_hash, IN_FLIGHT)
+
+    def finish(self, ext_hash, url=None):
+        self.__set(ext_hash, DONE, url)
+
+    def defer(self, ext_hash):
+        """Gives up on a download for this run, but not for the next one"""
+        self.__set(ext_hash, PENDING)
+
+    def fail(self, ext_hash, status=None):
+        self.__set(ext_hash, FAILED, status=status, time=int(time.time()))
+
+    def pending(self):
+        """Returns (url, hash) for pending downloads in the order they were scheduled"""
+        seen = set()
+        pending = []
+        for ext_hash in self.__pending:
+            if ext_hash not in seen and self.__entries[ext_hash]["state"] == PENDING:
+                seen.add(ext_hash)
+                pending.append((self.__entries[ext_hash]["url"], ext_hash))
+        self.__pending = deque(ext_hash for _, ext_hash in pending)
+        return pending
+
+    def compact(self, keep=None):
+        """
+        Rewrites the log with just the current state of every download.
+        If given, only downloads with hashes in |keep| are retained.
+        """
+        if keep is not None:
+            self.__entries = dict((h, e) for h, e in self.__entries.items() if h in keep)
+            self.__pending = deque(h for h in self.__pending if h in keep)
+        if self.__filename is None:
+            return
+        if self.__log is not None:
+            self.__log.close()
+        with open(self.__filename + ".tmp", "w") as f:
+            for entry in self.__entries.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(self.__filename + ".tmp", self.__filename)
+        self.__log = open(self.__filename, "a")
+
+    def close(self):
+        if self.__log is not None:
+            self.__log.close()
+            self.__log = None
+
+    def __len__(self):
+        return len(self.__entries)
@@ -10,7 +10,9 @@ import pkg_resources as pkgr
 import resource
 import sys
 
+from . import metadata as md
 from . import modes
+from . import unzipcache as uc
 
 
 # Initialize coloredlogs
@@ -44,6 +46,26 @@ def get_args(argv=None):
                         action="store",
                         default=os.path.join(home, ".webextaware"))
 
+    parser.add_argument("--unzip-cache",
+                        help="Directory for caching unzipped extensions, e.g. on a tmpfs "
+                             "(default: in working directory)",
+                        type=os.path.abspath,
+                        action="store",
+                        default=None)
+
+    parser.add_argument("--unzip-cache-size",
+                        help="Evict least recently used extensions from the unzip cache beyond this many bytes, "
+                             "0 disables the cache (default: %d)" % uc.DEFAULT_BUDGET,
+                        type=int,
+                        action="store",
+                        default=None)
+
+    parser.add_argument("--metadata-codec",
+                        help="Compression of the metadata file (default: %s)" % md.DEFAULT_METADATA_CODEC,
+                        choices=md.available_codecs(),
+                        action="store",
+                        default=None)
+
     # Set up subparsers, one for each mode
     subparsers = parser.add_subparsers(help="run mode", dest="mode")
     modes_list = modes.list_modes()
@@ -0,0 +1,132 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import logging
+from multiprocessing import Pool
+import os
+import zipfile
+import zlib
+
+from . import metadata as md
+from . import webext as we
+
+
+logger = logging.getLogger(__name__)
+
+# Status of extension files without a readable manifest
+MISSING = "missing"
+# Fewer new files than this are parsed without starting worker processes
+MIN_PARALLEL = 100
+
+
+def get_manifest_cache_file(args):
+    return os.path.join(args.workdir, "webext_manifests.sqlite")
+
+
+def read_manifest(path):
+    """Returns the parse status, raw content and normalized JSON text of the manifest in the zip at |path|"""
+    global logger
+    try:
+        with zipfile.ZipFile(path) as z:
+            content = z.read("manifest.json")
+    except (OSError, KeyError, zipfile.BadZipFile) as err:
+        logger.warning("Can't read manifest of `%s`: %s" % (path, err))
+        return MISSING, None, None
+    manifest = we.Manifest(content)
+    return manifest.status, content, None if manifest.json is None else json.dumps(manifest.json)
+
+
+def read_entry(item):
+    ext_hash, path = item
+    return (ext_hash,) + read_manifest(path)
+
+
+class ManifestCache(object):
+    """
+    Raw and parsed manifests of the extension files in the file store by
+    hash, with the status of parsing them. As file contents never change
+    for a hash, entries are only ever added for new files and dropped for
+    files that are gone from the store.
+
+    Raw manifests and their normalized JSON are kept zlib-compressed in
+    an SQLite database.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS manifests (
+            hash TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            raw BLOB,
+            json BLOB
+        );
+    """
+
+    def __init__(self, filename=":memory:"):
+        self.__sqlite = md.SQLiteConnection(filename)
+        self.__connection.executescript(self.SCHEMA)
+
+    @property
+    def __connection(self):
+        return self.__sqlite.connection
+
+    def __insert(self, ext_hash, status, content, json_text):
+        self.__connection.execute(
+            "INSERT OR REPLACE INTO manifests (hash, status, raw, json) VALUES (?, ?, ?, ?)",
+            (ext_hash, status, None if content is None else zlib.compress(content),
+             None if json_text is None else zlib.compress(json_text.encode("utf-8"))))
+
+    def add(self, ext_hash, path):
+        """Parses and caches the manifest of the extension file at |path|"""
+        self.__insert(ext_hash, *read_manifest(path))
+        self.__connection.commit()
+
+    def remove(self, ext_hash):
+        self.__connection.execute("DELETE FROM manifests WHERE hash = ?", (ext_hash,))
+
+    def update(self, inventory):
+        """Parses the manifests of new files in a FileInventory in parallel and drops the ones of files gone"""
+        global logger
+        cached = set(self)
+        removed = [ext_hash for ext_hash in cached if ext_hash not in inventory]
+        added = [(ext_hash, inventory.path(ext_hash)) for ext_hash in inventory if ext_hash not in cached]
+        logger.debug("Parsing manifests of %d new files, dropping %d" % (len(added), len(removed)))
+        for ext_hash in removed:
+            self.remove(ext_hash)
+        if len(added) >= MIN_PARALLEL:
+            with Pool() as p:
+                for entry in p.imap_unordered(read_entry, added, chunksize=64):
+                    self.__insert(*entry)
+        else:
+            for entry in map(read_entry, added):
+                self.__insert(*entry)
+        self.__connection.commit()
+        return len(added), len(removed)
+
+    def get(self, ext_hash):
+        """
+        Returns the cached Manifest of an extension file, or None if it has
+        no readable manifest. Raises KeyError for files not in the cache.
+        """
+        row = self.__connection.execute("SELECT status, raw, json FROM manifests WHERE hash = ?",
+                                        (ext_hash,)).fetchone()
+        if row is None:
+            raise KeyError(ext_hash)
+        status, content, json_blob = row
+        if status == MISSING:
+            return None
+        parsed = None if json_blob is None else json.loads(zlib.decompress(json_blob).decode("utf-8"))
+        return we.Manifest.from_parsed(zlib.decompress(content), parsed, status)
+
+    def close(self):
+        self.__connection.close()
+
+    def __contains__(self, ext_hash):
+        return self.__connection.execute("SELECT 1 FROM manifests WHERE hash = ?", (ext_hash,)).fetchone() is not None
+
+    def __iter__(self):
+        return (row[0] for row in self.__connection.execute("SELECT hash FROM manifests"))
+
+    def __len__(self):
+        return self.__connection.execute("SELECT COUNT(*) FROM manifests").fetchone()[0]
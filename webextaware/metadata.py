@@ -3,16 +3,131 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import bz2
+import gzip
+import itertools
 import json
 import logging
+import lzma
 import os
+import sqlite3
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 logger = logging.getLogger(__name__)
 
+# Metadata file suffixes by codec
+METADATA_CODECS = {
+    "bz2": ".bz2",
+    "gzip": ".gz",
+    "none": "",
+    "xz": ".xz",
+    "zstd": ".zst"
+}
+DEFAULT_METADATA_CODEC = "gzip"
+LEGACY_METADATA_FILE = "amo_metadata.json.bz2"
+
+
+def available_codecs():
+    return sorted(c for c in METADATA_CODECS if c != "zstd" or zstandard is not None)
+
+
+def get_codec(filename):
+    """Returns the codec of a file by its suffix"""
+    filename = str(filename)
+    for codec, suffix in METADATA_CODECS.items():
+        if suffix != "" and filename.endswith(suffix):
+            return codec
+    return "none"
+
+
+def open_compressed(filename, mode, codec=None):
+    """Opens a text stream on a file, compressed by |codec| or according to its suffix"""
+    if codec is None:
+        codec = get_codec(filename)
+    if codec == "bz2":
+        return bz2.open(filename, mode, encoding="utf-8")
+    elif codec == "gzip":
+        # Level 6 writes about three times faster than the default for slightly larger files
+        return gzip.open(filename, mode, compresslevel=6, encoding="utf-8")
+    elif codec == "xz":
+        return lzma.open(filename, mode, encoding="utf-8")
+    elif codec == "zstd":
+        if zstandard is None:
+            raise ValueError("The zstd codec requires the `zstandard` package")
+        return zstandard.open(filename, mode, encoding="utf-8")
+    return open(filename, mode, encoding="utf-8")
+
 
 def get_metadata_file(args):
-    return os.path.join(args.workdir, "amo_metadata.json.bz2")
+    """Returns the metadata file to write, compressed with the selected codec"""
+    codec = args.metadata_codec or DEFAULT_METADATA_CODEC
+    return os.path.join(args.workdir, "amo_metadata.jsonl" + METADATA_CODECS[codec])
+
+
+def get_metadata_stamp(filename):
+    """Returns what identifies the version of a metadata file, or None if there is none"""
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return [os.path.basename(filename), stat.st_size, stat.st_mtime_ns]
+
+
+def find_metadata_file(args):
+    """
+    Returns the most recently written metadata file of any codec, including
+    the legacy format, or the one to write if there is none.
+    """
+    candidates = [os.path.join(args.workdir, "amo_metadata.jsonl" + suffix) for suffix in METADATA_CODECS.values()]
+    candidates.append(os.path.join(args.workdir, LEGACY_METADATA_FILE))
+    existing = [f for f in candidates if os.path.isfile(f)]
+    if len(existing) == 0:
+        return get_metadata_file(args)
+    return max(existing, key=os.path.getmtime)
+
+
+def get_metadata_db_file(args):
+    return os.path.join(args.workdir, "amo_metadata.sqlite")
+
+
+def open_metadata(args):
+    """
+    Opens the indexed metadata database if it is current and at least as
+    recent as the metadata file, or else the metadata file.
+    """
+    db_file = get_metadata_db_file(args)
+    metadata_file = find_metadata_file(args)
+    if os.path.isfile(db_file) and MetadataDB.is_current(db_file):
+        if not os.path.isfile(metadata_file) or os.path.getmtime(db_file) >= os.path.getmtime(metadata_file):
+            return MetadataDB(db_file)
+    return Metadata(filename=metadata_file)
+
+
+def get_sync_state_file(args):
+    return os.path.join(args.workdir, "amo_sync_state.json")
+
+
+def load_sync_state(args):
+    try:
+        with open(get_sync_state_file(args), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_sync_state(args, state):
+    state_file = get_sync_state_file(args)
+    with open(state_file + ".tmp", "w") as f:
+        json.dump(state, f, indent=4)
+    os.replace(state_file + ".tmp", state_file)
+
+
+def is_host_permission(permission):
+    return "/" in permission or ":" in permission or "<" in permission
 
 
 def create_directory_path(amo_id, ext_id, base=None):
@@ -25,28 +140,69 @@ def create_directory_path(amo_id, ext_id, base=None):
 class Metadata(object):
     def __init__(self, filename=None, data=None):
         self.__ext = []
-        if data is not None:
-            for e in data:
-                ext = Extension(e)
-                if ext.is_webextension():
-                    self.__ext.append(ext)
         self.__filename = filename
         self.__hash_index = {}
         self.__id_index = {}
-        if data is None and filename is not None:
+        if data is not None:
+            self.ingest(data)
+        elif filename is not None:
             self.load(filename)
+            self.generate_index()
+
+    def ingest(self, data):
+        """Add raw AMO addon results, e.g. as they arrive from a metadata crawl"""
+        for e in data:
+            ext = Extension(e)
+            if ext.is_webextension():
+                self.__ext.append(ext)
+                self.__add_to_index(ext)
+
+    def merge(self, data):
+        """Insert raw AMO addon results or replace them by AMO ID"""
+        updates = {}
+        for e in data:
+            ext = Extension(e)
+            updates[ext.id] = ext
+        merged = []
+        for ext in self.__ext:
+            if ext.id in updates:
+                ext = updates.pop(ext.id)
+            if ext.is_webextension():
+                merged.append(ext)
+        for ext in updates.values():
+            if ext.is_webextension():
+                merged.append(ext)
+        self.__ext = merged
+        self.generate_index()
+
+    def remove(self, amo_ids):
+        amo_ids = set(amo_ids)
+        self.__ext = [ext for ext in self.__ext if ext.id not in amo_ids]
         self.generate_index()
 
+    def last_updated(self):
+        """Returns the most recent `last_updated` timestamp in the metadata set"""
+        return max((ext["last_updated"] for ext in self.__ext if "last_updated" in ext), default=None)
+
     def raw_data(self):
         return self.__ext
 
     def load(self, metadata_filename):
+        """
+        Reads newline-delimited AMO records one by one, or the legacy
+        format of a single JSON array.
+        """
         global logger
         self.__ext = []
         try:
-            with bz2.open(metadata_filename, "r") as f:
+            with open_compressed(metadata_filename, "rt") as f:
                 logger.debug("Retrieving metadata state from `%s`" % metadata_filename)
-                for e in json.load(f):
+                first_line = f.readline()
+                if first_line.startswith("["):
+                    records = json.loads(first_line + f.read())
+                else:
+                    records = (line for line in itertools.chain([first_line], f) if line.strip())
+                for e in records:
                     ext = Extension(e)
                     if ext.is_webextension():
                         self.__ext.append(ext)
@@ -54,18 +210,26 @@ class Metadata(object):
             logger.warning("No metadata state stored in `%s`" % metadata_filename)
 
     def save(self):
+        """Atomically writes the AMO records one per line"""
         global logger
         logger.debug("Writing metadata state to `%s`" % self.__filename)
-        with bz2.open(self.__filename, "w") as f:
-            f.write(json.dumps(self.__ext).encode("utf-8"))
+        temp_file = str(self.__filename) + ".tmp"
+        with open_compressed(temp_file, "wt", get_codec(self.__filename)) as f:
+            for ext in self.__ext:
+                f.write(ext.raw_json())
+                f.write("\n")
+        os.replace(temp_file, self.__filename)
 
     def generate_index(self):
         self.__id_index = {}
         self.__hash_index = {}
         for ext in self.__ext:
-            self.__id_index[ext.id] = ext
-            for h in ext.file_hashes():
-                self.__hash_index[h] = ext
+            self.__add_to_index(ext)
+
+    def __add_to_index(self, ext):
+        self.__id_index[ext.id] = ext
+        for h in ext.file_hashes():
+            self.__hash_index[h] = ext
 
     def is_known_id(self, amo_id):
         try:
@@ -117,29 +281,367 @@ class Metadata(object):
     def __len__(self):
         return len(self.__ext)
 
+    @property
+    def filename(self):
+        return self.__filename
+
     def iter_files(self):
         for ext in self:
             for f in ext.files:
                 yield f
 
 
-class Extension(dict):
-    __language_priority = ['en-US', 'en-GB', 'uk', 'de', 'fr', 'pl', 'es', 'it', 'nl']
+class SQLiteConnection(object):
+    """
+    Connection to an SQLite database that is opened again in forked
+    processes, as connections must not be used across fork(), as it happens
+    for multiprocessing pool workers.
+    """
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def __init__(self, filename):
+        self.__filename = filename
+        self.__pid = os.getpid()
+        self.__db = sqlite3.connect(filename)
 
     @property
-    def id(self):
-        return self["id"]
+    def connection(self):
+        if self.__pid != os.getpid():
+            self.__pid = os.getpid()
+            self.__db = sqlite3.connect(self.__filename)
+        return self.__db
+
+
+class StampedIndex(object):
+    """
+    Base class for indexes of the metadata that are persisted as JSON with
+    a stamp of the metadata version they were built from. Subclasses
+    implement from_metadata(), from_state() and state().
+    """
+
+    # Name of the index in log messages
+    kind = "index"
+
+    @classmethod
+    def open(cls, filename, metadata, stamp):
+        """
+        Loads the index from |filename| if it was built for the metadata
+        version |stamp|, or else builds it from |metadata| and saves it.
+        """
+        global logger
+        try:
+            with open(filename, "r") as f:
+                state = json.load(f)
+            if state["stamp"] == stamp:
+                logger.debug("Loading %s from `%s`" % (cls.kind, filename))
+                return cls.from_state(state)
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError):
+            logger.warning("Ignoring corrupt %s in `%s`" % (cls.kind, filename))
+        logger.debug("Building %s in `%s`" % (cls.kind, filename))
+        index = cls.from_metadata(metadata)
+        index.save(filename, stamp)
+        return index
+
+    def save(self, filename, stamp):
+        state = self.state()
+        state["stamp"] = stamp
+        with open(filename + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(filename + ".tmp", filename)
+
+
+class MetadataDB(object):
+    """
+    Metadata in an SQLite database, with the raw AMO records indexed by AMO ID,
+    file hash, name, user count and dates. Records are only loaded when they
+    are looked up or iterated over, so a query for a single extension doesn't
+    have to read the whole catalogue into memory.
+
+    Offers the same interface as Metadata. Changes are written by `save()`.
+    """
+
+    SCHEMA_VERSION = 2
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS extensions (
+            seq INTEGER PRIMARY KEY,
+            id INTEGER NOT NULL UNIQUE,
+            guid TEXT,
+            name TEXT,
+            average_daily_users INTEGER,
+            weekly_downloads INTEGER,
+            created TEXT,
+            last_updated TEXT,
+            files TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS files (
+            hash TEXT PRIMARY KEY,
+            id INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS files_id ON files (id);
+        CREATE INDEX IF NOT EXISTS extensions_name ON extensions (name);
+        CREATE INDEX IF NOT EXISTS extensions_users ON extensions (average_daily_users);
+        CREATE INDEX IF NOT EXISTS extensions_created ON extensions (created);
+        CREATE INDEX IF NOT EXISTS extensions_last_updated ON extensions (last_updated);
+    """
+    # Columns that make up an Extension without its complete AMO record
+    RECORD_COLUMNS = ("e.id, e.guid, e.average_daily_users, e.weekly_downloads, e.created, e.last_updated, e.name, "
+                      "e.files")
+
+    def __init__(self, filename):
+        self.__filename = filename
+        self.__sqlite = SQLiteConnection(filename)
+        self.__connection.executescript(self.SCHEMA)
+        self.__connection.execute("PRAGMA user_version = %d" % self.SCHEMA_VERSION)
+
+    @staticmethod
+    def is_current(filename):
+        """Whether the database at |filename| has the current schema"""
+        db = sqlite3.connect(filename)
+        try:
+            return db.execute("PRAGMA user_version").fetchone()[0] == MetadataDB.SCHEMA_VERSION
+        finally:
+            db.close()
 
     @property
-    def name(self):
-        for lang in self.__language_priority:
-            if lang in self["name"]:
-                return self["name"][lang]
-        lang = list(self["name"].keys())[0]
-        return self["name"][lang]
+    def __connection(self):
+        return self.__sqlite.connection
+
+    @staticmethod
+    def create(filename, metadata):
+        """Atomically replaces the database at |filename| with the extensions in |metadata|"""
+        global logger
+        logger.debug("Writing metadata database to `%s`" % filename)
+        temp_file = filename + ".tmp"
+        if os.path.exists(temp_file):
+            os.unlink(temp_file)
+        db = sqlite3.connect(temp_file)
+        try:
+            # The file is only moved into place when complete
+            db.execute("PRAGMA journal_mode = OFF")
+            db.execute("PRAGMA synchronous = OFF")
+            db.executescript(MetadataDB.SCHEMA)
+            db.execute("PRAGMA user_version = %d" % MetadataDB.SCHEMA_VERSION)
+            MetadataDB.__insert(db, metadata)
+            db.commit()
+        finally:
+            db.close()
+        os.replace(temp_file, filename)
+        return MetadataDB(filename)
+
+    @staticmethod
+    def __insert(db, extensions):
+        for ext in extensions:
+            db.execute("INSERT INTO extensions (id, guid, name, average_daily_users, weekly_downloads, created, "
+                       "last_updated, files, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       (ext.id, ext.guid, ext.name, ext.average_daily_users, ext.weekly_downloads, ext.created,
+                        ext.last_updated, json.dumps(list(ext.files())), ext.raw_json()))
+            db.executemany("INSERT OR REPLACE INTO files (hash, id) VALUES (?, ?)",
+                           ((h, ext.id) for h in ext.file_hashes()))
+
+    def ingest(self, data):
+        """Add raw AMO addon results"""
+        self.__insert(self.__connection, (ext for ext in map(Extension, data) if ext.is_webextension()))
+
+    def merge(self, data):
+        """Insert raw AMO addon results or replace them by AMO ID"""
+        for e in data:
+            ext = Extension(e)
+            row = self.__connection.execute("SELECT seq FROM extensions WHERE id = ?", (ext.id,)).fetchone()
+            self.remove([ext.id])
+            if not ext.is_webextension():
+                continue
+            self.__insert(self.__connection, [ext])
+            if row is not None:
+                # Keep the original position
+                self.__connection.execute("UPDATE extensions SET seq = ? WHERE id = ?", (row[0], ext.id))
+
+    def remove(self, amo_ids):
+        amo_ids = [(amo_id,) for amo_id in amo_ids]
+        self.__connection.executemany("DELETE FROM files WHERE id = ?", amo_ids)
+        self.__connection.executemany("DELETE FROM extensions WHERE id = ?", amo_ids)
+
+    def last_updated(self):
+        """Returns the most recent `last_updated` timestamp in the metadata set"""
+        return self.__connection.execute("SELECT MAX(last_updated) FROM extensions").fetchone()[0]
+
+    def raw_data(self):
+        return list(self)
+
+    def save(self):
+        self.__connection.commit()
+
+    @property
+    def filename(self):
+        return self.__filename
+
+    def close(self):
+        self.__connection.close()
+
+    def is_known_id(self, amo_id):
+        try:
+            amo_id = int(amo_id)
+        except (ValueError, TypeError):
+            return False
+        return self.__connection.execute("SELECT 1 FROM extensions WHERE id = ?", (amo_id,)).fetchone() is not None
+
+    def is_known_hash(self, hash_id):
+        if type(hash_id) is not str:
+            return False
+        return self.__connection.execute("SELECT 1 FROM files WHERE hash = ?", (hash_id,)).fetchone() is not None
+
+    def get_by_id(self, amo_id):
+        try:
+            amo_id = int(amo_id)
+        except (ValueError, TypeError):
+            return None
+        row = self.__connection.execute("SELECT %s FROM extensions e WHERE e.id = ?" % self.RECORD_COLUMNS,
+                                        (amo_id,)).fetchone()
+        if row is None:
+            return None
+        return self.__record(row)
+
+    def get_by_hash(self, hash_id):
+        if type(hash_id) is not str:
+            return None
+        row = self.__connection.execute("SELECT %s FROM files f JOIN extensions e ON e.id = f.id WHERE f.hash = ?"
+                                        % self.RECORD_COLUMNS, (hash_id,)).fetchone()
+        if row is None:
+            return None
+        return self.__record(row)
+
+    def __record(self, row):
+        return Extension.from_record(row[:-1], json.loads(row[-1]), self)
+
+    def raw_json(self, amo_id):
+        """Returns the complete AMO record of an extension as JSON text"""
+        return self.__connection.execute("SELECT data FROM extensions WHERE id = ?", (amo_id,)).fetchone()[0]
+
+    def get(self, amo_or_hash_id):
+        if self.is_known_id(amo_or_hash_id):
+            return self.get_by_id(amo_or_hash_id)
+        elif self.is_known_hash(amo_or_hash_id):
+            return self.get_by_hash(amo_or_hash_id)
+        else:
+            return None
+
+    def id_to_hashes(self, amo_id):
+        ext = self.get_by_id(amo_id)
+        if ext is None:
+            return None
+        return [h for h in ext.file_hashes()]
+
+    def hash_to_id(self, hash_id):
+        row = self.__connection.execute("SELECT id FROM files WHERE hash = ?", (hash_id,)).fetchone()
+        return row[0]
+
+    def __iter__(self):
+        for row in self.__connection.execute("SELECT %s FROM extensions e ORDER BY e.seq" % self.RECORD_COLUMNS):
+            yield self.__record(row)
+
+    def __len__(self):
+        return self.__connection.execute("SELECT COUNT(*) FROM extensions").fetchone()[0]
+
+    def iter_files(self):
+        for ext in self:
+            for f in ext.files():
+                yield f
+
+
+class Extension(object):
+    """
+    Compact record of an AMO addon result.
+
+    Only the fields needed for lookups and selections are kept in slots. The
+    complete AMO record is kept as JSON text, or left in the MetadataDB the
+    record came from, and only decoded when other fields are asked for, e.g.
+    for `meta` output. Otherwise it reads like the AMO record dict it was
+    created from, which may also be given as JSON text.
+    """
+
+    __language_priority = ['en-US', 'en-GB', 'uk', 'de', 'fr', 'pl', 'es', 'it', 'nl']
+    __hot_fields = ("id", "guid", "average_daily_users", "weekly_downloads", "created", "last_updated")
+    __file_fields = ("hash", "url", "size", "permissions", "optional_permissions", "host_permissions")
+    __slots__ = __hot_fields + ("name", "__files", "__json", "__source")
+
+    def __init__(self, data):
+        if isinstance(data, Extension):
+            for field in self.__hot_fields:
+                setattr(self, field, getattr(data, field))
+            self.name = data.name
+            self.__files = data.__files
+            self.__json = data.__json
+            self.__source = data.__source
+            return
+        self.__source = None
+        if isinstance(data, str):
+            self.__json = data.strip()
+            data = json.loads(self.__json)
+        else:
+            self.__json = json.dumps(data)
+        for field in self.__hot_fields:
+            setattr(self, field, data.get(field))
+        self.name = self.__pick_name(data.get("name"))
+        self.__files = tuple(dict((k, f[k]) for k in self.__file_fields if k in f)
+                             for f in self.__raw_files(data))
+
+    @classmethod
+    def from_record(cls, fields, files, source):
+        """
+        Creates an extension from its hot |fields| and |files| in the order of
+        the slots, leaving the complete AMO record in the MetadataDB |source|.
+        """
+        ext = cls.__new__(cls)
+        for field, value in zip(cls.__hot_fields + ("name",), fields):
+            setattr(ext, field, value)
+        ext.__files = tuple(files)
+        ext.__json = None
+        ext.__source = source
+        return ext
+
+    @classmethod
+    def __pick_name(cls, names):
+        if not names:
+            return ""
+        for lang in cls.__language_priority:
+            if lang in names:
+                return names[lang]
+        return names[list(names.keys())[0]]
+
+    @staticmethod
+    def __raw_files(data):
+        if "current_version" not in data:
+            return
+
+        # AMO API v5 (latest)
+        if "file" in data["current_version"]:
+            yield data["current_version"]["file"]
+            return
+
+        if "files" not in data["current_version"]:
+            return
+
+        # AMO API v3 (from disk by webextaware<=1.2.5)
+        # Until 2021, "files" could contain multiple items.
+        # Since sep 2021, "files" can only have one item:
+        # https://github.com/mozilla/addons-server/issues/17839
+        for f in data["current_version"]["files"]:
+            # If the metadata was downloaded before sep 2021, is_webextension could be false.
+            # After sep 2021, all addons on AMO are WebExtensions:
+            # https://github.com/mozilla/addons-server/issues/17946
+            if f["is_webextension"]:
+                yield f
+
+    def raw(self):
+        """Returns the complete AMO record"""
+        return json.loads(self.raw_json())
+
+    def raw_json(self):
+        """Returns the complete AMO record as JSON text"""
+        if self.__json is None:
+            return self.__source.raw_json(self.id)
+        return self.__json
 
     @property
     def permissions(self):
@@ -147,7 +649,7 @@ class Extension(dict):
         aggregate_host_permissions = set()
         for f in self.files():
             for p in f["permissions"]:
-                if "/" in p or ":" in p or "<" in p:
+                if is_host_permission(p):
                     aggregate_host_permissions.add(p)
                 else:
                     aggregate_api_permissions.add(p)
@@ -159,36 +661,49 @@ class Extension(dict):
 
     def is_webextension(self):
         # True in practice, unless the metadata was downloaded before sep 2021.
-        for f in self.files():
-            return True
-        return False
+        return len(self.__files) > 0
 
     def files(self):
-        if "current_version" not in self:
-            return
+        """Yields the web extension files with their hash, URL, size and permissions"""
+        for f in self.__files:
+            yield f
 
-        # AMO API v5 (latest)
-        if "file" in self["current_version"]:
-            yield self["current_version"]["file"]
-            return
+    def file_hashes(self):
+        for f in self.__files:
+            yield f["hash"].split(":")[1]
 
-        if "files" not in self["current_version"]:
-            return
+    def __getitem__(self, key):
+        if key in self.__hot_fields:
+            value = getattr(self, key)
+            if value is not None:
+                return value
+        return self.raw()[key]
 
-        # AMO API v3 (from disk by webextaware<=1.2.5)
-        # Until 2021, "files" could contain multiple items.
-        # Since sep 2021, "files" can only have one item:
-        # https://github.com/mozilla/addons-server/issues/17839
-        for f in self["current_version"]["files"]:
-            # If the metadata was downloaded before sep 2021, is_webextension could be false.
-            # After sep 2021, all addons on AMO are WebExtensions:
-            # https://github.com/mozilla/addons-server/issues/17946
-            if f["is_webextension"]:
-                yield f
+    def __contains__(self, key):
+        if key in self.__hot_fields and getattr(self, key) is not None:
+            return True
+        return key in self.raw()
 
-    def file_hashes(self):
-        for f in self.files():
-            yield f["hash"].split(":")[1]
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self.raw().keys()
+
+    def __eq__(self, other):
+        if isinstance(other, Extension):
+            return self.raw_json() == other.raw_json() or self.raw() == other.raw()
+        if isinstance(other, dict):
+            return self.raw() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "<Extension[%s %s]>" % (self.id, self.name)
 
     def __iter__(self):
         return self.files()
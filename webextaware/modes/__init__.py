@@ -2,6 +2,8 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from . import diff
+from . import find
 from . import get
 from . import grep
 from . import info
@@ -19,6 +21,8 @@ from .runmode import run, list_modes
 
 
 __all__ = [
+    "diff",
+    "find",
     "get",
     "grep",
     "info",
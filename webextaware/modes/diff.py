@@ -0,0 +1,58 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+import logging
+
+from .runmode import RunMode
+from .. import snapshots as sn
+
+
+logger = logging.getLogger(__name__)
+
+
+class DiffMode(RunMode):
+    """
+    Mode to compare metadata snapshots
+    """
+
+    name = "diff"
+    help = "print extensions added, removed and changed between metadata snapshots as JSON"
+
+    @staticmethod
+    def setup_args(parser):
+        parser.add_argument("-l", "--list",
+                            help="list snapshots instead",
+                            action="store_true",
+                            default=False)
+        parser.add_argument("start",
+                            metavar="from",
+                            nargs="?",
+                            default="-2",
+                            help="snapshot name or index (default: -2, the one before the latest)")
+        parser.add_argument("end",
+                            metavar="to",
+                            nargs="?",
+                            default="-1",
+                            help="snapshot name or index (default: -1, the latest)")
+
+    def setup(self):
+        # Snapshots don't need the current metadata or the file store
+        self.snapshots = sn.SnapshotStore(sn.get_snapshot_dir(self.args))
+        return True
+
+    def run(self):
+        if self.args.list:
+            for snapshot in self.snapshots.snapshots():
+                print("%s\t%s\t%d\t+%d\t-%d\t~%d" % (snapshot["name"], "base" if snapshot["base"] else "delta",
+                                                    snapshot["count"], snapshot["added"], snapshot["removed"],
+                                                    snapshot["bumped"] + snapshot["changed"]))
+            return 0
+        try:
+            diff = self.snapshots.diff(self.args.start, self.args.end)
+        except KeyError as e:
+            logger.critical("Unknown metadata snapshot %s, see `diff --list`" % e)
+            return 5
+        print(json.dumps(diff, indent=4))
+        return 0
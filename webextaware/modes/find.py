@@ -0,0 +1,59 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+
+from .runmode import RunMode
+from .. import selection as sel
+
+
+logger = logging.getLogger(__name__)
+
+
+class FindMode(RunMode):
+    """
+    Mode to find files inside extensions by name and size
+    """
+
+    name = "find"
+    help = "find files inside extensions by glob pattern and size"
+
+    @staticmethod
+    def setup_args(parser):
+        parser.add_argument("-s", "--min-size",
+                            type=int,
+                            help="only files of at least this many bytes")
+        parser.add_argument("-l", "--largest",
+                            type=int,
+                            metavar="N",
+                            help="print the N largest files only")
+        parser.add_argument("pattern",
+                            action="store",
+                            help="glob pattern for file paths inside extensions, like `*.wasm`")
+        parser.add_argument("selectors",
+                            metavar="selector",
+                            nargs="*",
+                            default=["all", "orphans"],
+                            help="AMO IDs, extension IDs, regexp, `orphans`, `all` (default: all and orphans)")
+
+    def run(self):
+        plan = sel.compile_selectors(self.db, self.args.selectors)
+        if plan is None:
+            logger.warning("No results")
+            return 10
+        found = 0
+        for ext_id, name, size in self.db.members.find(self.args.pattern, self.args.min_size,
+                                                       largest_first=self.args.largest is not None):
+            amo_id = self.db.hashes.amo_id(ext_id)
+            if not plan.contains(amo_id, ext_id):
+                continue
+            print("%s\t%s\t%s\t%d" % (repr(amo_id), ext_id, name, size))
+            found += 1
+            if found == self.args.largest:
+                break
+
+        if found == 0:
+            logger.warning("No results")
+            return 10
+        return 0
@@ -26,18 +26,15 @@ class GetMode(RunMode):
                             help="AMO IDs, extension IDs, regexp, `orphans`, `all`")
 
     def run(self):
-        matches = self.db.match(self.args.selectors)
-        if len(matches) == 0:
+        done = 0
+        for amo_id, ext_id, file_path in self.db.select(self.args.selectors):
+            done += 1
+            if file_path is None:
+                logger.warning("Cache miss for AMO ID %s file %s" % (amo_id, ext_id))
+                continue
+            print("%s\t%s" % (repr(amo_id), file_path))
+
+        if done == 0:
             logger.warning("No results")
             return 10
-
-        for amo_id in matches:
-            for ext_id in matches[amo_id]:
-                file_ref = self.files.get(ext_id)
-                if file_ref is None:
-                    logger.warning("Cache miss for AMO ID %d file %s" % (amo_id, ext_id))
-                    continue
-                file_path = file_ref.abspath
-                print("%s\t%s" % (repr(amo_id), file_path))
-
         return 0
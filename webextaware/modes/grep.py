@@ -6,10 +6,12 @@ import argparse
 import logging
 from multiprocessing import Pool
 import os
+import re
 import sys
 
 from .runmode import RunMode
 from .. import webext
+from .. import zipgrep
 
 
 logger = logging.getLogger(__name__)
@@ -42,6 +44,12 @@ class GrepMode(RunMode):
     def setup(self):
         if not super().setup():
             return False
+        try:
+            zipgrep.ZipGrep.from_args(self.args.regexp, self.args.grepargs)
+            logger.debug("Grepping in memory")
+            return True
+        except (ValueError, re.error) as err:
+            logger.debug("Can't grep in memory: %s" % err)
         if webext.WebExtension.grep_exe is None:
             logger.critical("Missing `grep` binary")
             return False
@@ -49,18 +57,19 @@ class GrepMode(RunMode):
         return True
 
     def run(self):
-        matches = self.db.match(self.args.selectors)
-        if len(matches) == 0:
-            logger.warning("No results")
-            return 10
-
-        work_list = [(amo_id, ext_id) for amo_id in matches for ext_id in matches[amo_id]]
+        # Selector terms may query SQLite connections that can't be used from the pool's task thread
+        work_list = list(self.db.select(self.args.selectors))
+        done = 0
         for amo_id, ext_id, lines in parallel_grep(work_list, self):
+            done += 1
             if lines is None:
                 continue
             for line in lines:
                 print(line)
 
+        if done == 0:
+            logger.warning("No results")
+            return 10
         return 0
 
 
@@ -68,31 +77,26 @@ mp_mode = None
 
 
 def parallel_grep(work_list, mode):
+    """Greps the (amo_id, ext_id, path) items of |work_list| in worker processes"""
     global mp_mode
     mp_mode = mode
-    work_len = len(work_list)
     with Pool() as p:
         results = p.imap_unordered(grep, work_list)
         done = 0
         for result in results:
             done += 1
             if done % 500 == 0:
-                logger.info("Progress: %d/%d (%.1f%%)" % (done, work_len, 100.0 * done / work_len))
+                logger.info("Progress: %d done" % done)
             yield result
 
 
 def grep(work_item):
     global mp_mode
-    amo_id, ext_id = work_item
-    try:
-        ext = mp_mode.db.get_ext(ext_id)[amo_id][ext_id]
-    except KeyError:
-        logger.debug("Missing cache file for %d - %s" % (amo_id, ext_id))
-        return amo_id, ext_id, None
-    file_ref = mp_mode.files.get(ext_id)
-    if file_ref is None:
-        logger.warning("Cache miss for ID %d - %s" % (amo_id, ext_id))
+    amo_id, ext_id, path = work_item
+    if path is None:
+        logger.warning("Cache miss for ID %s - %s" % (amo_id, ext_id))
         return amo_id, ext_id, None
+    ext = webext.WebExtension(path, ext_id, mp_mode.db.unzip_cache)
 
     logger.debug("Grepping in %s, %s" % (amo_id, ext_id))
     lines = []
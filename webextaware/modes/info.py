@@ -18,7 +18,17 @@ class InfoMode(RunMode):
     name = "info"
     help = "print info on state of local cache"
 
+    @staticmethod
+    def setup_args(parser):
+        parser.add_argument("-r", "--rescan",
+                            help="rescan the cache instead of trusting its inventory",
+                            action="store_true",
+                            default=False)
+
     def run(self):
+        if self.args.rescan:
+            self.db.inventory.rescan()
+            self.db.inventory.save()
         all_amo_ids = set()
         all_ext_ids = set()
         matches = self.db.match("all")
@@ -30,7 +40,9 @@ class InfoMode(RunMode):
         print("AMO IDs in local cache: %d" % amo_count)
         ext_count = len(all_ext_ids)
         print("Referenced extensions in cache: %d" % ext_count)
-        file_count = len(self.files)
+        # Selecting drops files pruned since the last sync from the inventory
+        orphan_count = sum(len(ext_ids) for ext_ids in self.db.match("orphans").values())
+        file_count = len(self.db.inventory)
         print("Total files in cache: %d" % file_count)
-        print("Orphans in cache: %d" % (file_count - ext_count))
+        print("Orphans in cache: %d" % orphan_count)
         return 0
@@ -12,7 +12,7 @@ import shutil
 
 from .runmode import RunMode
 from .. import scanner
-from ..webext import traverse
+from ..webext import traverse, WebExtension
 
 
 logger = logging.getLogger(__name__)
@@ -50,8 +50,8 @@ class LibsMode(RunMode):
         node_dir = check_npm_install(self.args)
         if node_dir is None:
             return 5
-        matches = self.db.match(self.args.selectors)
-        if len(matches) == 0:
+        work_list = list(self.db.select(self.args.selectors))
+        if len(work_list) == 0:
             logger.warning("No results")
             return 10
 
@@ -59,7 +59,6 @@ class LibsMode(RunMode):
         if not retire_instance.dependencies():
             return 20
 
-        work_list = [(amo_id, ext_id) for amo_id in matches for ext_id in matches[amo_id]]
         results = {}
         for amo_id, ext_id, result in parallel_scan(work_list, self, retire_instance):
             if amo_id not in results:
@@ -91,8 +90,8 @@ class LibsMode(RunMode):
             else:
                 # severity_rating = ["-", "low", "medium", "high"]
                 aggregate = aggregate_counts(components)
-                amo_count = len(matches)
-                ext_count = sum([len(matches[amo_id]) for amo_id in matches])
+                amo_count = len(set(amo_id for amo_id, _, _ in work_list))
+                ext_count = len(work_list)
                 for component in sorted(aggregate.keys()):
                     for version in sorted(aggregate[component].keys()):
                         print("%40s\t%-15s\t%7d (%.1f%%)\t%7d (%.1f%%)" % (
@@ -152,16 +151,11 @@ def parallel_scan(work_list, mode, scanner_instance):
 
 def scan(work_item):
     global mp_mode, mp_scanner
-    amo_id, ext_id = work_item
-    try:
-        ext = mp_mode.db.get_ext(ext_id)[amo_id][ext_id]
-    except KeyError:
-        logger.debug("Missing cache file for %s - %s" % (amo_id, ext_id))
-        return amo_id, ext_id, None
-    file_ref = mp_mode.files.get(ext_id)
-    if file_ref is None:
-        logger.warning("Cache miss for ID %d - %s" % (amo_id, ext_id))
+    amo_id, ext_id, path = work_item
+    if path is None:
+        logger.warning("Cache miss for ID %s - %s" % (amo_id, ext_id))
         return amo_id, ext_id, None
+    ext = WebExtension(path, ext_id, mp_mode.db.unzip_cache)
 
     logger.debug("Running %s scan on %s, %s" % (mp_scanner.name, amo_id, ext_id))
     mp_scanner.scan(extension=ext, verbose=True)
@@ -43,48 +43,51 @@ class MetadataMode(RunMode):
             return False
         return True
 
-    def run(self):
+    def __manifests(self):
+        """Yields (amo_id, ext_id, Manifest) for the selected files, with None for unreadable manifests"""
         global logger
+        for amo_id, ext_id, path in self.db.select(self.args.selectors):
+            if path is None:
+                logger.warning("Cache miss for ID %s - %s" % (amo_id, ext_id))
+                continue
+            manifest = self.db.manifest(ext_id)
+            if manifest is None:
+                logger.warning("Unable to read extension manifest of %s - %s" % (amo_id, ext_id))
+            yield amo_id, ext_id, manifest
 
-        exts = self.db.get_ext(self.args.selectors)
-        if len(exts) == 0:
-            logger.warning("No results")
-            return 10
+    def run(self):
+        manifests = self.__manifests()
+        done = 0
 
         if self.args.traverse:
-            for amo_id in exts:
-                for ext_id in exts[amo_id]:
-                    ext = exts[amo_id][ext_id]
-                    manifest = ext.manifest()
-                    for line in manifest.traverse():
-                        print("%s/%s/manifest.json%s" % (amo_id, ext_id, line))
-            return 0
-
-        if self.args.raw:
-            for amo_id in exts:
-                for ext_id in exts[amo_id]:
-                    ext = exts[amo_id][ext_id]
-                    manifest = ext.manifest()
-                    sys.stdout.buffer.write(manifest.raw)
-                    if not manifest.raw.endswith(b"\n"):
-                        sys.stdout.buffer.write(b"\n")
-            sys.stdout.flush()
-            return 0
-
-        manifests = {}
-        for amo_id in exts:
-            for ext_id in exts[amo_id]:
-                if amo_id not in manifests:
-                    manifests[amo_id] = {}
-                ext = exts[amo_id][ext_id]
-                try:
-                    manifest = ext.manifest()
-                except Exception as e:
-                    logger.warning("Unable to parse extension manifest of %d - %s: %s" % (amo_id, ext_id, str(e)))
-                    manifests[amo_id][ext_id] = None
+            for amo_id, ext_id, manifest in manifests:
+                done += 1
+                if manifest is None:
                     continue
-                manifests[amo_id][ext_id] = manifest.json
+                for line in manifest.traverse():
+                    print("%s/%s/manifest.json%s" % (amo_id, ext_id, line))
 
-        print(json.dumps(manifests, sort_keys=True, indent=4))
+        elif self.args.raw:
+            for amo_id, ext_id, manifest in manifests:
+                done += 1
+                if manifest is None:
+                    continue
+                sys.stdout.buffer.write(manifest.raw)
+                if not manifest.raw.endswith(b"\n"):
+                    sys.stdout.buffer.write(b"\n")
+            sys.stdout.flush()
 
+        else:
+            result = {}
+            for amo_id, ext_id, manifest in manifests:
+                done += 1
+                if amo_id not in result:
+                    result[amo_id] = {}
+                result[amo_id][ext_id] = None if manifest is None else manifest.json
+            if done > 0:
+                print(json.dumps(result, sort_keys=True, indent=4))
+
+        if done == 0:
+            logger.warning("No results")
+            return 10
         return 0
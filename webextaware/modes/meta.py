@@ -33,5 +33,6 @@ class MetaaMode(RunMode):
         if len(meta) == 0:
             logger.warning("No results")
             result = 10
-        print(json.dumps(meta, sort_keys=True, indent=4))
+        print(json.dumps(dict((amo_id, ext.raw() if ext is not None else None) for amo_id, ext in meta.items()),
+                         sort_keys=True, indent=4))
         return result
@@ -5,7 +5,6 @@
 import logging
 
 from .runmode import RunMode
-from .. import webext as we
 
 
 logger = logging.getLogger(__name__)
@@ -36,8 +35,8 @@ class QueryMode(RunMode):
             for ext_id in matches[amo_id]:
                 if amo_id is None:
                     # Orphans are not referenced in current metadata
-                    ext = we.WebExtension(self.files.get(ext_id).abspath)
-                    ext_name = ext.manifest()["name"]
+                    manifest = self.db.manifest(ext_id)
+                    ext_name = manifest["name"] if manifest is not None and "name" in manifest else None
                 else:
                     ext = self.db.get_meta(amo_id)[amo_id]
                     ext_name = ext.name
@@ -69,7 +69,7 @@ class RunMode(object):
             self.files = hashfs.HashFS(db_dir, depth=4, width=1, algorithm='sha256')
 
         if self.meta is None:
-            self.meta = md.Metadata(filename=md.get_metadata_file(self.args))
+            self.meta = md.open_metadata(self.args)
 
         if self.db is None:
             self.db = db.Database(self.args, files=self.files, metadata=self.meta)
@@ -12,6 +12,7 @@ import shutil
 
 from .runmode import RunMode
 from .. import scanner
+from ..webext import WebExtension
 
 
 logger = logging.getLogger(__name__)
@@ -42,8 +43,8 @@ class ScanMode(RunMode):
         node_dir = check_npm_install(self.args)
         if node_dir is None:
             return 5
-        matches = self.db.match(self.args.selectors)
-        if len(matches) == 0:
+        work_list = list(self.db.select(self.args.selectors))
+        if len(work_list) == 0:
             logger.warning("No results")
             return 10
 
@@ -62,7 +63,6 @@ class ScanMode(RunMode):
                 return 20
             scanners.append(scanner_instance)
 
-        work_list = [(amo_id, ext_id) for amo_id in matches for ext_id in matches[amo_id]]
         results = {}
         for amo_id, ext_id, result in parallel_scan(work_list, self, scanners):
             if amo_id not in results:
@@ -115,16 +115,11 @@ def parallel_scan(work_list, mode, scanners):
 
 def scan(work_item):
     global mp_mode, mp_scanners
-    amo_id, ext_id = work_item
-    try:
-        ext = mp_mode.db.get_ext(ext_id)[amo_id][ext_id]
-    except KeyError:
-        logger.debug("Missing cache file for %d - %s" % (amo_id, ext_id))
-        return amo_id, ext_id, None
-    file_ref = mp_mode.files.get(ext_id)
-    if file_ref is None:
-        logger.warning("Cache miss for ID %d - %s" % (amo_id, ext_id))
+    amo_id, ext_id, path = work_item
+    if path is None:
+        logger.warning("Cache miss for ID %s - %s" % (amo_id, ext_id))
         return amo_id, ext_id, None
+    ext = WebExtension(path, ext_id, mp_mode.db.unzip_cache)
 
     result = {}
     for scanner_instance in mp_scanners:
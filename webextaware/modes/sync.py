@@ -4,9 +4,8 @@
 
 import logging
 
+from .. import amo
 from .runmode import RunMode
-import webextaware.amo as amo
-import webextaware.metadata as md
 
 
 logger = logging.getLogger(__name__)
@@ -27,15 +26,42 @@ class SyncMode(RunMode):
                             action="store_true",
                             default=False)
 
+        parser.add_argument("-i", "--incremental",
+                            help="only fetch metadata of extensions created or updated since the last sync",
+                            action="store_true",
+                            default=False)
+
+        parser.add_argument("-s", "--stats-interval",
+                            help="log sync stats every this many seconds (summary goes to sync_stats.json)",
+                            type=float,
+                            action="store",
+                            default=None)
+
+        parser.add_argument("-p", "--priority",
+                            help="download extensions with the most users, the latest updates or the smallest first",
+                            choices=sorted(amo.DOWNLOAD_PRIORITIES.keys()),
+                            action="store",
+                            default=None)
+
+        parser.add_argument("--max-files",
+                            help="download at most this many extensions",
+                            type=int,
+                            action="store",
+                            default=None)
+
+        parser.add_argument("--max-bytes",
+                            help="download at most this many bytes of extensions",
+                            type=int,
+                            action="store",
+                            default=None)
+
+        parser.add_argument("--max-time",
+                            help="stop starting downloads after this many seconds",
+                            type=float,
+                            action="store",
+                            default=None)
+
     def run(self):
-        if self.args.nometa:
-            logger.warning("Using cached AMO metadata, not updating")
-        else:
-            logger.info("Downloading current metadata set from AMO")
-            self.meta = md.Metadata(filename=md.get_metadata_file(self.args),
-                                    data=amo.download_metadata())
-            self.meta.save()
-        logger.info("Downloaded metadata set contains %d web extensions" % len(self.meta))
-        logger.info("Downloading missing web extensions")
-        amo.update_files(self.meta, self.files)
+        self.db.sync()
+        self.meta = self.db.meta
         return 0
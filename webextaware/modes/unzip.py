@@ -42,28 +42,28 @@ class UnzipMode(RunMode):
                             help="AMO IDs, extension IDs, regexp, `orphans`, `all`")
 
     def run(self):
-        exts = self.db.get_ext(self.args.selectors)
-        if len(exts) == 0:
+        done = 0
+        for amo_id, ext_id, ext in self.db.iter_ext(self.args.selectors):
+            done += 1
+            unzip_path = create_directory_path(str(amo_id), ext_id, base=self.args.outdir)
+            logger.debug("Considering to unzip %s to %s" % (amo_id, unzip_path))
+            try:
+                os.makedirs(unzip_path, exist_ok=False)
+            except FileExistsError:
+                if self.args.nooverwrite:
+                    logger.info("Skipping existing directory %s" % unzip_path)
+                    continue
+            with ext:
+                ext.unzip(unzip_path)
+            print(unzip_path)
+
+        if done == 0:
             logger.warning("No results")
             return 10
 
-        for amo_id in exts:
-            for ext_id in exts[amo_id]:
-                unzip_path = create_directory_path(str(amo_id), ext_id, base=self.args.outdir)
-                logger.debug("Considering to unzip %d to %s" % (amo_id, unzip_path))
-                try:
-                    os.makedirs(unzip_path, exist_ok=False)
-                except FileExistsError:
-                    if self.args.nooverwrite:
-                        logger.info("Skipping existing directory %s" % unzip_path)
-                        continue
-                with exts[amo_id][ext_id] as ext:
-                    ext.unzip(unzip_path)
-                print(unzip_path)
-
         if self.args.prune:
             logger.info("Pruning orphans from output directory")
-            for ext_id in self.db.get_ext("orphans")[0]:
+            for ext_id in self.db.orphans():
                 for match in glob.glob(create_directory_path("*", ext_id, base=self.args.outdir)):
                     logger.info("Pruning `%s`" % match)
                     rmtree(match)
@@ -0,0 +1,138 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import bisect
+import logging
+import os
+import re
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from . import metadata as md
+
+
+logger = logging.getLogger(__name__)
+
+# Non-ASCII characters that case-insensitive regular expressions match with ASCII letters
+CASE_FOLDS = str.maketrans({"İ": "i", "ı": "i", "ſ": "s", "K": "k"})
+
+
+def get_name_index_file(args):
+    return os.path.join(args.workdir, "amo_names.json")
+
+
+def fold(text):
+    """Folds |text| so case-insensitive ASCII literals can be looked up in it"""
+    return text.translate(CASE_FOLDS).lower()
+
+
+def trigrams(text):
+    return set(text[n:n + 3] for n in range(len(text) - 2))
+
+
+def required_literals(pattern):
+    """
+    Returns the literal prefix of a regular expression |pattern| along with
+    the runs of ASCII literals that anything it matches must contain, both
+    folded for case-insensitive matching. Anything but a literal, a group or
+    a zero-width assertion ends a run.
+    """
+    runs = [""]
+    prefix = None
+
+    def walk(items):
+        nonlocal prefix
+        for op, av in items:
+            if op is sre_parse.LITERAL and av < 128:
+                runs[-1] += chr(av)
+            elif op is sre_parse.SUBPATTERN:
+                walk(av[-1])
+            elif op is not sre_parse.AT:
+                if prefix is None:
+                    prefix = runs[-1]
+                runs.append("")
+
+    walk(sre_parse.parse(pattern, re.IGNORECASE))
+    if prefix is None:
+        prefix = runs[0]
+    return fold(prefix), [fold(run) for run in runs if len(run) > 0]
+
+
+class NameIndex(md.StampedIndex):
+    """
+    Extension names with their AMO IDs and file hashes, for matching regex
+    selectors against names without going through the metadata.
+
+    A regex is only evaluated against names that start with its literal
+    prefix and contain all trigrams of its literal runs, and results are
+    kept per regex. The index is persisted along with a stamp of the
+    metadata version it was built from.
+    """
+
+    kind = "name index"
+
+    def __init__(self, entries=()):
+        self.__ids = []
+        self.__names = []
+        self.__hashes = []
+        for amo_id, name, hashes in entries:
+            self.__ids.append(amo_id)
+            self.__names.append(name)
+            self.__hashes.append(hashes)
+        self.__folded = sorted((fold(name), n) for n, name in enumerate(self.__names))
+        self.__prefixes = [folded for folded, _ in self.__folded]
+        self.__trigrams = {}
+        for folded, n in self.__folded:
+            for trigram in trigrams(folded):
+                self.__trigrams.setdefault(trigram, []).append(n)
+        self.__results = {}
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        return cls((ext.id, ext.name, list(ext.file_hashes())) for ext in metadata)
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(zip(state["ids"], state["names"], state["hashes"]))
+
+    def state(self):
+        return {"ids": self.__ids, "names": self.__names, "hashes": self.__hashes}
+
+    def candidates(self, pattern):
+        """Returns the positions of the names that |pattern| may match, or None for all"""
+        prefix, runs = required_literals(pattern)
+        candidates = None
+        if len(prefix) > 0:
+            start = bisect.bisect_left(self.__prefixes, prefix)
+            end = bisect.bisect_left(self.__prefixes, prefix + "\U0010ffff", start)
+            candidates = set(n for _, n in self.__folded[start:end])
+        postings = [self.__trigrams.get(trigram, []) for run in runs for trigram in trigrams(run)]
+        for posting in sorted(postings, key=len):
+            if candidates is None:
+                candidates = set(posting)
+            else:
+                candidates.intersection_update(posting)
+            if len(candidates) == 0:
+                break
+        return candidates
+
+    def search(self, pattern):
+        """
+        Returns the AMO IDs and file hashes of the extensions whose names
+        match the regex |pattern| case-insensitively. Raises re.error for
+        invalid patterns.
+        """
+        if pattern not in self.__results:
+            m = re.compile(pattern, re.IGNORECASE)
+            candidates = self.candidates(pattern)
+            if candidates is None:
+                candidates = range(len(self.__names))
+            self.__results[pattern] = [n for n in sorted(candidates) if m.match(self.__names[n]) is not None]
+        return [(self.__ids[n], self.__hashes[n]) for n in self.__results[pattern]]
+
+    def __len__(self):
+        return len(self.__ids)
@@ -0,0 +1,94 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+import os
+
+from . import metadata as md
+
+
+logger = logging.getLogger(__name__)
+
+SELECTOR_PREFIXES = ("perm:", "host:")
+
+
+def get_permission_index_file(args):
+    return os.path.join(args.workdir, "amo_permissions.json")
+
+
+def normalize_host(pattern):
+    """Lower-cases the scheme and host of a host permission and adds the path if missing"""
+    pattern = pattern.strip()
+    if "://" not in pattern:
+        return pattern
+    scheme, rest = pattern.split("://", 1)
+    host, slash, path = rest.partition("/")
+    return "%s://%s/%s" % (scheme.lower(), host.lower(), path)
+
+
+def permission_keys(ext_file):
+    """Yields the index keys of the permissions requested by an extension file"""
+    for p in ext_file.get("permissions") or []:
+        if md.is_host_permission(p):
+            yield "host:" + normalize_host(p)
+        else:
+            yield "perm:" + p
+    for p in ext_file.get("host_permissions") or []:
+        yield "host:" + normalize_host(p)
+
+
+def is_permission_selector(selector):
+    """Whether |selector| is a permission selector like `perm:tabs` or `host:<all_urls>`"""
+    return type(selector) is str and selector.startswith(SELECTOR_PREFIXES)
+
+
+class PermissionIndex(md.StampedIndex):
+    """
+    Inverted index from API permissions and normalized host permissions to
+    the extension files requesting them, for selecting extensions by
+    permission without going through the metadata.
+
+    Like the name index, it is persisted with a stamp of the metadata
+    version it was built from.
+    """
+
+    kind = "permission index"
+
+    def __init__(self, files=(), postings=None):
+        self.__files = [tuple(f) for f in files]
+        self.__postings = {} if postings is None else postings
+
+    @classmethod
+    def from_metadata(cls, metadata):
+        index = cls()
+        for ext in metadata:
+            for f in ext.files():
+                index.add(ext.id, f)
+        return index
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state["files"], state["permissions"])
+
+    def state(self):
+        return {"files": self.__files, "permissions": self.__postings}
+
+    def add(self, amo_id, ext_file):
+        n = len(self.__files)
+        self.__files.append((amo_id, ext_file["hash"].split(":")[1]))
+        for key in set(permission_keys(ext_file)):
+            self.__postings.setdefault(key, []).append(n)
+
+    def lookup(self, key):
+        """Returns the AMO IDs and file hashes requesting the permission |key|, e.g. `perm:tabs`"""
+        if key.startswith("host:"):
+            key = "host:" + normalize_host(key[5:])
+        return [self.__files[n] for n in self.__postings.get(key, [])]
+
+    def permissions(self):
+        """Returns all indexed permission keys with their number of files"""
+        return dict((key, len(posting)) for key, posting in self.__postings.items())
+
+    def __len__(self):
+        return len(self.__files)
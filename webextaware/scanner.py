@@ -90,12 +90,14 @@ class RetireScanner(Scanner):
 
     def scan(self, unzip_dir=None, extension=None, verbose=False):
         global logger
-        if unzip_dir is None:
+        rm_unzip_dir = False
+        if unzip_dir is None and extension is not None:
+            # Possibly from the unzip cache
+            unzip_dir = extension.unzip()
+        elif unzip_dir is None:
             unzip_dir = tempfile.mkdtemp()
             rm_unzip_dir = True
-        else:
-            rm_unzip_dir = False
-        if extension is not None:
+        elif extension is not None:
             extension.unzip(unzip_dir)
         cmd = [self.args["retire_bin"], "--outputformat", "json", "--outputpath", "/dev/stdout",
                "--js", "--jspath", unzip_dir]
@@ -108,6 +110,8 @@ class RetireScanner(Scanner):
         logger.debug("Shell command output: `%s`" % cmd_output)
         if rm_unzip_dir:
             shutil.rmtree(unzip_dir, ignore_errors=True)
+        elif extension is not None:
+            extension.cleanup()
         try:
             result = json.loads(cmd_output.decode("utf-8"))
         except json.decoder.JSONDecodeError:
@@ -176,12 +180,14 @@ class ScanJSScanner(Scanner):
 
     def scan(self, unzip_dir=None, extension=None):
         global logger
-        if unzip_dir is None:
+        rm_unzip_dir = False
+        if unzip_dir is None and extension is not None:
+            # Possibly from the unzip cache
+            unzip_dir = extension.unzip()
+        elif unzip_dir is None:
             unzip_dir = tempfile.mkdtemp()
             rm_unzip_dir = True
-        else:
-            rm_unzip_dir = False
-        if extension is not None:
+        elif extension is not None:
             extension.unzip(unzip_dir)
         cmd = [self.args["eslint_bin"],
                "--no-eslintrc",
@@ -197,6 +203,8 @@ class ScanJSScanner(Scanner):
         logger.debug("Shell command output: `%s`" % cmd_output)
         if rm_unzip_dir:
             shutil.rmtree(unzip_dir, ignore_errors=True)
+        elif extension is not None:
+            extension.cleanup()
         if len(cmd_output) == 0:
             self.result = None
         else:
@@ -0,0 +1,288 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+import operator
+import re
+
+from . import permindex as pi
+
+
+logger = logging.getLogger(__name__)
+
+OPERATORS = ("&", "|", "-")
+# Operators inside a single selector argument must stand between blanks,
+# so they are not mistaken for parts of a name regex like `Add-on`.
+OPERATOR_PATTERN = re.compile(r"\s+([&|-])\s+")
+# Selects extension files with members matching a glob, like `file:*.wasm`
+FILE_PREFIX = "file:"
+FILTER_PATTERN = re.compile(r"^(users|downloads)\s*(>=|<=|==|=|>|<)\s*(\d+)$")
+FILTER_FIELDS = {
+    "users": "average_daily_users",
+    "downloads": "weekly_downloads"
+}
+FILTER_OPERATORS = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    "==": operator.eq,
+    "=": operator.eq,
+    ">": operator.gt,
+    "<": operator.lt
+}
+
+
+def tokenize(selectors):
+    """Splits selector arguments into selectors and the operators between them"""
+    for selector in selectors:
+        if type(selector) is not str:
+            yield selector
+            continue
+        for token in OPERATOR_PATTERN.split(selector):
+            if len(token.strip()) > 0:
+                yield token.strip()
+
+
+def compile_selectors(db, selectors):
+    """
+    Compiles a list of selectors into a query plan over the Database |db|.
+
+    Selectors are combined from left to right: `&` intersects, `-`
+    subtracts and `|` or no operator at all unites. A leading `-` negates,
+    selecting everything else the metadata references. For example,
+    `all - orphans`, `perm:tabs & users>=1000` or `file:*.wasm - orphans`. Returns None if nothing
+    could be compiled.
+    """
+    global logger
+    plan = None
+    pending = None
+    for token in tokenize(selectors):
+        if token in OPERATORS:
+            if pending is not None:
+                logger.warning("Ignoring `%s` following `%s`" % (token, pending))
+                continue
+            pending = token
+            continue
+        term = compile_term(db, token)
+        op, pending = pending, None
+        if term is None:
+            continue
+        if plan is None:
+            plan = Difference(AllTerm(db), term) if op == "-" else term
+        elif op == "&":
+            plan = Intersection(plan, term)
+        elif op == "-":
+            plan = Difference(plan, term)
+        else:
+            plan = Union(plan, term)
+    if pending is not None:
+        logger.warning("Ignoring trailing `%s`" % pending)
+    return plan
+
+
+def is_selector_keyword(selector):
+    """Whether |selector| is a keyword, permission, file or filter selector, which names never look like"""
+    return selector in ("all", "orphans") or selector.startswith(pi.SELECTOR_PREFIXES + (FILE_PREFIX,)) \
+        or FILTER_PATTERN.match(selector) is not None
+
+
+def is_unspaced_expression(selector):
+    """Whether |selector| combines selectors like `perm:tabs&users>=10` or `!perm:tabs` without blanks"""
+    if type(selector) is not str or ("&" not in selector and not selector.startswith("!")):
+        return False
+    parts = selector.split("&")
+    # Names like `AT&T` have no selector after their `&`
+    candidates = parts if parts[0].startswith("!") else parts[1:]
+    return any(is_selector_keyword(part.strip().lstrip("!")) for part in candidates)
+
+
+def space_operators(selector):
+    """Rewrites an unspaced expression like `perm:tabs&!perm:storage` to `perm:tabs - perm:storage`"""
+    tokens = []
+    for part in selector.split("&"):
+        part = part.strip()
+        if part.startswith("!"):
+            tokens += ["-", part[1:]]
+        else:
+            tokens += ["&", part] if len(tokens) > 0 else [part]
+    return " ".join(tokens)
+
+
+def compile_term(db, selector):
+    """Returns the term for a single selector, or None for invalid ones"""
+    global logger
+    if selector == "all":
+        return AllTerm(db)
+    elif selector == "orphans":
+        return OrphansTerm(db)
+    elif type(selector) is str and selector.startswith(FILE_PREFIX):
+        glob_pattern = selector[len(FILE_PREFIX):]
+        return SetTerm(lambda: [(db.hashes.amo_id(h), h) for h in db.members.search(glob_pattern)])
+    elif is_unspaced_expression(selector):
+        logger.error("Invalid selector `%s`, did you mean `%s`?" % (selector, space_operators(selector)))
+        return None
+    elif pi.is_permission_selector(selector):
+        return SetTerm(lambda: db.permissions.lookup(selector))
+    elif type(selector) is str and FILTER_PATTERN.match(selector) is not None:
+        field, op, value = FILTER_PATTERN.match(selector).groups()
+        return FilterTerm(db, FILTER_FIELDS[field], FILTER_OPERATORS[op], int(value))
+    elif db.meta.is_known_id(selector):
+        return IdTerm(db, int(selector))
+    elif selector in db.hashes:
+        return SetTerm(lambda: [(db.hashes.amo_id(selector), selector)])
+    elif type(selector) is str and len(selector) == 64 and selector in db.inventory:
+        return SetTerm(lambda: [(None, selector)])
+    try:
+        db.names.search(selector)
+    except re.error:
+        logger.error("Invalid selector `%s`" % selector)
+        return None
+    return SetTerm(lambda: [(amo_id, ext_id) for amo_id, ext_ids in db.names.search(selector) for ext_id in ext_ids])
+
+
+class Term(object):
+    """
+    Node of a query plan. Yields the (amo_id, ext_id) pairs it selects one
+    by one, and tells whether it selects a given pair, so combinations can
+    filter one side by the other without collecting either.
+    """
+
+    def __iter__(self):
+        raise NotImplementedError
+
+    def contains(self, amo_id, ext_id):
+        raise NotImplementedError
+
+
+class AllTerm(Term):
+    def __init__(self, db):
+        self.__db = db
+
+    def __iter__(self):
+        for ext in self.__db.meta:
+            for ext_id in ext.file_hashes():
+                yield ext.id, ext_id
+
+    def contains(self, amo_id, ext_id):
+        return amo_id is not None and ext_id in self.__db.hashes
+
+
+class OrphansTerm(Term):
+    def __init__(self, db):
+        self.__db = db
+
+    def __iter__(self):
+        for ext_id in self.__db.inventory:
+            if ext_id not in self.__db.hashes:
+                yield None, ext_id
+
+    def contains(self, amo_id, ext_id):
+        return amo_id is None and ext_id in self.__db.inventory and ext_id not in self.__db.hashes
+
+
+class IdTerm(Term):
+    def __init__(self, db, amo_id):
+        self.__db = db
+        self.__amo_id = amo_id
+
+    def __iter__(self):
+        for ext_id in self.__db.meta.get_by_id(self.__amo_id).file_hashes():
+            yield self.__amo_id, ext_id
+
+    def contains(self, amo_id, ext_id):
+        return amo_id == self.__amo_id
+
+
+class FilterTerm(Term):
+    """Extensions with a numeric metadata |field| that compares to |value| with |op|"""
+
+    def __init__(self, db, field, op, value):
+        self.__db = db
+        self.__field = field
+        self.__op = op
+        self.__value = value
+
+    def __selects(self, ext):
+        return ext is not None and self.__op(getattr(ext, self.__field) or 0, self.__value)
+
+    def __iter__(self):
+        for ext in self.__db.meta:
+            if self.__selects(ext):
+                for ext_id in ext.file_hashes():
+                    yield ext.id, ext_id
+
+    def contains(self, amo_id, ext_id):
+        return amo_id is not None and self.__selects(self.__db.meta.get_by_id(amo_id))
+
+
+class SetTerm(Term):
+    """Pairs looked up in an index, computed on first use"""
+
+    def __init__(self, lookup):
+        self.__lookup = lookup
+        self.__pairs = None
+        self.__set = None
+
+    def __pairs_list(self):
+        if self.__pairs is None:
+            self.__pairs = self.__lookup()
+            self.__set = set(self.__pairs)
+        return self.__pairs
+
+    def __iter__(self):
+        return iter(self.__pairs_list())
+
+    def contains(self, amo_id, ext_id):
+        self.__pairs_list()
+        return (amo_id, ext_id) in self.__set
+
+
+class Union(Term):
+    """
+    Pairs selected by any of its terms. Pairs already yielded are
+    remembered, as asking every term before would get slow for long
+    selector lists.
+    """
+
+    def __init__(self, left, right):
+        self.__terms = left.__terms if isinstance(left, Union) else [left]
+        self.__terms = self.__terms + [right]
+
+    def __iter__(self):
+        seen = set()
+        for term in self.__terms:
+            for pair in term:
+                if pair not in seen:
+                    seen.add(pair)
+                    yield pair
+
+    def contains(self, amo_id, ext_id):
+        return any(term.contains(amo_id, ext_id) for term in self.__terms)
+
+
+class Intersection(Term):
+    def __init__(self, left, right):
+        self.__left = left
+        self.__right = right
+
+    def __iter__(self):
+        for amo_id, ext_id in self.__left:
+            if self.__right.contains(amo_id, ext_id):
+                yield amo_id, ext_id
+
+    def contains(self, amo_id, ext_id):
+        return self.__left.contains(amo_id, ext_id) and self.__right.contains(amo_id, ext_id)
+
+
+class Difference(Term):
+    def __init__(self, left, right):
+        self.__left = left
+        self.__right = right
+
+    def __iter__(self):
+        for amo_id, ext_id in self.__left:
+            if not self.__right.contains(amo_id, ext_id):
+                yield amo_id, ext_id
+
+    def contains(self, amo_id, ext_id):
+        return self.__left.contains(amo_id, ext_id) and not self.__right.contains(amo_id, ext_id)
@@ -0,0 +1,190 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from datetime import datetime, timezone
+import hashlib
+import json
+import logging
+import os
+
+from . import metadata as md
+
+
+logger = logging.getLogger(__name__)
+
+# Number of delta snapshots before the next snapshot is written in full
+REBASE_INTERVAL = 30
+SNAPSHOT_TIME_FORMAT = "%Y%m%dT%H%M%SZ"
+
+
+def get_snapshot_dir(args):
+    return os.path.join(args.workdir, "amo_snapshots")
+
+
+def get_version(ext):
+    current_version = ext.get("current_version") or {}
+    return current_version.get("version")
+
+
+class SnapshotStore(object):
+    """
+    Series of metadata snapshots, each written as per-record deltas against
+    the snapshot before it. Every REBASE_INTERVAL snapshots a base snapshot
+    holds all records, so a catalogue never has to be replayed from the
+    first one.
+
+    Each line of a snapshot file names an AMO ID with its state before and
+    after as `[digest, version]`, or null where the extension wasn't listed,
+    and the new AMO record if there is one. Diffs between any two snapshots
+    only need the states, so they are composed from the lines in between
+    without loading either catalogue.
+    """
+
+    def __init__(self, directory):
+        self.__directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        try:
+            with open(self.__path("index.json"), "r") as f:
+                self.__snapshots = json.load(f)
+        except FileNotFoundError:
+            self.__snapshots = []
+
+    def __path(self, file_name):
+        return os.path.join(self.__directory, file_name)
+
+    def __load_state(self):
+        """Returns the digest and version of each extension in the latest snapshot by AMO ID"""
+        try:
+            with md.open_compressed(self.__path("state.json.gz"), "rt") as f:
+                return dict((int(amo_id), state) for amo_id, state in json.load(f).items())
+        except FileNotFoundError:
+            return {}
+
+    def __save(self, state):
+        with md.open_compressed(self.__path("state.json.gz.tmp"), "wt", "gzip") as f:
+            json.dump(state, f)
+        os.replace(self.__path("state.json.gz.tmp"), self.__path("state.json.gz"))
+        with open(self.__path("index.json.tmp"), "w") as f:
+            json.dump(self.__snapshots, f, indent=4)
+        os.replace(self.__path("index.json.tmp"), self.__path("index.json"))
+
+    def record(self, metadata, name=None):
+        """Writes a snapshot of |metadata|, named after the current time unless |name| is given"""
+        global logger
+        if name is None:
+            name = datetime.now(timezone.utc).strftime(SNAPSHOT_TIME_FORMAT)
+            taken = set(s["name"] for s in self.__snapshots)
+            n = 1
+            while name in taken:
+                name = "%s-%d" % (name.split("-")[0], n)
+                n += 1
+        base = len(self.__snapshots) == 0 or all(not s["base"] for s in self.__snapshots[-REBASE_INTERVAL:])
+        old_state = self.__load_state()
+        state = {}
+        counts = {"added": 0, "removed": 0, "bumped": 0, "changed": 0}
+        file_name = name + ".jsonl.gz"
+        logger.info("Writing %s metadata snapshot `%s`" % ("base" if base else "delta", name))
+        with md.open_compressed(self.__path(file_name + ".tmp"), "wt", "gzip") as f:
+            for ext in metadata:
+                raw_json = ext.raw_json()
+                digest = hashlib.sha1(raw_json.encode("utf-8")).hexdigest()
+                old = old_state.pop(ext.id, None)
+                if old is not None and old[0] == digest:
+                    new = old
+                else:
+                    new = [digest, get_version(ext)]
+                    if old is None:
+                        counts["added"] += 1
+                    elif old[1] != new[1]:
+                        counts["bumped"] += 1
+                    else:
+                        counts["changed"] += 1
+                state[ext.id] = new
+                if base or new is not old:
+                    f.write('{"id": %d, "old": %s, "new": %s, "record": %s}\n'
+                            % (ext.id, json.dumps(old), json.dumps(new), raw_json))
+            for amo_id, old in old_state.items():
+                counts["removed"] += 1
+                f.write(json.dumps({"id": amo_id, "old": old, "new": None}) + "\n")
+        os.replace(self.__path(file_name + ".tmp"), self.__path(file_name))
+        snapshot = {"name": name, "file": file_name, "base": base, "count": len(state)}
+        snapshot.update(counts)
+        self.__snapshots.append(snapshot)
+        self.__save(state)
+        return snapshot
+
+    def snapshots(self):
+        return list(self.__snapshots)
+
+    def position(self, name):
+        """
+        Returns the position of a snapshot by its name or by an index like
+        `-1` for the latest one. Raises KeyError for unknown snapshots.
+        """
+        for n, snapshot in enumerate(self.__snapshots):
+            if snapshot["name"] == name:
+                return n
+        try:
+            n = int(name)
+        except (ValueError, TypeError):
+            raise KeyError(name)
+        if not -len(self.__snapshots) <= n < len(self.__snapshots):
+            raise KeyError(name)
+        return n % len(self.__snapshots)
+
+    def __lines(self, n):
+        with md.open_compressed(self.__path(self.__snapshots[n]["file"]), "rt") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def diff(self, from_name, to_name):
+        """
+        Returns the AMO IDs of the extensions added, removed, version-bumped
+        and otherwise changed between two snapshots.
+        """
+        start, end = self.position(from_name), self.position(to_name)
+        reverse = start > end
+        if reverse:
+            start, end = end, start
+        states = {}
+        for n in range(start + 1, end + 1):
+            for line in self.__lines(n):
+                if line["id"] in states:
+                    states[line["id"]][1] = line["new"]
+                else:
+                    states[line["id"]] = [line["old"], line["new"]]
+        diff = {"added": [], "removed": [], "bumped": [], "changed": []}
+        for amo_id, (old, new) in sorted(states.items()):
+            if reverse:
+                old, new = new, old
+            if old == new:
+                continue
+            elif old is None:
+                diff["added"].append(amo_id)
+            elif new is None:
+                diff["removed"].append(amo_id)
+            elif old[1] != new[1]:
+                diff["bumped"].append({"id": amo_id, "from": old[1], "to": new[1]})
+            else:
+                diff["changed"].append(amo_id)
+        diff["from"] = self.__snapshots[self.position(from_name)]["name"]
+        diff["to"] = self.__snapshots[self.position(to_name)]["name"]
+        return diff
+
+    def load(self, name):
+        """Returns the metadata of a snapshot, replayed from the base snapshot before it"""
+        end = self.position(name)
+        start = max(n for n in range(end + 1) if self.__snapshots[n]["base"])
+        records = {}
+        for n in range(start, end + 1):
+            for line in self.__lines(n):
+                if line["new"] is None:
+                    records.pop(line["id"], None)
+                else:
+                    records[line["id"]] = line["record"]
+        return md.Metadata(data=records.values())
+
+    def __len__(self):
+        return len(self.__snapshots)
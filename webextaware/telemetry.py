@@ -0,0 +1,181 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import bisect
+import json
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the request latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+
+def get_stats_file(args):
+    return os.path.join(args.workdir, "sync_stats.json")
+
+
+class SyncStats(object):
+    """
+    Telemetry of a sync run, with one RequestStats section per phase.
+
+    With an |interval| in seconds, a snapshot of the summary is logged
+    whenever a request finishes at least that long after the last one.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval
+        self.sections = {}
+        self.__start = time.monotonic()
+        self.__last_report = self.__start
+
+    def section(self, name):
+        if name not in self.sections:
+            self.sections[name] = RequestStats(self)
+        return self.sections[name]
+
+    def tick(self):
+        global logger
+        if self.interval is None:
+            return
+        now = time.monotonic()
+        if now - self.__last_report >= self.interval:
+            self.__last_report = now
+            logger.info("Sync stats: %s" % json.dumps(self.summary()))
+
+    def summary(self):
+        summary = {"elapsed": time.monotonic() - self.__start}
+        for name, section in self.sections.items():
+            summary[name] = section.summary()
+        return summary
+
+    def save(self, filename):
+        with open(filename + ".tmp", "w") as f:
+            json.dump(self.summary(), f, indent=4)
+        os.replace(filename + ".tmp", filename)
+
+
+class RequestStats(object):
+    """
+    Request counters of an AMO client phase: a latency histogram, responses
+    by status, retries, concurrency, transferred bytes and where the time
+    went. Network time is spent waiting for AMO, decode time parsing JSON
+    and disk time writing and moving files, so a slow AMO can be told apart
+    from a slow local disk.
+    """
+
+    def __init__(self, owner=None):
+        self.requests = 0
+        self.statuses = {}
+        self.bytes = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.limits = None
+        self.network_time = 0.0
+        self.decode_time = 0.0
+        self.disk_time = 0.0
+        self.retries = {}
+        self.retried_items = 0
+        self.exhausted_items = 0
+        self.__owner = owner
+        self.__histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.__latency_sum = 0.0
+        self.__first = None
+        self.__last = None
+
+    def start(self):
+        """Account for a request going out"""
+        now = time.monotonic()
+        if self.__first is None:
+            self.__first = now
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def finish(self):
+        self.in_flight -= 1
+        self.__last = time.monotonic()
+        if self.__owner is not None:
+            self.__owner.tick()
+
+    def response(self, latency, status, limit=None):
+        """Account for a response, or a connection error with status None"""
+        self.requests += 1
+        status = "error" if status is None else str(status)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if latency is not None:
+            self.__histogram[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+            self.__latency_sum += latency
+        if limit is not None:
+            if self.limits is None:
+                self.limits = [limit, limit, limit]
+            self.limits = [min(self.limits[0], limit), max(self.limits[1], limit), limit]
+
+    def transfer(self, size, seconds):
+        self.bytes += size
+        self.network_time += seconds
+
+    def decode(self, seconds):
+        self.decode_time += seconds
+
+    def disk(self, seconds):
+        self.disk_time += seconds
+
+    def retry_summary(self, scheduler):
+        """Merge the retry counts of a finished RetryScheduler"""
+        for status, count in scheduler.errors.items():
+            status = "error" if status is None else str(status)
+            self.retries[status] = self.retries.get(status, 0) + count
+        self.retried_items += len(scheduler.attempts)
+        self.exhausted_items += sum(1 for n in scheduler.attempts.values() if n >= scheduler.max_attempts)
+
+    def percentile(self, p):
+        """
+        Returns the upper bound of the latency bucket holding the |p|th
+        percentile, or None if there is none.
+        """
+        rank = p / 100 * sum(self.__histogram)
+        seen = 0
+        for n, count in enumerate(self.__histogram):
+            seen += count
+            if count > 0 and seen >= rank:
+                return LATENCY_BUCKETS[n] if n < len(LATENCY_BUCKETS) else None
+        return None
+
+    def summary(self):
+        elapsed = 0.0
+        if self.__first is not None and self.__last is not None:
+            elapsed = self.__last - self.__first
+        buckets = dict(("%g" % bound, count) for bound, count in zip(LATENCY_BUCKETS, self.__histogram))
+        buckets["+Inf"] = self.__histogram[-1]
+        return {
+            "requests": self.requests,
+            "statuses": self.statuses,
+            "bytes": self.bytes,
+            "elapsed": elapsed,
+            "requests_per_second": self.requests / elapsed if elapsed > 0 else None,
+            "bytes_per_second": self.bytes / elapsed if elapsed > 0 else None,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "concurrency_limit": None if self.limits is None else dict(zip(("min", "max", "last"), self.limits)),
+            "latency": {
+                "mean": self.__latency_sum / sum(self.__histogram) if sum(self.__histogram) > 0 else None,
+                "p50": self.percentile(50),
+                "p90": self.percentile(90),
+                "p99": self.percentile(99),
+                "buckets": buckets
+            },
+            "time": {
+                "network": self.network_time,
+                "decode": self.decode_time,
+                "disk": self.disk_time
+            },
+            "retries": {
+                "by_status": self.retries,
+                "items": self.retried_items,
+                "exhausted": self.exhausted_items
+            }
+        }
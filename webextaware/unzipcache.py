@@ -0,0 +1,199 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import fcntl
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET = 4 << 30
+# Each hash has a directory with the extracted content, a file with its size
+# and a lock file, which is share-locked by every process using the tree.
+CONTENT_DIR = "content"
+SIZE_FILE = "size"
+LOCK_FILE = "lock"
+TEMP_PREFIX = ".tmp_"
+
+
+def get_unzip_cache_dir(args):
+    if args.unzip_cache is not None:
+        return args.unzip_cache
+    return os.path.join(args.workdir, "webext_unzipped")
+
+
+def get_unzip_cache_budget(args):
+    if args.unzip_cache_size is None:
+        return DEFAULT_BUDGET
+    return args.unzip_cache_size
+
+
+class UnzipCache(object):
+    """
+    Extracted extension trees by hash, shared between runs, modes and
+    worker processes. Once the trees take up more than |budget| bytes,
+    the least recently used ones are evicted.
+
+    Trees are extracted to a temporary directory and renamed into place,
+    so concurrent workers never see half-extracted trees. Trees returned by
+    `get()` are locked until they are released, and locked trees are never
+    evicted. Pointing the cache to a tmpfs keeps it off the disk.
+    """
+
+    def __init__(self, directory, budget=DEFAULT_BUDGET):
+        self.__directory = directory
+        self.__budget = budget
+        self.__size = None
+        # Lock file descriptors and use counts of the trees in use by this process
+        self.__locks = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def __path(self, ext_hash):
+        return os.path.join(self.__directory, ext_hash)
+
+    def __lock(self, path):
+        """Returns the share-locked lock file descriptor of the tree at |path|, or None if there is no tree"""
+        try:
+            fd = os.open(os.path.join(path, LOCK_FILE), os.O_RDONLY | os.O_CREAT, 0o644)
+        except FileNotFoundError:
+            return None
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        try:
+            # The tree may have been evicted before the lock was granted
+            if os.path.samestat(os.fstat(fd), os.stat(os.path.join(path, LOCK_FILE))):
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+        return None
+
+    def get(self, ext_hash, zip_path):
+        """
+        Returns the directory with the content of the zip at |zip_path|,
+        extracting it if necessary. The tree is locked against eviction
+        until it is released.
+        """
+        global logger
+        path = self.__path(ext_hash)
+        content_path = os.path.join(path, CONTENT_DIR)
+        if ext_hash in self.__locks:
+            self.__locks[ext_hash][1] += 1
+            return content_path
+        fd = self.__lock(path)
+        if fd is not None:
+            # The mtime records the last use
+            os.utime(path)
+            self.__locks[ext_hash] = [fd, 1]
+            return content_path
+        logger.debug("Extracting `%s` to unzip cache" % zip_path)
+        temp_path = tempfile.mkdtemp(prefix=TEMP_PREFIX, dir=self.__directory)
+        fd = None
+        try:
+            os.mkdir(os.path.join(temp_path, CONTENT_DIR))
+            with zipfile.ZipFile(zip_path) as z:
+                z.extractall(os.path.join(temp_path, CONTENT_DIR))
+                size = sum(info.file_size for info in z.infolist())
+            with open(os.path.join(temp_path, SIZE_FILE), "w") as f:
+                f.write(str(size))
+            # Locked before it is renamed into place, so it can't be evicted right away
+            fd = self.__lock(temp_path)
+            os.rename(temp_path, path)
+        except OSError:
+            if fd is not None:
+                os.close(fd)
+            shutil.rmtree(temp_path, ignore_errors=True)
+            fd = self.__lock(path)
+            if fd is None:
+                raise
+            # Another worker was faster
+            self.__locks[ext_hash] = [fd, 1]
+            return content_path
+        except Exception:
+            if fd is not None:
+                os.close(fd)
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise
+        self.__locks[ext_hash] = [fd, 1]
+        if self.__size is not None:
+            self.__size += size
+        if self.size() > self.__budget:
+            self.evict()
+        return content_path
+
+    def release(self, ext_hash):
+        """Releases a tree returned by `get()`, so it can be evicted"""
+        lock = self.__locks.get(ext_hash)
+        if lock is None:
+            return
+        lock[1] -= 1
+        if lock[1] == 0:
+            os.close(lock[0])
+            del self.__locks[ext_hash]
+
+    def __contains__(self, ext_hash):
+        return os.path.isdir(self.__path(ext_hash))
+
+    def trees(self):
+        """Returns (last use, size, hash) of all cached trees, least recently used first"""
+        trees = []
+        with os.scandir(self.__directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(TEMP_PREFIX) or not entry.is_dir(follow_symlinks=False):
+                    continue
+                try:
+                    with open(os.path.join(entry.path, SIZE_FILE), "r") as f:
+                        size = int(f.read())
+                    trees.append((entry.stat(follow_symlinks=False).st_mtime, size, entry.name))
+                except (OSError, ValueError):
+                    continue
+        return sorted(trees)
+
+    def size(self):
+        """Returns the size of all cached trees, which is only computed once per process"""
+        if self.__size is None:
+            self.__size = sum(size for _, size, _ in self.trees())
+        return self.__size
+
+    def evict(self):
+        """Removes the least recently used trees that aren't in use until the cache fits into its budget"""
+        global logger
+        trees = self.trees()
+        self.__size = sum(size for _, size, _ in trees)
+        for _, size, ext_hash in trees:
+            if self.__size <= self.__budget:
+                break
+            if ext_hash in self.__locks:
+                continue
+            path = self.__path(ext_hash)
+            try:
+                fd = os.open(os.path.join(path, LOCK_FILE), os.O_RDONLY | os.O_CREAT, 0o644)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # In use by another process
+                os.close(fd)
+                continue
+            logger.debug("Evicting `%s` from unzip cache" % ext_hash)
+            # Renaming first removes the tree from the cache in one step
+            trash_path = tempfile.mkdtemp(prefix=TEMP_PREFIX, dir=self.__directory)
+            try:
+                os.rename(path, os.path.join(trash_path, ext_hash))
+                self.__size -= size
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+            shutil.rmtree(trash_path, ignore_errors=True)
+
+    def clear(self):
+        """Removes all cached trees"""
+        for _, _, ext_hash in self.trees():
+            shutil.rmtree(self.__path(ext_hash), ignore_errors=True)
+        self.__size = 0
@@ -9,14 +9,31 @@ import json
 import jsoncfg
 import logging
 import os
+import re
 import shutil
 import subprocess
 import tempfile
 import zipfile
 
+from . import zipgrep as zg
+
 
 logger = logging.getLogger(__name__)
 
+# Strings are matched first and put back, so that comment markers and commas
+# inside them are kept. Comments and commas before closing brackets are dropped.
+TOLERANT_JSON_PATTERN = re.compile(r'("[^"\\]*(?:\\.[^"\\]*)*")|//[^\n]*|/\*.*?\*/'
+                                   r'|,(?=(?:\s|//[^\n]*|/\*.*?\*/)*[}\]])', re.DOTALL)
+
+
+def tolerant_json_loads(text):
+    """
+    Parses JSON with comments and trailing commas, which are stripped in a
+    single pass before handing the text to the json module.
+    Raises ValueError like json.loads().
+    """
+    return json.loads(TOLERANT_JSON_PATTERN.sub(r"\1", text))
+
 
 class WebExtension(object):
 
@@ -24,10 +41,13 @@ class WebExtension(object):
     if grep_exe is None:
         grep_exe = find_executable("grep.exe")
 
-    def __init__(self, filename):
+    def __init__(self, filename, ext_hash=None, unzip_cache=None):
         self.filename = filename
+        self.ext_hash = ext_hash
+        self.unzip_cache = unzip_cache
         self.unzip_folder = None
         self.unzip_folder_is_temp = False
+        self.unzip_folder_is_cached = False
 
     def __str__(self):
         manifest = self.manifest()
@@ -55,6 +75,11 @@ class WebExtension(object):
     def unzip(self, unzip_folder=None):
         if self.unzip_folder is not None and os.path.isdir(self.unzip_folder):
             return self.unzip_folder
+        if unzip_folder is None and self.unzip_cache is not None and self.ext_hash is not None:
+            self.unzip_folder = self.unzip_cache.get(self.ext_hash, self.filename)
+            self.unzip_folder_is_temp = False
+            self.unzip_folder_is_cached = True
+            return self.unzip_folder
         if unzip_folder is None:
             self.unzip_folder = tempfile.mkdtemp(prefix="webextaware_unzip_")
             self.unzip_folder_is_temp = True
@@ -74,6 +99,11 @@ class WebExtension(object):
             shutil.rmtree(self.unzip_folder)
             self.unzip_folder = None
             self.unzip_folder_is_temp = False
+        elif self.unzip_folder is not None and self.unzip_folder_is_cached:
+            # Allow the cached tree to be evicted
+            self.unzip_cache.release(self.ext_hash)
+            self.unzip_folder = None
+            self.unzip_folder_is_cached = False
 
     def find(self, glob_pattern):
         matches = []
@@ -83,6 +113,22 @@ class WebExtension(object):
         return matches
 
     def grep(self, regexp, grep_args=None, color=False):
+        """
+        Returns the `grep -E -r` output lines for |regexp| over the extension
+        content, with paths relative to `<%= PACKAGE_ID %>`. The zip members are
+        grepped in memory unless |grep_args| has flags that only the `grep`
+        binary supports, or |regexp| doesn't translate to Python syntax.
+        """
+        try:
+            engine = zg.ZipGrep.from_args(regexp, grep_args, color=color)
+        except (ValueError, re.error) as err:
+            logger.debug("Falling back to `grep` binary: %s" % err)
+            return self.grep_exe_output(regexp, grep_args, color)
+        with self._open_ZipFile() as z:
+            return engine.grep_zip(z, "<%= PACKAGE_ID %>")
+
+    def grep_exe_output(self, regexp, grep_args=None, color=False):
+        """Returns the output of running the `grep` binary over the unzipped extension"""
         if self.grep_exe is None:
             logger.critical("Can't find the `grep` binary.")
             return None
@@ -109,6 +155,9 @@ class WebExtension(object):
         for line in decoded_result.splitlines():
             if line.startswith(folder):
                 results.append(line.replace(folder, "<%= PACKAGE_ID %>"))
+            elif line == "--" or line == zg.COLOR_SEPARATOR + "--" + zg.COLOR_END:
+                # Separates groups of context lines
+                results.append(line)
             elif line.startswith("Binary file ") and line.endswith(" matches"):
                 filename = line[12:-8]
                 if not os.path.isfile(filename) or not filename.startswith(folder):
@@ -119,8 +168,15 @@ class WebExtension(object):
 
 class Manifest(object):
 
+    # Parse status values
+    PARSED = "parsed"
+    RELAXED = "relaxed"
+    ENCODING_ERROR = "encoding_error"
+    INVALID = "invalid"
+
     def __init__(self, content):
         self.raw = content
+        self.status = self.PARSED
         try:
             utf_content = content.decode('utf-8-sig')
         except UnicodeDecodeError as e:
@@ -128,24 +184,42 @@ class Manifest(object):
             # extensions with non-standard manifest encoding.
             logger.warning("Unicode error in manifest: %s: %s" % (repr(content), str(e)))
             self.json = None
+            self.status = self.ENCODING_ERROR
             return
 
         try:
             self.json = json.loads(utf_content)
         except ValueError as e:
-            # There is lots of broken JSON in the wild. Most are using comments,
-            # so will retry with a more relaxed parser.
+            # There is lots of broken JSON in the wild. Most are using comments
+            # or trailing commas, so will retry without them.
             self.json = None
-            logger.debug("Manifest can't be regularly parsed: %s: %s" % (repr(utf_content), str(e)))
+            logger.debug("Manifest can't be regularly parsed: %s" % str(e))
+            try:
+                self.json = tolerant_json_loads(utf_content)
+                self.status = self.RELAXED
+            except ValueError as e:
+                logger.debug("Manifest can't be parsed without comments: %s" % str(e))
 
         if self.json is None:
+            # Last resort for unquoted keys and the like
             logger.debug("Retrying with relaxed parser")
             try:
                 self.json = jsoncfg.loads(utf_content)
+                self.status = self.RELAXED
             except jsoncfg.parser.JSONConfigParserException as e:
                 # Give up when even relaxed parsing does not work.
                 logger.error("Manifest can't be parsed: %s" % str(e))
                 self.json = None
+                self.status = self.INVALID
+
+    @classmethod
+    def from_parsed(cls, content, parsed, status):
+        """Returns a Manifest for |content| that was already parsed to |parsed| with |status|"""
+        manifest = cls.__new__(cls)
+        manifest.raw = content
+        manifest.json = parsed
+        manifest.status = status
+        return manifest
 
     def traverse(self):
         if self.json is None:
@@ -0,0 +1,280 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+import re
+
+
+logger = logging.getLogger(__name__)
+
+# Output colors as used by `grep --color=always` by default
+COLOR_MATCH = "\33[01;31m\33[K"
+COLOR_FILE = "\33[35m\33[K"
+COLOR_SEPARATOR = "\33[36m\33[K"
+COLOR_LINE_NUMBER = "\33[32m\33[K"
+COLOR_END = "\33[m\33[K"
+
+SHORT_FLAGS = {
+    "i": "ignore_case",
+    "l": "list_files",
+    "c": "count",
+    "o": "only_matching",
+    "n": "line_number"
+}
+LONG_FLAGS = {
+    "--ignore-case": "ignore_case",
+    "--files-with-matches": "list_files",
+    "--count": "count",
+    "--only-matching": "only_matching",
+    "--line-number": "line_number"
+}
+CONTEXT_FLAGS = {
+    "A": ("after",),
+    "B": ("before",),
+    "C": ("before", "after")
+}
+LONG_CONTEXT_FLAGS = {
+    "--after-context": ("after",),
+    "--before-context": ("before",),
+    "--context": ("before", "after")
+}
+# Flags implied by the way extensions are grepped anyway
+IGNORED_FLAGS = ("-E", "--extended-regexp", "-r", "--recursive", "-H", "--with-filename")
+
+POSIX_CLASSES = {
+    "[:alnum:]": "a-zA-Z0-9",
+    "[:alpha:]": "a-zA-Z",
+    "[:blank:]": " \\t",
+    "[:cntrl:]": "\\x00-\\x1f\\x7f",
+    "[:digit:]": "0-9",
+    "[:graph:]": "\\x21-\\x7e",
+    "[:lower:]": "a-z",
+    "[:print:]": "\\x20-\\x7e",
+    "[:punct:]": "!-/:-@\\[-`{-~",
+    "[:space:]": " \\t\\n\\r\\f\\v",
+    "[:upper:]": "A-Z",
+    "[:xdigit:]": "0-9A-Fa-f"
+}
+
+# Escapes that mean the same in GNU extended regexps and Python
+GNU_ESCAPES = "<>bBwWsS"
+
+
+def check_ere(regexp, longest_match=False):
+    """
+    Raises ValueError for extended regexp syntax that has another meaning in
+    Python. With |longest_match|, also for alternatives and quantified groups,
+    where POSIX matches the longest text but Python the first alternative.
+    """
+    n = 0
+    while n < len(regexp):
+        char, following = regexp[n], regexp[n + 1:n + 2]
+        if char == "\\":
+            if following.isalnum() and following not in GNU_ESCAPES:
+                raise ValueError("Unsupported escape `\\%s`" % following)
+            n += 2
+            continue
+        if char == "[":
+            n = skip_bracket_expression(regexp, n)
+            continue
+        if char == "(" and following == "?":
+            raise ValueError("Unsupported group `(?`")
+        if char in "*+?}" and following in ("?", "+"):
+            raise ValueError("Unsupported quantifier `%s%s`" % (char, following))
+        if longest_match and (char == "|" or char == ")" and following in ("*", "+", "?", "{")):
+            raise ValueError("Python doesn't match the longest alternative")
+        n += 1
+
+
+def skip_bracket_expression(regexp, start):
+    """Returns the index after the bracket expression at |start|, where backslashes are literal in POSIX"""
+    n = start + 1
+    if regexp[n:n + 1] == "^":
+        n += 1
+    if regexp[n:n + 1] == "]":
+        n += 1
+    while n < len(regexp) and regexp[n] != "]":
+        if regexp[n] == "\\":
+            raise ValueError("Unsupported backslash in bracket expression")
+        if regexp[n:n + 2] == "[:":
+            end = regexp.find(":]", n + 2)
+            if end < 0:
+                raise ValueError("Unterminated character class")
+            n = end + 2
+            continue
+        if regexp[n:n + 2] in ("[.", "[="):
+            raise ValueError("Unsupported collating element")
+        n += 1
+    return n + 1
+
+
+def translate_ere(regexp):
+    """Translates the POSIX classes and GNU word anchors of an extended regexp to Python syntax"""
+    for posix_class, python_class in POSIX_CLASSES.items():
+        regexp = regexp.replace(posix_class, python_class)
+    return regexp.replace("\\<", "\\b").replace("\\>", "\\b")
+
+
+def parse_grep_args(grep_args):
+    """
+    Returns keyword arguments for ZipGrep from `grep` command line flags.
+    Raises ValueError for flags that aren't supported.
+    """
+    options = {}
+    args = list(grep_args or [])
+    while len(args) > 0:
+        arg = args.pop(0)
+        if arg in IGNORED_FLAGS:
+            continue
+        elif arg in LONG_FLAGS:
+            options[LONG_FLAGS[arg]] = True
+        elif arg.split("=")[0] in LONG_CONTEXT_FLAGS and "=" in arg:
+            flag, value = arg.split("=", 1)
+            for option in LONG_CONTEXT_FLAGS[flag]:
+                options[option] = int(value)
+        elif arg.startswith("-") and not arg.startswith("--") and len(arg) > 1:
+            flags = arg[1:]
+            while len(flags) > 0:
+                flag, flags = flags[0], flags[1:]
+                if flag in SHORT_FLAGS:
+                    options[SHORT_FLAGS[flag]] = True
+                elif flag in CONTEXT_FLAGS:
+                    if len(flags) == 0:
+                        if len(args) == 0:
+                            raise ValueError("Missing context length for `-%s`" % flag)
+                        flags = args.pop(0)
+                    for option in CONTEXT_FLAGS[flag]:
+                        options[option] = int(flags)
+                    flags = ""
+                elif flag == "E" or flag == "r" or flag == "H":
+                    continue
+                else:
+                    raise ValueError("Unsupported grep flag `-%s`" % flag)
+        else:
+            raise ValueError("Unsupported grep argument `%s`" % arg)
+    return options
+
+
+def split_lines(text):
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return lines
+
+
+class ZipGrep(object):
+    """
+    Greps the members of a zip file in memory, with the output format of
+    `grep -E -r` over the unzipped files. Supports the flags `-i`, `-l`,
+    `-c`, `-o`, `-n` and the context flags `-A`, `-B` and `-C`.
+
+    Like GNU grep, members with NUL bytes or invalid UTF-8 are binary,
+    and only reported as `<file>: Binary file matches`. Patterns are
+    rejected where Python's first-match semantics would change the output.
+    """
+
+    def __init__(self, regexp, ignore_case=False, list_files=False, count=False, only_matching=False,
+                 line_number=False, before=None, after=None, color=False):
+        """Raises ValueError for patterns that Python would match differently and re.error for invalid ones"""
+        check_ere(regexp, longest_match=only_matching or color)
+        flags = re.IGNORECASE if ignore_case else 0
+        self.__pattern = re.compile(translate_ere(regexp), flags)
+        # Lines can only match if the whole text does
+        self.__prefilter = re.compile(self.__pattern.pattern, flags | re.MULTILINE)
+        self.__list_files = list_files
+        self.__count = count
+        self.__only_matching = only_matching
+        self.__line_number = line_number
+        # Like grep, any context flag separates groups of lines with `--`, even `-A 0`
+        self.__context = before is not None or after is not None
+        self.__before = before or 0
+        self.__after = after or 0
+        self.__color = color
+
+    @classmethod
+    def from_args(cls, regexp, grep_args=None, color=False):
+        """Raises ValueError for unsupported flags and re.error for invalid patterns"""
+        return cls(regexp, color=color, **parse_grep_args(grep_args))
+
+    def __paint(self, text, color):
+        if not self.__color:
+            return text
+        return color + text + COLOR_END
+
+    def __prefix(self, file_name, separator, line_number=None):
+        prefix = self.__paint(file_name, COLOR_FILE) + self.__paint(separator, COLOR_SEPARATOR)
+        if line_number is not None:
+            prefix += self.__paint(str(line_number), COLOR_LINE_NUMBER) + self.__paint(separator, COLOR_SEPARATOR)
+        return prefix
+
+    def __highlight(self, line):
+        if not self.__color:
+            return line
+        return self.__pattern.sub(lambda m: self.__paint(m.group(0), COLOR_MATCH) if len(m.group(0)) > 0 else "",
+                                  line)
+
+    def grep_zip(self, zip_file, prefix):
+        """Returns the output lines for all members of an open ZipFile, with paths starting with |prefix|"""
+        results = []
+        for info in zip_file.infolist():
+            if info.is_dir():
+                continue
+            file_name = "%s/%s" % (prefix, info.filename.lstrip("/"))
+            lines, grouped = self.__grep_member(zip_file.read(info), file_name)
+            if grouped and len(results) > 0 and len(lines) > 0:
+                results.append(self.__paint("--", COLOR_SEPARATOR))
+            results += lines
+        return results
+
+    def grep_data(self, data, file_name):
+        """Returns the output lines for the content of a single file"""
+        return self.__grep_member(data, file_name)[0]
+
+    def __grep_member(self, data, file_name):
+        """Returns the output lines for a file, and whether they are groups to be separated from other files"""
+        binary = b"\0" in data
+        try:
+            text = data.decode("utf-8")
+        except UnicodeDecodeError:
+            binary = True
+            text = data.decode("utf-8", errors="replace")
+        if self.__count:
+            count = 0
+            if self.__prefilter.search(text) is not None:
+                count = sum(1 for line in split_lines(text) if self.__pattern.search(line) is not None)
+            return [self.__prefix(file_name, ":") + str(count)], False
+        if self.__prefilter.search(text) is None:
+            return [], False
+        lines = split_lines(text)
+        matching = [n for n, line in enumerate(lines) if self.__pattern.search(line) is not None]
+        if len(matching) == 0:
+            return [], False
+        if self.__list_files:
+            return [self.__paint(file_name, COLOR_FILE)], False
+        if binary:
+            return ["%s: Binary file matches" % file_name], self.__context
+        return self.__context_lines(lines, matching, file_name), self.__context
+
+    def __context_lines(self, lines, matching, file_name):
+        results = []
+        matching_set = set(matching)
+        printed_until = -1
+        for n in matching:
+            start = max(n - self.__before, printed_until + 1)
+            if self.__context and printed_until >= 0 and start > printed_until + 1:
+                results.append(self.__paint("--", COLOR_SEPARATOR))
+            for m in range(start, min(n + self.__after, len(lines) - 1) + 1):
+                line_number = m + 1 if self.__line_number else None
+                if m not in matching_set:
+                    # Only matching parts are printed with `-o`, but context lines still join groups
+                    if not self.__only_matching:
+                        results.append((self.__prefix(file_name, "-", line_number) + lines[m]).rstrip("\r"))
+                elif self.__only_matching:
+                    results += [self.__prefix(file_name, ":", line_number) + self.__paint(match.group(0), COLOR_MATCH)
+                                for match in self.__pattern.finditer(lines[m]) if len(match.group(0)) > 0]
+                else:
+                    results.append((self.__prefix(file_name, ":", line_number) + self.__highlight(lines[m]))
+                                   .rstrip("\r"))
+                printed_until = m
+        return results
@@ -0,0 +1,135 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import zipfile
+
+from . import metadata as md
+
+
+logger = logging.getLogger(__name__)
+
+# Number of threads reading zip central directories while updating
+READ_THREADS = 16
+
+
+def get_zip_index_file(args):
+    return os.path.join(args.workdir, "webext_members.sqlite")
+
+
+def read_members(path):
+    """Returns (name, compressed size, size, CRC32, compression method) of the files in a zip, or None"""
+    global logger
+    try:
+        with zipfile.ZipFile(path) as z:
+            return [(info.filename, info.compress_size, info.file_size, info.CRC, info.compress_type)
+                    for info in z.infolist() if not info.is_dir()]
+    except (OSError, zipfile.BadZipFile) as err:
+        logger.warning("Can't read members of `%s`: %s" % (path, err))
+        return None
+
+
+def glob_to_sqlite(glob_pattern):
+    """Translates an fnmatch pattern to SQLite GLOB syntax, where negated sets are `[^...]`"""
+    return glob_pattern.replace("[!", "[^")
+
+
+class ZipIndex(object):
+    """
+    Central directories of the extension files in the file store, with
+    every member's name, sizes, CRC32 and compression method by extension
+    hash, so file names and sizes can be queried across the whole cache
+    without opening any zip.
+
+    Updated incrementally from the file store inventory. Zips that can't
+    be read are remembered as broken rather than retried on every update.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS archives (
+            hash TEXT PRIMARY KEY,
+            broken INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS members (
+            hash TEXT NOT NULL,
+            name TEXT NOT NULL,
+            compressed_size INTEGER,
+            file_size INTEGER,
+            crc INTEGER,
+            compress_type INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS members_hash ON members (hash);
+        CREATE INDEX IF NOT EXISTS members_file_size ON members (file_size);
+    """
+
+    def __init__(self, filename=":memory:"):
+        self.__sqlite = md.SQLiteConnection(filename)
+        self.__connection.executescript(self.SCHEMA)
+
+    @property
+    def __connection(self):
+        return self.__sqlite.connection
+
+    def add(self, ext_hash, path):
+        """Indexes the members of the zip at |path| under |ext_hash|"""
+        self.__insert(ext_hash, read_members(path))
+        self.__connection.commit()
+
+    def __insert(self, ext_hash, members):
+        db = self.__connection
+        db.execute("DELETE FROM members WHERE hash = ?", (ext_hash,))
+        db.execute("INSERT OR REPLACE INTO archives (hash, broken) VALUES (?, ?)", (ext_hash, members is None))
+        if members is not None:
+            db.executemany("INSERT INTO members (hash, name, compressed_size, file_size, crc, compress_type) "
+                           "VALUES (?, ?, ?, ?, ?, ?)", ((ext_hash,) + member for member in members))
+
+    def remove(self, ext_hash):
+        self.__connection.execute("DELETE FROM members WHERE hash = ?", (ext_hash,))
+        self.__connection.execute("DELETE FROM archives WHERE hash = ?", (ext_hash,))
+
+    def update(self, inventory):
+        """Indexes the files in a FileInventory that are new and drops the ones that are gone"""
+        global logger
+        indexed = set(self)
+        removed = [ext_hash for ext_hash in indexed if ext_hash not in inventory]
+        added = [ext_hash for ext_hash in inventory if ext_hash not in indexed]
+        logger.debug("Indexing zip members of %d new files, dropping %d" % (len(added), len(removed)))
+        for ext_hash in removed:
+            self.remove(ext_hash)
+        with ThreadPoolExecutor(max_workers=READ_THREADS) as executor:
+            for ext_hash, members in zip(added, executor.map(lambda h: read_members(inventory.path(h)), added)):
+                self.__insert(ext_hash, members)
+        self.__connection.commit()
+        return len(added), len(removed)
+
+    def find(self, glob_pattern, min_size=None, largest_first=False):
+        """Yields (hash, name, size) of the members matching |glob_pattern| in any extension file"""
+        query = "SELECT hash, name, file_size FROM members WHERE name GLOB ?"
+        params = [glob_to_sqlite(glob_pattern)]
+        if min_size is not None:
+            query += " AND file_size >= ?"
+            params.append(min_size)
+        if largest_first:
+            query += " ORDER BY file_size DESC"
+        for row in self.__connection.execute(query, params):
+            yield row
+
+    def search(self, glob_pattern):
+        """Returns the hashes of the extension files with members matching |glob_pattern|"""
+        return [row[0] for row in self.__connection.execute("SELECT DISTINCT hash FROM members WHERE name GLOB ?",
+                                                            (glob_to_sqlite(glob_pattern),))]
+
+    def close(self):
+        self.__connection.close()
+
+    def __contains__(self, ext_hash):
+        return self.__connection.execute("SELECT 1 FROM archives WHERE hash = ?", (ext_hash,)).fetchone() is not None
+
+    def __iter__(self):
+        return (row[0] for row in self.__connection.execute("SELECT hash FROM archives"))
+
+    def __len__(self):
+        return self.__connection.execute("SELECT COUNT(*) FROM archives").fetchone()[0]